@@ -0,0 +1,1513 @@
+"""Бенчмарки бота напоминаний.
+
+Запуск: python benchmark.py [сценарий ...]
+Без аргументов выполняются все сценарии.
+
+Нагрузочный прогон для проверки перед выкладкой:
+python benchmark.py load --json results.json --compare previous.json
+"""
+import argparse
+import asyncio
+import contextlib
+import gc
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.request
+from datetime import datetime, timedelta
+
+import discord
+from discord.ext import commands
+
+import main
+from fake_discord import FakeDiscord, FakeDiscordAPI, MEMBER_ID_BASE, USER_ID_BASE, percentile
+
+main.HEALTH_PORT = 0  # Веб-сервер проверок на свободном порту, а не на 8080
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+WHEEL_SIZES = [1_000_000, 5_000_000]
+SQLITE_SIZES = [10_000, 100_000, 1_000_000]
+
+# ============================================================================
+# ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
+# ============================================================================
+
+def make_reminder(now, seconds_ahead, user_id):
+    """Синтетическое напоминание в формате users_data.json"""
+    return {
+        'message': 'Время оплатить дом!',
+        'end_time': (now + timedelta(seconds=seconds_ahead)).isoformat(),
+        'user_id': user_id,
+        'category': '⏰ Таймер - 🏠 Оплата дома'
+    }
+
+def legacy_scan_tick(reminders, now):
+    """Прежний тик check_reminders: полный проход с разбором end_time"""
+    due = []
+    for reminder_id, reminder_data in reminders.items():
+        if 'end_time' in reminder_data:
+            end_time = datetime.fromisoformat(reminder_data['end_time'])
+            if now >= end_time:
+                due.append(reminder_id)
+    return due
+
+def best_of(fn, repeat=5):
+    """Минимальное время выполнения fn в секундах"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+# ============================================================================
+# СЦЕНАРИИ
+# ============================================================================
+
+def bench_scheduler():
+    """Стоимость тика: полный скан против кучи при одном наступившем напоминании"""
+    print("📊 Тик планировщика (одно наступившее напоминание)")
+    print(f"{'напоминаний':>12} {'скан, мс':>12} {'куча, мкс':>12}")
+    rng = random.Random(1)
+    now = datetime.now()
+
+    for size in SIZES:
+        data = {
+            f"{i}_{i}": make_reminder(now, rng.randint(60, 999 * 86400), i)
+            for i in range(size)
+        }
+        scan = best_of(lambda: legacy_scan_tick(data, now), repeat=3)
+
+        scheduler = main.HeapScheduler()
+        for reminder_id, reminder_data in data.items():
+            scheduler.insert(reminder_id, main.Reminder.from_dict(reminder_data).end_ts)
+
+        def heap_tick():
+            scheduler.insert('due', now.timestamp() - 1)
+            scheduler.pop_due(now.timestamp())
+            scheduler.next_deadline()
+
+        heap = best_of(heap_tick, repeat=1000)
+        print(f"{size:>12} {scan * 1e3:>12.2f} {heap * 1e6:>12.2f}")
+
+def simulate_jitter(fire_times, deadlines):
+    """Средняя и максимальная задержка срабатывания в секундах"""
+    lateness = [fire - deadline for fire, deadline in zip(fire_times, deadlines)]
+    return sum(lateness) / len(lateness), max(lateness)
+
+def bench_wheel():
+    """Колесо таймеров против кучи и прежнего скана: память, вставка, джиттер"""
+    print("📊 Движки планировщика (сроки равномерно на 999 дней вперёд)")
+    print(f"{'напоминаний':>12} {'движок':>8} {'МБ':>8} {'вставок/с':>12} {'джиттер ср/макс, с':>20}")
+    rng = random.Random(2)
+    start = int(time.time())
+
+    for size in WHEEL_SIZES:
+        deadlines = [start + rng.randint(1, 999 * 86400) for _ in range(size)]
+        ids = [str(i) for i in range(size)]
+
+        for name, factory in (('heap', main.HeapScheduler), ('wheel', main.TimingWheelScheduler)):
+            # Память и скорость меряются отдельно: tracemalloc сильно замедляет вставку
+            tracemalloc.start()
+            scheduler = factory()
+            for reminder_id, deadline in zip(ids, deadlines):
+                scheduler.insert(reminder_id, deadline)
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            del scheduler
+
+            scheduler = factory()
+            began = time.perf_counter()
+            for reminder_id, deadline in zip(ids, deadlines):
+                scheduler.insert(reminder_id, deadline)
+            elapsed = time.perf_counter() - began
+
+            # Джиттер: 10 000 напоминаний в ближайший час, каждое пробуждение
+            # происходит во время, которое вернул next_deadline
+            origin = time.time()
+            probe = {f"p{i}": origin + rng.uniform(1, 3600) for i in range(10_000)}
+            for reminder_id, deadline in probe.items():
+                scheduler.insert(reminder_id, deadline)
+            fired = {}
+            now = origin
+            while len(fired) < len(probe):
+                now = max(now + 0.001, scheduler.next_deadline())
+                for reminder_id in scheduler.pop_due(now):
+                    if reminder_id in probe:
+                        fired[reminder_id] = now
+            avg, worst = simulate_jitter(
+                [fired[k] for k in probe], [probe[k] for k in probe]
+            )
+            print(f"{size:>12} {name:>8} {memory / 2**20:>8.1f} {size / elapsed:>12.0f} "
+                  f"{avg:>9.3f} / {worst:<8.3f}")
+            del scheduler
+
+        # Прежний скан: отдельного индекса нет, срабатывание раз в 10 секунд
+        tick_size = min(size, 1_000_000)
+        data = {
+            ids[i]: {'end_time': datetime.fromtimestamp(deadlines[i]).isoformat()}
+            for i in range(tick_size)
+        }
+        tick = best_of(lambda data=data: legacy_scan_tick(data, datetime.now()), repeat=1)
+        del data
+        print(f"{size:>12} {'scan':>8} {'—':>8} {'—':>12} {'~5.000 / 10.000':>20}"
+              f"  (тик {tick * size / tick_size:.2f} с каждые 10 с)")
+
+FIXED_SUBCATEGORIES = [
+    ('таймер', 'оплата_дома', '⏰ Таймер - 🏠 Оплата дома', 'Время оплатить дом!'),
+    ('фарм', 'билетики', '🌾 Фарм - 🎫 Билетики', 'Проверить билетики!'),
+    ('задания_клуба', 'реднеки', '🏁 Задания клуба - 🤠 Реднеки', 'Задание Реднеки!'),
+    ('таймер', 'настраиваемый', '⏰ Таймер - 🔄 Настраиваемый таймер', None),
+]
+
+def make_users_file(size, with_keys):
+    """Текст users_data.json со смесью fixed и настраиваемых напоминаний"""
+    rng = random.Random(3)
+    now = datetime.now()
+    data = {}
+    for i in range(size):
+        category_key, sub_key, label, message = rng.choice(FIXED_SUBCATEGORIES)
+        user_id = 100_000_000_000_000_000 + rng.randint(0, size // 5)
+        reminder = make_reminder(now, rng.randint(60, 999 * 86400), user_id)
+        reminder['category'] = label
+        reminder['message'] = message or f"Своё напоминание №{i}"
+        if with_keys:
+            reminder['category_key'] = category_key
+            reminder['sub_key'] = sub_key
+        data[f"{user_id}_{now.timestamp() + i}"] = reminder
+    return json.dumps(data, ensure_ascii=False)
+
+def traced_bytes(build):
+    """Объём памяти, удерживаемой результатом build()"""
+    tracemalloc.start()
+    result = build()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return memory, result
+
+def bench_records():
+    """Байт на напоминание: словари с ISO-строками против записей Reminder"""
+    print("📊 Память хранилища reminders")
+    print(f"{'напоминаний':>12} {'dict, Б/шт':>12} {'Reminder, Б/шт':>16}")
+    for size in (100_000, 1_000_000):
+        text = make_users_file(size, with_keys=False)
+        before, result = traced_bytes(lambda text=text: json.loads(text))
+        del result, text
+
+        text = make_users_file(size, with_keys=True)
+        after, result = traced_bytes(lambda text=text: {
+            reminder_id: main.Reminder.from_dict(reminder_data)
+            for reminder_id, reminder_data in json.loads(text).items()
+        })
+        del result, text
+        print(f"{size:>12} {before / size:>12.0f} {after / size:>16.0f}")
+
+def fill_reminders(size, users):
+    """Заполняет глобальное хранилище main синтетическими напоминаниями"""
+    rng = random.Random(4)
+    main.reminders.clear()
+    main.rebuild_indexes()
+    start = int(time.time())
+    for i in range(size):
+        main.add_reminder(
+            f"r{i}",
+            main.Reminder(rng.randrange(users), start + rng.randint(60, 999 * 86400),
+                          'таймер', 'оплата_дома', 'Время оплатить дом!')
+        )
+
+def bench_listing():
+    """/моинапоминания: скан всего хранилища против индекса пользователя"""
+    print("📊 Список напоминаний пользователя (в среднем 10 у пользователя)")
+    print(f"{'напоминаний':>12} {'скан, мс':>12} {'индекс, мкс':>14}")
+    for size in SIZES:
+        fill_reminders(size, users=max(1, size // 10))
+        user_id = 0
+
+        def scan():
+            return {k: v for k, v in main.reminders.items() if v.user_id == user_id}
+
+        def indexed():
+            main.build_reminders_page(main.get_user_reminders(user_id), 0)
+
+        print(f"{size:>12} {best_of(scan, repeat=3) * 1e3:>12.2f} "
+              f"{best_of(indexed, repeat=200) * 1e6:>14.1f}")
+    main.reminders.clear()
+    main.rebuild_indexes()
+
+def use_temp_files(directory):
+    """Перенаправляет файлы данных бота во временный каталог"""
+    main.USERS_FILE = os.path.join(directory, 'users_data.json')
+    main.CATEGORIES_FILE = os.path.join(directory, 'categories.json')
+    main.JOURNAL_FILE = os.path.join(directory, 'data.journal')
+    main.DATABASE_FILE = os.path.join(directory, 'reminders.db')
+    main.COMMAND_TREE_HASH_FILE = os.path.join(directory, 'command_tree.hash')
+    main.DEAD_LETTERS_FILE = os.path.join(directory, 'dead_letters.jsonl')
+
+def data_size():
+    """Суммарный размер файлов данных в байтах"""
+    return sum(
+        os.path.getsize(path)
+        for path in (main.USERS_FILE, main.CATEGORIES_FILE, main.JOURNAL_FILE)
+        if os.path.exists(path)
+    )
+
+def bench_persistence():
+    """Задержка в обработчике, стоимость записи и объём записи на изменение"""
+    print("📊 Сохранение новых напоминаний")
+    print(f"{'напоминаний':>12} {'режим':>10} {'обраб., мкс':>12} {'запись, мс':>11} "
+          f"{'пакет 100, мс':>14} {'байт/изм.':>10} {'усиление':>9}")
+    main.categories_data.clear()
+    record = len(json.dumps(
+        main.Reminder(1, 0, 'таймер', 'оплата_дома', 'Время оплатить дом!').to_dict(),
+        ensure_ascii=False
+    ).encode())
+
+    def new_reminder(reminder_id):
+        reminder = main.Reminder(1, int(time.time()) + 3600, 'таймер', 'оплата_дома',
+                                 'Время оплатить дом!')
+        main.add_reminder(reminder_id, reminder)
+        return reminder
+
+    with tempfile.TemporaryDirectory() as directory:
+        use_temp_files(directory)
+        main.init_default_categories()
+        main.persistence_writer.flush_sync()
+        for size in (1_000, 10_000, 100_000):
+            fill_reminders(size, users=max(1, size // 10))
+            for mode in ('snapshot', 'journal'):
+                main.PERSISTENCE_MODE = mode
+                main.compact_journal()
+                submit, flush = [], []
+                written = 0
+                for i in range(10):
+                    reminder_id = f"bench_{mode}_{i}"
+                    reminder = new_reminder(reminder_id)
+                    before = data_size() if mode == 'journal' else 0
+                    began = time.perf_counter()
+                    main.record_reminder_added(reminder_id, reminder)
+                    submit.append(time.perf_counter() - began)
+                    began = time.perf_counter()
+                    main.persistence_writer.flush_sync()
+                    flush.append(time.perf_counter() - began)
+                    written += data_size() - before
+
+                # Сто изменений за одно окно записываются одним заходом
+                for i in range(100):
+                    reminder_id = f"batch_{mode}_{i}"
+                    main.record_reminder_added(reminder_id, new_reminder(reminder_id))
+                began = time.perf_counter()
+                main.persistence_writer.flush_sync()
+                batch = time.perf_counter() - began
+
+                per_write = written / len(flush)
+                print(f"{size:>12} {mode:>10} {sorted(submit)[len(submit) // 2] * 1e6:>12.1f} "
+                      f"{sorted(flush)[len(flush) // 2] * 1e3:>11.3f} {batch * 1e3:>14.3f} "
+                      f"{per_write:>10.0f} {per_write / record:>8.0f}x")
+        main.compact_journal()
+    main.PERSISTENCE_MODE = 'snapshot'
+    main.reminders.clear()
+    main.rebuild_indexes()
+
+def rss_kb(field='VmRSS', pid='self'):
+    """Резидентная память процесса в КБ (VmHWM — пиковая)"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # ru_maxrss наследуется от родителя при fork, поэтому только как запасной вариант
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def load_child(mode, directory):
+    """Замер запуска в отдельном процессе: время load_data и пиковый RSS"""
+    use_temp_files(directory)
+    main.PERSISTENCE_MODE = mode
+    baseline = rss_kb()
+    began = time.perf_counter()
+    main.load_data()
+    elapsed = time.perf_counter() - began
+    print(json.dumps({'seconds': elapsed, 'rss_kb': rss_kb() - baseline, 'in_memory': len(main.reminders)}))
+
+def run_load_child(mode, directory):
+    output = subprocess.run(
+        [sys.executable, __file__, '--load-child', mode, directory],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def median_ms(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - began)
+    return sorted(samples)[len(samples) // 2] * 1e3
+
+def bench_sqlite():
+    """JSON-снимок против SQLite: запуск, память, задержки операций"""
+    print("📊 Хранилище: snapshot (JSON) против sqlite")
+    print(f"{'напоминаний':>12} {'режим':>9} {'запуск, с':>10} {'RSS, МБ':>9} {'в памяти':>10} "
+          f"{'добавл., мс':>12} {'удал., мс':>10} {'список, мс':>11} {'срок, мс':>9}")
+    for size in SQLITE_SIZES:
+        with tempfile.TemporaryDirectory() as directory:
+            use_temp_files(directory)
+            main.reminders.clear()
+            main.categories_data.clear()
+            main.PERSISTENCE_MODE = 'snapshot'
+            main.init_default_categories()
+            main.persistence_writer.flush_sync()
+            with open(main.USERS_FILE, 'w', encoding='utf-8') as f:
+                f.write(make_users_file(size, with_keys=True))
+            main.SqliteStore(main.DATABASE_FILE).migrate_from_json(main.USERS_FILE, main.CATEGORIES_FILE)
+
+            for mode in ('snapshot', 'sqlite'):
+                startup = run_load_child(mode, directory)
+                main.PERSISTENCE_MODE = mode
+                main.sqlite_store = None
+                main.memory_horizon = float('inf')
+                main.load_data()
+                user_id = next(iter(main.reminders.values())).user_id if main.reminders else 0
+                reminder = main.Reminder(user_id, int(time.time()) + 3600,
+                                         'таймер', 'оплата_дома', 'Время оплатить дом!')
+                repeat = 3 if mode == 'snapshot' and size >= 100_000 else 20
+
+                def add():
+                    main.add_reminder('bench', reminder)
+                    main.record_reminder_added('bench', reminder)
+                    main.persistence_writer.flush_sync()
+
+                def delete():
+                    main.remove_reminder('bench')
+                    main.record_reminders_removed(['bench'])
+                    main.persistence_writer.flush_sync()
+
+                def due():
+                    main.reminder_scheduler.next_deadline()
+                    main.reminder_scheduler.pop_due(time.time() - 86400)
+
+                add_samples, delete_samples = [], []
+                for _ in range(repeat):
+                    began = time.perf_counter()
+                    add()
+                    add_samples.append(time.perf_counter() - began)
+                    began = time.perf_counter()
+                    delete()
+                    delete_samples.append(time.perf_counter() - began)
+                add_ms = sorted(add_samples)[repeat // 2] * 1e3
+                delete_ms = sorted(delete_samples)[repeat // 2] * 1e3
+                if mode == 'sqlite':
+                    # Этот запрос бот выполняет в потоке, см. local_user_reminders
+                    listing_ms = median_ms(lambda: main.sqlite_store.user_reminders(user_id, time.time()), 20)
+                else:
+                    listing_ms = median_ms(lambda: main.get_user_reminders(user_id), 20)
+                due_ms = median_ms(due, 20)
+                print(f"{size:>12} {mode:>9} {startup['seconds']:>10.2f} "
+                      f"{startup['rss_kb'] / 1024:>9.1f} {startup['in_memory']:>10} "
+                      f"{add_ms:>12.3f} {delete_ms:>10.3f} {listing_ms:>11.3f} {due_ms:>9.3f}")
+            main.sqlite_store = None
+            main.memory_horizon = float('inf')
+    main.PERSISTENCE_MODE = 'snapshot'
+    main.reminders.clear()
+    main.rebuild_indexes()
+
+# ============================================================================
+# ДОСТАВКА ЧЕРЕЗ ЛОКАЛЬНУЮ ЗАМЕНУ DISCORD
+# ============================================================================
+
+def fresh_bot():
+    """Новый бот со своими фоновыми службами: каждый asyncio.run — отдельный event loop"""
+    main.bot = main.ReminderBot(**main.GATEWAY_OPTIONS)
+    main.persistence_writer = main.PersistenceWriter(main.PERSISTENCE_FLUSH_SECONDS)
+    main.delivery_pipeline = main.DeliveryPipeline(main.DELIVERY_WORKERS, main.DELIVERY_GLOBAL_RATE)
+    # Событие пробуждения планировщика привязано к event loop, в котором его ждал check_reminders
+    main.reminder_scheduler = type(main.reminder_scheduler)()
+
+async def run_delivery_bench(size, workers, users):
+    """Всплеск из size напоминаний с одним сроком; workers=0 — прежняя отправка по одному"""
+    api = FakeDiscordAPI()
+    discord.http.Route.BASE = await api.start()
+    await main.bot.login('fake-token')
+    main.dm_channel_cache = main.DMChannelCache(main.DM_CACHE_SIZE, main.DM_CACHE_TTL)
+    due = int(time.time())
+    batch = [
+        (f"r{i}", main.Reminder(10_000 + i % users, due, 'таймер', 'оплата_дома', 'Время оплатить дом!'))
+        for i in range(size)
+    ]
+    requests_before = api.requests
+
+    began = time.time()
+    if workers == 0:
+        for reminder_id, reminder in batch:
+            try:
+                user = await main.bot.fetch_user(reminder.user_id)
+                await user.send(main.format_reminder_message(reminder))
+            except Exception as e:
+                print(f"❌ {e}")
+    else:
+        pipeline = main.DeliveryPipeline(workers, api.global_limit * 0.9)
+        pipeline.start()
+        for item in batch:
+            pipeline.submit([item])
+        await pipeline.queue.join()
+        await pipeline.stop()
+    elapsed = time.time() - began
+
+    lateness = [sent - due for sent, _ in api.messages]
+    requests = (api.requests - requests_before - api.rate_limited) / len(api.messages)
+    cache = main.dm_channel_cache
+    await main.bot.close()
+    await api.stop()
+    return {
+        'rate': len(api.messages) / elapsed,
+        'p99': percentile(lateness, 0.99),
+        'rate_limited': api.rate_limited,
+        'requests_per_dm': requests,
+        'cache': f"{cache.gateway_hits + cache.hits}/{cache.misses}",
+    }
+
+RETRY_REMINDERS = 2_000
+RETRY_FAILURE_RATES = [0.05, 0.3]  # доля ответов 503 на отправку
+RETRY_CLOSED_DMS = 0.02  # доля пользователей с закрытыми ЛС
+
+async def run_retry_bench(directory, failure_rate, max_attempts):
+    """Всплеск при ответах 503 и закрытых ЛС; повторы снимает с планировщика настоящий check_reminders"""
+    api = FakeDiscordAPI(global_limit=10**6)
+    api.failure_rate = failure_rate
+    api.closed_dms = {str(10_000 + i) for i in range(int(RETRY_REMINDERS * RETRY_CLOSED_DMS))}
+    discord.http.Route.BASE = await api.start()
+    main.delivery_pipeline = pipeline = main.DeliveryPipeline(64, 10**6)
+    main.dead_letters = main.DeadLetterStore(os.path.join(directory, f"dead_{failure_rate}_{max_attempts}.jsonl"), 100)
+    await main.bot.login('fake-token')  # setup_hook запускает отправителей и check_reminders
+    main.dm_channel_cache = main.DMChannelCache(main.DM_CACHE_SIZE, main.DM_CACHE_TTL)
+    main.DELIVERY_MAX_ATTEMPTS = max_attempts
+    main.DELIVERY_RETRY_BASE, main.DELIVERY_RETRY_MAX = 0.1, 1  # секунды вместо минут
+    retries_before = main.DELIVERY_RETRIES.values[None]
+    after_retry_before = main.DELIVERED_AFTER_RETRY.values[None]
+    now = time.time()
+    for i in range(RETRY_REMINDERS):
+        main.add_reminder(f"r{i}", main.Reminder(10_000 + i, now, 'таймер', 'оплата_дома', 'Время оплатить дом!'))
+
+    began = time.time()
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        while main.reminders or pipeline.queue.qsize() or pipeline._pending_deadlines:
+            await asyncio.sleep(0.05)
+        elapsed = time.time() - began
+        await main.bot.close()
+    await api.stop()
+    return {
+        'delivered': pipeline.delivered,
+        'after_retry': main.DELIVERED_AFTER_RETRY.values[None] - after_retry_before,
+        'retries': main.DELIVERY_RETRIES.values[None] - retries_before,
+        'dead': main.dead_letters.total,
+        'seconds': elapsed,
+    }
+
+def bench_retries():
+    """Доставка при временных ошибках API: без повторов против повторов с экспоненциальной задержкой"""
+    print(f"📊 Повторы доставки: {RETRY_REMINDERS} напоминаний, {RETRY_CLOSED_DMS:.0%} пользователей с закрытыми ЛС")
+    print(f"{'503, доля':>10} {'попыток':>8} {'доставлено':>11} {'с повтора':>10} {'повторов':>9} "
+          f"{'недоставлено':>13} {'за, с':>7}")
+    with tempfile.TemporaryDirectory() as directory:
+        use_temp_files(directory)
+        for failure_rate in RETRY_FAILURE_RATES:
+            for max_attempts in (1, 5):
+                fresh_bot()
+                result = asyncio.run(run_retry_bench(directory, failure_rate, max_attempts))
+                print(f"{failure_rate:>10.2f} {max_attempts:>8} {result['delivered']:>11} {result['after_retry']:>10} "
+                      f"{result['retries']:>9} {result['dead']:>13} {result['seconds']:>7.1f}")
+
+def bench_delivery():
+    """Доставка всплеска напоминаний: по одному против очереди с пулом отправителей"""
+    print("📊 Доставка всплеска напоминаний (REST-заглушка: 10 мс на запрос, 1000 запросов/с)")
+    print(f"{'напоминаний':>12} {'польз.':>7} {'отправителей':>13} {'доставок/с':>11} "
+          f"{'p99 опоздание, с':>17} {'429':>6} {'запросов/DM':>12} {'кэш попад./пром.':>17}")
+    with tempfile.TemporaryDirectory() as directory:
+        use_temp_files(directory)
+        for size, users, workers in ((500, 500, 0), (500, 500, 16), (5000, 5000, 16),
+                                     (5000, 5000, 64), (5000, 500, 64)):
+            fresh_bot()
+            result = asyncio.run(run_delivery_bench(size, workers, users))
+            cache = result['cache'] if workers else '—'
+            print(f"{size:>12} {users:>7} {workers or 'по одному':>13} {result['rate']:>11.0f} "
+                  f"{result['p99']:>17.2f} {result['rate_limited']:>6} "
+                  f"{result['requests_per_dm']:>12.2f} {cache:>17}")
+
+async def run_coalesce_bench(users, per_user, window):
+    """Каждый пользователь ставит per_user таймеров в пределах минуты; тики идут раз в секунду"""
+    api = FakeDiscordAPI()
+    discord.http.Route.BASE = await api.start()
+    await main.bot.login('fake-token')
+    main.dm_channel_cache = main.DMChannelCache(main.DM_CACHE_SIZE, main.DM_CACHE_TTL)
+    main.DELIVERY_COALESCE_SECONDS = window
+    rng = random.Random(10)
+    start = int(time.time())
+    main.reminders.clear()
+    main.rebuild_indexes()
+    for user in range(users):
+        for i in range(per_user):
+            main.add_reminder(f"r{user}_{i}", main.Reminder(
+                10_000 + user, start + rng.randint(0, 59), 'таймер', 'оплата_дома', 'Время оплатить дом!'))
+
+    pipeline = main.DeliveryPipeline(64, api.global_limit * 0.9)
+    pipeline.start()
+    # Виртуальное время: тик на каждую секунду минуты без ожидания
+    for second in range(60):
+        now = start + second
+        for batch in main.collect_due_batches(main.reminder_scheduler.pop_due(now), now):
+            pipeline.submit(batch)
+    await pipeline.queue.join()
+    await pipeline.stop()
+    await main.bot.close()
+    await api.stop()
+    return pipeline
+
+def bench_coalesce():
+    """Объединение напоминаний одного пользователя в одно сообщение"""
+    print("📊 Объединение напоминаний (таймеры пользователя разбросаны по минуте)")
+    print(f"{'польз.':>7} {'на польз.':>10} {'окно, с':>8} {'напоминаний':>12} "
+          f"{'сообщений':>10} {'DM на напоминание':>18}")
+    with tempfile.TemporaryDirectory() as directory:
+        use_temp_files(directory)
+        for users, per_user, window in ((500, 5, 0), (500, 5, 10), (500, 5, 60), (50, 40, 60)):
+            fresh_bot()
+            pipeline = asyncio.run(run_coalesce_bench(users, per_user, window))
+            print(f"{users:>7} {per_user:>10} {window:>8} {pipeline.reminders_fired:>12} "
+                  f"{pipeline.dms_sent:>10} {pipeline.dms_per_reminder():>18.2f}")
+    main.DELIVERY_COALESCE_SECONDS = 0
+
+class FakeResponse:
+    """interaction.response без сети, но с тем же учётом View, что в discord.py"""
+    async def send_message(self, *args, view=None, ephemeral=False, **kwargs):
+        self.sent = kwargs
+        if view is not None and not view.is_finished():
+            if ephemeral and view.timeout is None:
+                view.timeout = 15 * 60.0
+            main.bot._connection.store_view(view, None)
+
+    async def send_modal(self, modal):
+        self.modal = modal
+
+class FakeUser:
+    """discord.User без сети: send только запоминает время отправки"""
+    def __init__(self, user_id, sent=None):
+        self.id = user_id
+        self.name = f"user{user_id}"
+        self.roles = []
+        self.dm_channel = None
+        self.sent = sent if sent is not None else []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append((self.id, time.perf_counter()))
+
+class FakeChannel:
+    def __init__(self, user):
+        self.recipient = user
+
+    async def send(self, content=None, **kwargs):
+        await self.recipient.send(content, **kwargs)
+
+class FakeInteraction:
+    def __init__(self, user_id=1):
+        self.user = FakeUser(user_id)
+        self.response = FakeResponse()
+
+def install_fake_client(sent):
+    """Подменяет сетевые методы бота: fetch_user, create_dm и User.send"""
+    async def fetch_user(user_id):
+        return FakeUser(user_id, sent)
+
+    async def create_dm(user):
+        return FakeChannel(FakeUser(user.id, sent))
+
+    main.bot.fetch_user = fetch_user
+    main.bot.create_dm = create_dm
+
+async def run_menu_bench(handlers, repeats):
+    """Процессорное время на одно нажатие, мкс, для каждого обработчика меню"""
+    results = {}
+    for name, handler in handlers:
+        await handler(FakeInteraction())
+        began = time.process_time()
+        for _ in range(repeats):
+            await handler(FakeInteraction())
+        results[name] = (time.process_time() - began) / repeats * 1e6
+    return results
+
+def bench_menus():
+    """Отрисовка меню категорий с кэшем версий и без него"""
+    print("📊 Процессорное время обработчика меню на нажатие")
+    main.categories_data.clear()
+    main.init_default_categories()
+    # Категория побольше: как у сервера, где администраторы завели много таймеров
+    main.categories_data['ивенты'] = {'name': '🎉 Ивенты', 'subcategories': {
+        f"ивент_{i}": {'name': f"🎯 Ивент {i}", 'type': 'fixed', 'time': f"{i}д 0ч 0м",
+                       'message': f"Ивент {i} начинается!"}
+        for i in range(20)
+    }}
+    main.menu_cache.bump()
+    handlers = [
+        ('show_subcategories(таймер)', lambda i: main.show_subcategories(i, 'таймер')),
+        ('show_subcategories(ивенты)', lambda i: main.show_subcategories(i, 'ивенты')),
+        ('show_admin_categories', main.show_admin_categories),
+        ('show_category_management', lambda i: main.show_category_management(i, 'ивенты')),
+        ('show_subcategories_management', lambda i: main.show_subcategories_management(i, 'ивенты')),
+    ]
+    repeats = 2000
+    main.menu_cache.enabled = False
+    without = asyncio.run(run_menu_bench(handlers, repeats))
+    main.menu_cache.enabled = True
+    cached = asyncio.run(run_menu_bench(handlers, repeats))
+    print(f"{'обработчик':>32} {'без кэша, мкс':>14} {'с кэшем, мкс':>13} {'ускорение':>10}")
+    for name, _ in handlers:
+        print(f"{name:>32} {without[name]:>14.1f} {cached[name]:>13.1f} {without[name] / cached[name]:>9.1f}x")
+    print(f"💾 Кэш: попаданий {main.menu_cache.hits}, промахов {main.menu_cache.misses}")
+
+class LegacySubcategoryMenu(discord.ui.View):
+    """Прежнее меню: свой View с таймаутом 180 с на каждое сообщение"""
+    def __init__(self, category_key):
+        super().__init__(timeout=180)
+        for key, subcat in main.categories_data[category_key]['subcategories'].items():
+            self.add_item(discord.ui.Button(label=subcat['name'], custom_id=f"sub_{key}"))
+
+async def legacy_show_subcategories(interaction, category_key):
+    embed, _ = main.render_subcategories(category_key)
+    await interaction.response.send_message(embed=embed, view=LegacySubcategoryMenu(category_key), ephemeral=True)
+
+async def open_menus(show, count):
+    """Открывает count меню и возвращает прирост памяти и число задач event loop"""
+    gc.collect()
+    tracemalloc.start()
+    tasks_before = len(asyncio.all_tasks())
+    for _ in range(count):
+        await show(FakeInteraction(), 'таймер')
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    tasks = len(asyncio.all_tasks()) - tasks_before
+    stored = sum(len(items) for items in main.bot._connection._view_store._views.values())
+    return used, tasks, stored
+
+async def check_menu_dispatch():
+    """Нажатие восстанавливается из одного custom_id, как после перезапуска"""
+    main.bot.add_dynamic_items(main.MenuButton)
+    store = main.bot._connection._view_store
+    button = main.SubcategoryMenu('таймер').children[0]
+    for pattern, factory in store._dynamic_items.items():
+        match = pattern.fullmatch(button.custom_id)
+        if match:
+            restored = await factory.from_custom_id(None, button.item, match)
+            return f"{button.custom_id} -> {restored.action}/{restored.category_key}/{restored.sub_key}"
+    return 'не распознан'
+
+def bench_views():
+    """10 000 открытых меню: View с таймаутом на сообщение против кнопок MenuButton"""
+    print("📊 Открытые меню подкатегорий (10 000 штук)")
+    main.categories_data.clear()
+    main.init_default_categories()
+    print(f"{'режим':>24} {'память, КБ':>11} {'задач':>7} {'View в хранилище':>17}")
+    for name, show in (('View на сообщение', legacy_show_subcategories),
+                       ('постоянные кнопки', main.show_subcategories)):
+        fresh_bot()
+
+        async def run():
+            result = await open_menus(show, 10_000)
+            for task in asyncio.all_tasks() - {asyncio.current_task()}:
+                task.cancel()
+            return result
+
+        used, tasks, stored = asyncio.run(run())
+        print(f"{name:>24} {used / 1024:>11.0f} {tasks:>7} {stored:>17}")
+    print(f"🔁 Разбор custom_id: {asyncio.run(check_menu_dispatch())}")
+
+HEALTH_SECONDS = 10
+SELF_PING_INTERVAL = 0.5  # вместо 4 минут, чтобы за замер набралось 20 пингов
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def external_checker(port, stop):
+    """Внешняя проверка здоровья, как у платформы хостинга, из отдельного потока"""
+    while not stop.is_set():
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=5).read()
+        except OSError:
+            pass
+        stop.wait(0.1)
+
+async def measure_loop_lag(seconds):
+    """Опоздание пробуждений event loop относительно sleep(0.01), мс"""
+    lags = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        began = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lags.append((time.perf_counter() - began - 0.01) * 1e3)
+    return lags
+
+def health_child(mode):
+    """Замер веб-сервера в отдельном процессе: RSS и остановки event loop"""
+    baseline = rss_kb()
+    port = free_port()
+    stop = threading.Event()
+    blocked = [0.0]
+
+    async def run():
+        if mode == 'flask':
+            # Прежняя схема: Flask в потоке и блокирующий requests.get внутри loop
+            import requests
+            from flask import Flask
+            app = Flask('')
+            app.add_url_rule('/health', 'health', lambda: ('ok', 200))
+            app.add_url_rule('/ping', 'ping', lambda: ('pong', 200))
+            threading.Thread(target=lambda: app.run(host='127.0.0.1', port=port), daemon=True).start()
+            await asyncio.sleep(1)
+
+            async def self_ping():
+                while True:
+                    began = time.perf_counter()
+                    try:
+                        requests.get(f"http://127.0.0.1:{port}/ping", timeout=5)
+                    except Exception:
+                        pass
+                    blocked[0] = max(blocked[0], (time.perf_counter() - began) * 1e3)
+                    await asyncio.sleep(SELF_PING_INTERVAL)
+            pinger = asyncio.create_task(self_ping())
+        else:
+            await main.health_server.start(port)
+            pinger = None
+        checker = threading.Thread(target=external_checker, args=(port, stop), daemon=True)
+        checker.start()
+        lags = await measure_loop_lag(HEALTH_SECONDS)
+        stop.set()
+        if pinger:
+            pinger.cancel()
+        else:
+            await main.health_server.stop()
+        return lags
+
+    lags = asyncio.run(run())
+    print(json.dumps({'rss_kb': rss_kb(), 'delta_kb': rss_kb() - baseline, 'threads': threading.active_count(),
+                      'p99_ms': percentile(lags, 0.99), 'max_ms': max(lags), 'blocked_ms': blocked[0]}))
+
+def bench_health():
+    """Flask в потоке с самопингом против aiohttp на event loop бота"""
+    print(f"📊 Веб-сервер проверок ({HEALTH_SECONDS} с, внешняя проверка каждые 100 мс, "
+          f"самопинг каждые {SELF_PING_INTERVAL} с)")
+    print(f"{'сервер':>10} {'RSS, МБ':>8} {'прирост, МБ':>12} {'потоков':>8} "
+          f"{'p99 опоздания loop, мс':>23} {'макс., мс':>10} {'самопинг блокирует, мс':>23}")
+    for mode in ('flask', 'aiohttp'):
+        output = subprocess.run(
+            [sys.executable, __file__, '--health-child', mode],
+            check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        blocked = f"{result['blocked_ms']:.2f}" if mode == 'flask' else '—'
+        print(f"{mode:>10} {result['rss_kb'] / 1024:>8.1f} {result['delta_kb'] / 1024:>12.1f} "
+              f"{result['threads']:>8} {result['p99_ms']:>23.2f} {result['max_ms']:>10.2f} "
+              f"{blocked:>23}")
+
+def bench_metrics():
+    """Стоимость метрик: наблюдение в горячем пути и отрисовка /metrics"""
+    print("📊 Метрики Prometheus")
+    histogram = main.Histogram('bench_seconds', 'бенчмарк', main.FAST_BUCKETS, label='handler')
+    main.METRICS.remove(histogram)
+    rng = random.Random(14)
+    values = [rng.expovariate(100) for _ in range(100_000)]
+    began = time.perf_counter()
+    for value in values:
+        histogram.observe(value, 'старт')
+    observe_ns = (time.perf_counter() - began) / len(values) * 1e9
+
+    counter = main.Counter('bench_total', 'бенчмарк', label='exception')
+    main.METRICS.remove(counter)
+    began = time.perf_counter()
+    for _ in range(100_000):
+        counter.inc('Forbidden')
+    inc_ns = (time.perf_counter() - began) / 100_000 * 1e9
+
+    # Все обработчики с наблюдениями, как у работающего бота
+    for name in ('старт', 'моинапоминания', 'помощь', 'CustomTimerModal.on_submit', 'menu:cat', 'menu:sub'):
+        main.HANDLER_LATENCY.observe(0.001, name)
+    render_ms = median_ms(main.render_metrics, 200)
+    print(f"  Histogram.observe: {observe_ns:.0f} нс, Counter.inc: {inc_ns:.0f} нс")
+    print(f"  /metrics: {render_ms:.2f} мс, {len(main.render_metrics().encode()) / 1024:.1f} КБ")
+
+async def legacy_check_reminders(legacy_reminders):
+    """Прежний тик с полным проходом по словарю прямо в event loop"""
+    legacy_scan_tick(legacy_reminders, datetime.now())
+
+async def legacy_save_in_loop():
+    """Прежний save_data: синхронная запись снимка прямо в event loop"""
+    main.save_data()
+
+async def legacy_self_ping():
+    """Прежний самопинг: блокирующий запрос к медленному серверу"""
+    time.sleep(0.6)
+
+def bench_loop():
+    """Монитор event loop: находит виновников блокировок и стоит почти ничего"""
+    print("📊 Монитор event loop")
+
+    async def idle(seconds, monitor):
+        if monitor:
+            main.loop_monitor.start(0.1, 0.25)
+        began = time.process_time()
+        await asyncio.sleep(seconds)
+        used = time.process_time() - began
+        main.loop_monitor.stop()
+        return used
+
+    idle_cpu = asyncio.run(idle(5, False))
+    monitor_cpu = asyncio.run(idle(5, True))
+    print(f"  Процессорное время за 5 с простоя (пульс каждые 0.1 с): без монитора {idle_cpu * 1e3:.1f} мс, "
+          f"с монитором {monitor_cpu * 1e3:.1f} мс")
+
+    with tempfile.TemporaryDirectory() as directory:
+        use_temp_files(directory)
+        fill_reminders(300_000, users=30_000)
+        now = datetime.now()
+        legacy = {f"r{i}": make_reminder(now, 60 + i, i % 1000) for i in range(600_000)}
+        main.loop_monitor = main.LoopMonitor()
+
+        async def run():
+            main.loop_monitor.start(0.05, 0.1)
+            for culprit in (legacy_check_reminders(legacy), legacy_save_in_loop(), legacy_self_ping()):
+                await asyncio.sleep(0.3)
+                await asyncio.create_task(culprit)
+            await asyncio.sleep(0.3)
+            main.loop_monitor.stop()
+            return main.loop_monitor.report()
+
+        report = asyncio.run(run())
+    print(f"  Блокировки при пороге 0.1 с, пульс каждые 0.05 с. Найдено: {report['stalls']}, наибольшая задержка {report['max_lag']:.2f} с")
+    for stall in report['recent_stalls']:
+        print(f"  🐢 {stall['seconds']:.2f} с — {stall['task']} ({stall['where']})")
+
+LOAD_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+LOAD_OPERATIONS = 2_000
+
+def latency_stats(samples, total=None):
+    """Пропускная способность и перцентили задержки в мс"""
+    total = total if total is not None else sum(samples)
+    return {
+        'count': len(samples),
+        'throughput': len(samples) / total if total else 0.0,
+        'p50_ms': percentile(samples, 0.5) * 1e3,
+        'p99_ms': percentile(samples, 0.99) * 1e3,
+    }
+
+async def timed_calls(call, count):
+    samples = []
+    for i in range(count):
+        began = time.perf_counter()
+        await call(i)
+        samples.append(time.perf_counter() - began)
+    return latency_stats(samples)
+
+def make_custom_timer_modal(i):
+    modal = main.CustomTimerModal('таймер', 'настраиваемый')
+    modal.days_input._value = '0'
+    modal.hours_input._value = str(i % 24)
+    modal.minutes_input._value = '30'
+    modal.message_input._value = 'Проверить почту'
+    return modal
+
+async def run_load_suite(size):
+    """Все основные обработчики на хранилище из size напоминаний"""
+    results = {}
+    sent = []
+    install_fake_client(sent)
+    main.delivery_pipeline = main.DeliveryPipeline(main.DELIVERY_WORKERS, 1e9)
+    operations = min(LOAD_OPERATIONS, size)
+    users = max(1, size // 10)
+
+    # Модальные окна создаются заранее: в боте это происходит при нажатии кнопки
+    modals = [make_custom_timer_modal(i) for i in range(operations)]
+
+    async def custom_timer(i):
+        await modals[i].on_submit(FakeInteraction(i % users))
+    results['custom_timer_submit'] = await timed_calls(custom_timer, operations)
+
+    async def fixed_timer(i):
+        await main.handle_fixed_timer(FakeInteraction(i % users), 'таймер', 'оплата_дома')
+    results['fixed_timer'] = await timed_calls(fixed_timer, operations)
+
+    async def my_reminders(i):
+        await main.моинапоминания.callback(FakeInteraction(i % users))
+    results['my_reminders'] = await timed_calls(my_reminders, min(500, size))
+
+    # Тики check_reminders: по 100 наступивших напоминаний у разных пользователей,
+    # доставка идёт параллельно, как в работающем боте
+    submitted = {}
+    tick_samples = []
+    main.delivery_pipeline.start()
+    delivery_began = time.perf_counter()
+    for tick in range(20):
+        for i in range(100):
+            user_id = 10**9 + tick * 100 + i
+            main.add_reminder(f"due{user_id}", main.Reminder(user_id, int(time.time()) - 1,
+                                                             'таймер', 'оплата_дома', 'Время оплатить дом!'))
+            submitted[user_id] = time.perf_counter()
+        began = time.perf_counter()
+        await main.check_reminders.coro()
+        tick_samples.append(time.perf_counter() - began)
+        await asyncio.sleep(0)
+    results['check_reminders_tick'] = latency_stats(tick_samples)
+
+    await main.delivery_pipeline.queue.join()
+    drained = time.perf_counter() - delivery_began
+    await main.delivery_pipeline.stop()
+    delivery = [sent_at - submitted[user_id] for user_id, sent_at in sent if user_id in submitted]
+    results['delivery'] = latency_stats(delivery, drained)
+
+    repeats = 3 if size >= 100_000 else 10
+    save_samples = []
+    for _ in range(repeats):
+        began = time.perf_counter()
+        main.save_data()
+        save_samples.append(time.perf_counter() - began)
+    results['save_data'] = latency_stats(save_samples)
+
+    load_samples = []
+    for _ in range(repeats):
+        began = time.perf_counter()
+        main.load_data()
+        load_samples.append(time.perf_counter() - began)
+    results['load_data'] = latency_stats(load_samples)
+    return results
+
+def load_suite_child(size, directory):
+    use_temp_files(directory)
+    size = int(size)
+    main.categories_data.clear()
+    main.init_default_categories()
+    fill_reminders(size, users=max(1, size // 10))
+    baseline = rss_kb()
+    results = asyncio.run(run_load_suite(size))
+    print(json.dumps({'size': size, 'rss_kb': rss_kb(), 'peak_rss_kb': rss_kb('VmHWM'),
+                      'store_rss_kb': baseline, 'operations': results}))
+
+def compare_results(current, baseline_path, tolerance):
+    """Сравнение p99 с прошлым прогоном; True, если есть регрессия"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {run['size']: run for run in json.load(f)['runs']}
+    regressed = False
+    for run in current:
+        previous = baseline.get(run['size'])
+        if previous is None:
+            continue
+        for name, stats in run['operations'].items():
+            old = previous['operations'].get(name)
+            if old and old['p99_ms'] > 0 and stats['p99_ms'] > old['p99_ms'] * (1 + tolerance):
+                regressed = True
+                print(f"❌ Регрессия: {name} при {run['size']}: p99 {old['p99_ms']:.3f} -> {stats['p99_ms']:.3f} мс")
+    return regressed
+
+def bench_load():
+    """Нагрузочный прогон обработчиков с поддельным клиентом Discord"""
+    sizes = ARGS.sizes or LOAD_SIZES
+    print("📊 Нагрузка на обработчики (поддельный Interaction, fetch_user и User.send)")
+    print(f"{'напоминаний':>12} {'операция':>22} {'оп/с':>10} {'p50, мс':>9} {'p99, мс':>9}")
+    runs = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            output = subprocess.run(
+                [sys.executable, __file__, '--suite-child', str(size), directory],
+                check=True, capture_output=True, text=True
+            ).stdout
+        run = json.loads(output.strip().splitlines()[-1])
+        runs.append(run)
+        for name, stats in run['operations'].items():
+            print(f"{size:>12} {name:>22} {stats['throughput']:>10.1f} "
+                  f"{stats['p50_ms']:>9.3f} {stats['p99_ms']:>9.3f}")
+        print(f"{size:>12} {'пиковый RSS, МБ':>22} {run['peak_rss_kb'] / 1024:>10.1f}")
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'discord_py': discord.__version__,
+        'runs': runs,
+    }
+    if ARGS.json == '-':
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    elif ARGS.json:
+        with open(ARGS.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 Результаты записаны в {ARGS.json}")
+    if ARGS.compare and compare_results(runs, ARGS.compare, ARGS.tolerance):
+        sys.exit(1)
+
+E2E_USERS = [200, 1_000]
+E2E_RATES = [20, 100]  # новых пользователей в секунду; 100/с упирается в глобальный лимит 50 запросов/с
+
+def start_fake_discord(port, *options):
+    """Запускает fake_discord.py и ждёт, пока он начнёт принимать соединения"""
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_discord.py'),
+         '--port', str(port), *map(str, options)],
+        stdout=subprocess.PIPE, text=True
+    )
+    server.stdout.readline()  # адрес заглушки: сервер готов
+    return server
+
+def start_bot(directory, port, **env):
+    """Запускает main.py как в продакшене, но против fake_discord.py на порту port"""
+    env = {**os.environ, 'DISCORD_TOKEN': 'fake', 'PORT': '0',
+           'DISCORD_API_BASE': f"http://127.0.0.1:{port}/api/v10",
+           'DISCORD_GATEWAY_URL': f"ws://127.0.0.1:{port}/gateway", **env}
+    return subprocess.Popen([sys.executable, os.path.abspath(main.__file__)], cwd=directory, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def bench_e2e():
+    """Сквозной прогон: настоящий bot.run против локальной замены gateway и REST API"""
+    sizes = ARGS.sizes or E2E_USERS
+    print("📊 Сквозная нагрузка: /старт, кнопки, модальное окно и доставка через fake_discord.py")
+    print(f"{'польз.':>8} {'польз./с':>9} {'шаг':>16} {'p50, мс':>9} {'p99, мс':>9}")
+    for users, rate in ((users, rate) for users in sizes for rate in E2E_RATES):
+        port = free_port()
+        with tempfile.TemporaryDirectory() as directory:
+            server = start_fake_discord(port, '--users', users, '--rate', rate, '--timer-minutes', 1)
+            bot = start_bot(directory, port)
+            try:
+                report = json.loads(server.stdout.readline())
+            finally:
+                bot.terminate()
+                bot.wait()
+                server.wait()
+        for step, stats in report['latency_ms'].items():
+            print(f"{users:>8} {rate:>9} {step:>16} {stats['p50']:>9.1f} {stats['p99']:>9.1f}")
+        print(f"{users:>8} {rate:>9} доставлено {report['deliveries']}/{users} за {report['interaction_seconds']:.1f} с "
+              f"взаимодействий, {report['delivery_rate']:.1f} ЛС/с, опоздание p50 {report['lateness_p50']:.2f} с, "
+              f"p99 {report['lateness_p99']:.2f} с, 429: {report['rate_limited']}, ошибок: {report['errors'] or 0}")
+
+CLUSTER_PROCESSES = [1, 2, 4]
+CLUSTER_REMINDERS = 4_000
+CLUSTER_API_LATENCY = 0.05  # время ответа Discord; пул отправителей процесса упирается в него
+
+async def run_cluster_delivery(total):
+    """Доставка своей части всплеска из total напоминаний одним процессом кластера"""
+    api = FakeDiscordAPI(latency=CLUSTER_API_LATENCY, global_limit=10**6)
+    discord.http.Route.BASE = await api.start()
+    await main.bot.login('fake-token')
+    main.dm_channel_cache = main.DMChannelCache(main.DM_CACHE_SIZE, main.DM_CACHE_TTL)
+    due = int(time.time())
+    owned = [
+        (f"r{i}", main.Reminder(10**17 + i, due, 'таймер', 'оплата_дома', 'Время оплатить дом!'))
+        for i in range(total) if main.owns_user(10**17 + i)
+    ]
+    # Глобальный лимит не ограничивает: у крупных ботов он повышен, здесь важен потолок процесса
+    pipeline = main.DeliveryPipeline(main.DELIVERY_WORKERS, 10**6)
+    # Все процессы начинают одновременно, когда каждый закончил подготовку
+    print('ready', flush=True)
+    await asyncio.to_thread(sys.stdin.readline)
+    cpu = time.process_time()
+    began = time.time()
+    # Журнал отправок не идёт в канал к родителю: он читает процессы по очереди,
+    # и переполненный канал останавливал бы остальные
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        pipeline.start()
+        for item in owned:
+            pipeline.submit([item])
+        await pipeline.queue.join()
+    finished = time.time()
+    await pipeline.stop()
+    await main.bot.close()
+    await api.stop()
+    return {'delivered': pipeline.delivered, 'began': began, 'finished': finished,
+            'cpu_seconds': time.process_time() - cpu}
+
+def cluster_child(count, cluster_id, total, directory):
+    use_temp_files(directory)
+    main.CLUSTER_COUNT, main.CLUSTER_ID = int(count), int(cluster_id)
+    fresh_bot()
+    result = asyncio.run(run_cluster_delivery(int(total)))
+    print(json.dumps(result))
+
+def bench_cluster():
+    """Пропускная способность доставки в зависимости от числа процессов кластера"""
+    print(f"📊 Кластер: всплеск из {CLUSTER_REMINDERS} напоминаний, ответ API {CLUSTER_API_LATENCY * 1e3:.0f} мс, "
+          f"{main.DELIVERY_WORKERS} отправителей на процесс, ядер: {os.cpu_count()}")
+    print(f"{'процессов':>10} {'доставлено':>11} {'доставок/с':>11} {'доля, мин/макс':>15} {'CPU мс/доставку':>16}")
+    for count in CLUSTER_PROCESSES:
+        with tempfile.TemporaryDirectory() as directory:
+            children = [
+                subprocess.Popen(
+                    [sys.executable, __file__, '--cluster-child', str(count), str(cluster_id),
+                     str(CLUSTER_REMINDERS), directory],
+                    stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+                )
+                for cluster_id in range(count)
+            ]
+            for child in children:
+                while child.stdout.readline().strip() != 'ready':
+                    pass
+            for child in children:
+                child.stdin.write('go\n')
+                child.stdin.flush()
+            results = [json.loads(child.communicate()[0].strip().splitlines()[-1]) for child in children]
+        delivered = sum(result['delivered'] for result in results)
+        elapsed = max(result['finished'] for result in results) - min(result['began'] for result in results)
+        shares = [result['delivered'] for result in results]
+        cpu = sum(result['cpu_seconds'] for result in results)
+        print(f"{count:>10} {delivered:>11} {delivered / elapsed:>11.0f} {min(shares):>7}/{max(shares):<7} "
+              f"{cpu / delivered * 1e3:>16.2f}")
+
+MEMORY_GUILDS = [(10, 100), (100, 100), (100, 1_000), (1_000, 100)]  # серверов, участников на сервер
+
+def settled_rss_kb(pid, interval=0.5, timeout=60):
+    """RSS процесса после того, как он перестал расти"""
+    previous, deadline = -1, time.time() + timeout
+    while time.time() < deadline:
+        time.sleep(interval)
+        current = rss_kb(pid=pid)
+        if abs(current - previous) < 256:
+            return current
+        previous = current
+    return previous
+
+def bench_memory():
+    """RSS бота в зависимости от числа серверов и участников: Intents.all() против минимальных интентов"""
+    print("📊 Память бота после подключения к серверам (участники со статусами, если разрешены интентами)")
+    print(f"{'серверов':>9} {'участников':>11} {'full, МБ':>9} {'minimal, МБ':>12}")
+    for guilds, members in MEMORY_GUILDS:
+        row = {}
+        for mode in ('full', 'minimal'):
+            port = free_port()
+            with tempfile.TemporaryDirectory() as directory:
+                server = start_fake_discord(port, '--users', 0, '--guilds', guilds, '--members', members)
+                bot = start_bot(directory, port, GATEWAY_MODE=mode)
+                try:
+                    server.stdout.readline()  # все GUILD_CREATE отправлены
+                    row[mode] = settled_rss_kb(bot.pid)
+                finally:
+                    bot.terminate()
+                    bot.wait()
+                    server.terminate()
+                    server.wait()
+        print(f"{guilds:>9} {guilds * members:>11} {row['full'] / 1024:>9.1f} {row['minimal'] / 1024:>12.1f}")
+
+STARTUP_CASES = [(1_000, 0), (1_000, 5), (100_000, 5)]  # напоминаний в хранилище, задержка READY, с
+
+async def cold_start(directory, stored, ready_delay):
+    """Запуск main.py с просроченным напоминанием: время до READY и до первой доставки"""
+    now = time.time()
+    data = {
+        f"r{i}": main.Reminder(USER_ID_BASE + i, now + 3600 + i, 'таймер', 'оплата_дома', 'Время оплатить дом!').to_dict()
+        for i in range(1, stored)
+    }
+    data['r0'] = main.Reminder(USER_ID_BASE, now, 'таймер', 'оплата_дома', 'Время оплатить дом!').to_dict()
+    with open(os.path.join(directory, main.USERS_FILE), 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+
+    port = free_port()
+    server = FakeDiscord(ready_delay=ready_delay)
+    await server.start(port)
+    launched = time.time()
+    bot = start_bot(directory, port)
+    try:
+        while not server.messages or server.ready_at is None:
+            await asyncio.sleep(0.01)
+    finally:
+        bot.terminate()
+        await asyncio.to_thread(bot.wait)
+        await server.stop()
+    return server.ready_at - launched, server.messages[0][0] - launched
+
+def bench_startup():
+    """Холодный старт: от запуска процесса до первой доставки просроченного напоминания"""
+    print("📊 Холодный старт main.py против fake_discord.py")
+    print(f"{'напоминаний':>12} {'задержка READY, с':>18} {'до READY, с':>12} {'до доставки, с':>15}")
+    for stored, ready_delay in STARTUP_CASES:
+        with tempfile.TemporaryDirectory() as directory:
+            ready, delivered = asyncio.run(cold_start(directory, stored, ready_delay))
+        print(f"{stored:>12} {ready_delay:>18} {ready:>12.2f} {delivered:>15.2f}")
+
+CATCHUP_BACKLOG = 600  # напоминаний, просроченных за время простоя
+CATCHUP_LIVE = 100  # напоминаний со сроком в первые CATCHUP_LIVE_WINDOW секунд после запуска
+CATCHUP_LIVE_WINDOW = 30
+CATCHUP_RATES = [1000, 20, 10]  # 1000 — весь хвост сразу, как без догоняющей доставки
+
+async def catch_up_run(directory, rate):
+    """Запуск после простоя: время доставки хвоста и опоздание напоминаний, наступающих вовремя"""
+    now = time.time()
+    live_base = USER_ID_BASE + CATCHUP_BACKLOG
+    deadlines = {}
+    data = {}
+    for i in range(CATCHUP_BACKLOG):
+        end_ts = now - 60 - i * 10  # простой до ~2 часов
+        data[f"b{i}"] = main.Reminder(USER_ID_BASE + i, end_ts, 'таймер', 'оплата_дома', 'Время оплатить дом!').to_dict()
+    for i in range(CATCHUP_LIVE):
+        deadlines[str(live_base + i)] = end_ts = now + 5 + i * CATCHUP_LIVE_WINDOW / CATCHUP_LIVE
+        data[f"l{i}"] = main.Reminder(live_base + i, end_ts, 'фарм', 'билетики', 'Проверить билетики!').to_dict()
+    with open(os.path.join(directory, main.USERS_FILE), 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+
+    port = free_port()
+    server = FakeDiscord()
+    await server.start(port)
+    launched = time.time()
+    bot = start_bot(directory, port, CATCHUP_RATE=str(rate))
+    try:
+        while len(server.messages) < len(data) and time.time() < launched + 600:
+            await asyncio.sleep(0.1)
+    finally:
+        bot.terminate()
+        await asyncio.to_thread(bot.wait)
+        await server.stop()
+    backlog_done = max(sent for sent, channel in server.messages if channel not in deadlines)
+    lateness = [sent - deadlines[channel] for sent, channel in server.messages if channel in deadlines]
+    return backlog_done - launched, percentile(lateness, 0.5), percentile(lateness, 0.99), len(server.messages)
+
+def bench_catchup():
+    """Догоняющая доставка после простоя против отправки всего хвоста сразу"""
+    print(f"📊 Запуск после простоя: {CATCHUP_BACKLOG} просроченных напоминаний и {CATCHUP_LIVE} "
+          f"со сроком в первые {CATCHUP_LIVE_WINDOW} с, лимит отправки {main.DELIVERY_GLOBAL_RATE:g}/с")
+    print(f"{'CATCHUP_RATE':>13} {'хвост за, с':>12} {'опоздание p50, с':>17} {'p99, с':>7} {'доставлено':>11}")
+    for rate in CATCHUP_RATES:
+        with tempfile.TemporaryDirectory() as directory:
+            drained, p50, p99, delivered = asyncio.run(catch_up_run(directory, rate))
+        print(f"{rate:>13} {drained:>12.1f} {p50:>17.2f} {p99:>7.2f} {delivered:>11}")
+
+def legacy_parse_time_string(time_str):
+    """Прежний разбор посимвольно: только д/ч/м/с, мусор молча пропускается"""
+    time_str = time_str.lower().replace(' ', '')
+    total_seconds = 0
+    current_num = ''
+    for char in time_str:
+        if char.isdigit():
+            current_num += char
+        elif current_num:
+            num = int(current_num)
+            if char == 'с':
+                total_seconds += num
+            elif char == 'м':
+                total_seconds += num * 60
+            elif char == 'ч':
+                total_seconds += num * 3600
+            elif char == 'д':
+                total_seconds += num * 86400
+            current_num = ''
+    return total_seconds
+
+DURATION_CALLS = 200_000
+DURATION_CASES = 100_000  # случайных длительностей для проверки туда-обратно
+
+def random_duration_text(rng, seconds):
+    """Та же длительность в случайной записи: русские или английские единицы, разные разделители"""
+    parts = []
+    for unit_seconds, names in ((604800, ('н', 'нед', 'w', 'weeks')), (86400, ('д', 'дней', 'd', 'day')),
+                                (3600, ('ч', 'часов', 'h', 'hours')), (60, ('м', 'мин', 'm', 'min')),
+                                (1, ('с', 'сек', 's', 'seconds'))):
+        count, seconds = divmod(seconds, unit_seconds)
+        if count or rng.random() < 0.2:
+            parts.append(f"{count}{rng.choice(('', ' '))}{rng.choice(names)}")
+    return rng.choice((' ', ', ', '')).join(parts) or '0с'
+
+def bench_durations():
+    """Разбор длительности fixed-таймера: посимвольно, регулярным выражением и готовое число"""
+    subcat = {'time': '0д 2ч 30м', 'duration_seconds': 9000}
+    print(f"📊 Длительность fixed-подкатегории '{subcat['time']}', {DURATION_CALLS} вызовов")
+    for label, call in (
+        ('посимвольный разбор (прежний)', lambda: legacy_parse_time_string(subcat['time'])),
+        ('регулярное выражение', lambda: main.parse_time_string(subcat['time'])),
+        ("subcat['duration_seconds'] при нажатии", lambda: subcat['duration_seconds']),
+    ):
+        began = time.perf_counter()
+        for _ in range(DURATION_CALLS):
+            call()
+        print(f"{label:>40} {(time.perf_counter() - began) / DURATION_CALLS * 1e9:>8.0f} нс/вызов")
+
+    # Свойства: format_time читается обратно, и любая запись длительности даёт её же
+    rng = random.Random(24)
+    for _ in range(DURATION_CASES):
+        seconds = rng.choice((rng.randrange(60), rng.randrange(86400), rng.randrange(10**8)))
+        assert main.parse_time_string(main.format_time(seconds)) == seconds, seconds
+        text = random_duration_text(rng, seconds)
+        assert main.parse_time_string(text) == seconds, text
+        # Наступивший, но ещё не снятый срок показывается нулём, а не «23ч 59м 55с»
+        assert main.format_time(-seconds - rng.random()) == main.format_time(0), -seconds
+    for text in ('', '5', '5 лет', '1д-2ч', 'час'):
+        try:
+            main.parse_time_string(text)
+        except ValueError:
+            continue
+        raise AssertionError(f"строка {text!r} разобрана без ошибки")
+    print(f"✅ {DURATION_CASES} случайных длительностей: format_time и случайные записи читаются обратно, отрицательные показываются нулём")
+
+MESSAGES_COUNT = 10_000  # обычных сообщений в канале сервера, не команд
+
+def prefix_bot():
+    """Бот до перехода на слэш-команды: commands.Bot с префиксом и разбором каждого сообщения"""
+    bot = commands.AutoShardedBot(command_prefix='/', intents=discord.Intents.all(), help_command=None)
+    async def command(ctx):
+        pass
+    for name in ('старт', 'моинапоминания', 'помощь'):
+        bot.command(name=name)(command)
+    return bot
+
+async def message_cpu(client, messages):
+    """CPU на разбор сообщений из gateway и вызов обработчиков клиента"""
+    server = FakeDiscord()
+    server.intents = client.intents.value
+    await client._async_setup_hook()
+    client._connection._add_guild_from_data(server.guild(0, 100))
+    channel_id = int(server.guild(0, 0)['channels'][0]['id'])
+    raw = [
+        json.dumps(server.message(channel_id, server.user(MEMBER_ID_BASE + i % 100), f"сообщение {i}"))
+        for i in range(messages)
+    ]
+    cpu = time.process_time()
+    for i, data in enumerate(raw):
+        client._connection.parse_message_create(json.loads(data))
+        if i % 100 == 0:
+            await asyncio.sleep(0)
+    while len(asyncio.all_tasks()) > 1:
+        await asyncio.sleep(0)
+    return time.process_time() - cpu
+
+def bench_messages():
+    """CPU на 1000 обычных сообщений: префиксные команды против слэш-команд"""
+    print(f"📊 Обычные сообщения в канале сервера ({MESSAGES_COUNT}), CPU на 1000 сообщений")
+    print(f"{'бот':>44} {'CPU, мс':>8}")
+    for label, make in (
+        ('префиксные команды, Intents.all()', prefix_bot),
+        ('слэш-команды, GATEWAY_MODE=full', lambda: main.ReminderBot(intents=discord.Intents.all())),
+    ):
+        cpu = asyncio.run(message_cpu(make(), MESSAGES_COUNT))
+        print(f"{label:>44} {cpu / MESSAGES_COUNT * 1e6:>8.1f}")
+    # Без интента guild_messages Discord не присылает MESSAGE_CREATE вовсе
+    print(f"{'слэш-команды, GATEWAY_MODE=minimal':>44} {0:>8.1f}")
+
+NDJSON_SIZES = [100_000, 1_000_000]
+MAIN_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+def write_stored_reminders(directory, size):
+    """users_data.json и categories.json на size напоминаний, без словаря в памяти"""
+    now = time.time()
+    labels = [(category_key, sub_key, label, message or 'Своё напоминание')
+              for category_key, sub_key, label, message in FIXED_SUBCATEGORIES]
+    def items():
+        rng = random.Random(5)
+        for i in range(size):
+            category_key, sub_key, label, message = labels[i % len(labels)]
+            user_id = USER_ID_BASE + rng.randint(0, size // 5)
+            yield f"{user_id}_{i}", main.Reminder(user_id, now + rng.randint(60, 365 * 86400),
+                                                  category_key, sub_key, message, label)
+    main.write_reminders_atomic(os.path.join(directory, 'users_data.json'), items())
+    main.write_json_atomic(os.path.join(directory, 'categories.json'), main.categories_data)
+
+def peak_child(mode, *args):
+    """Замер в отдельном процессе (каталог данных — текущий): пиковый RSS последней строкой stdout"""
+    began = time.perf_counter()
+    if mode == 'json-load':
+        with open(main.USERS_FILE, 'r', encoding='utf-8') as f:
+            json.load(f)
+    elif mode == 'load-data':
+        main.load_data()
+    elif mode == 'cli':
+        main.run_ndjson_cli(list(args))
+    print(json.dumps({'seconds': time.perf_counter() - began, 'peak_kb': rss_kb('VmHWM')}))
+
+def run_peak_child(directory, mode, *args, **env):
+    # ru_maxrss из wait4 не годится: после fork в нём остаётся RSS родителя
+    output = subprocess.run(
+        [sys.executable, __file__, '--peak-child', mode, *args],
+        cwd=directory, env={**os.environ, **env}, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def bench_ndjson():
+    """Пиковая память и время потокового экспорта и импорта NDJSON против json.load всего снимка"""
+    print("📊 Экспорт и импорт NDJSON (python main.py export/import), отдельный процесс на замер")
+    print(f"{'напоминаний':>12} {'операция':<34} {'время, с':>9} {'пик RSS, МБ':>12} {'файл, МБ':>9}")
+    main.categories_data.clear()
+    for size in NDJSON_SIZES:
+        with tempfile.TemporaryDirectory() as directory:
+            write_stored_reminders(directory, size)
+            export_file = os.path.join(directory, 'all.ndjson')
+            cases = [
+                ('процесс без работы', ('idle',), 'users_data.json'),
+                ('json.load снимка', ('json-load',), 'users_data.json'),
+                ('load_data (запуск бота)', ('load-data',), 'users_data.json'),
+                ('export', ('cli', 'export', export_file), export_file),
+                ('export --category фарм', ('cli', 'export', 'farm.ndjson', '--category', 'фарм'), 'farm.ndjson'),
+            ]
+            for name, args, output in cases:
+                result = run_peak_child(directory, *args)
+                size_mb = os.path.getsize(os.path.join(directory, output)) / 1024 / 1024
+                print(f"{size:>12} {name:<34} {result['seconds']:>9.1f} {result['peak_kb'] / 1024:>12.1f} "
+                      f"{size_mb:>9.1f}")
+            for mode in ('sqlite', 'journal'):
+                with tempfile.TemporaryDirectory() as target:
+                    result = run_peak_child(target, 'cli', 'import', export_file, PERSISTENCE_MODE=mode)
+                    print(f"{size:>12} {'import, PERSISTENCE_MODE=' + mode:<34} {result['seconds']:>9.1f} "
+                          f"{result['peak_kb'] / 1024:>12.1f} {'—':>9}")
+
+SCENARIOS = {
+    'scheduler': bench_scheduler,
+    'wheel': bench_wheel,
+    'records': bench_records,
+    'listing': bench_listing,
+    'persistence': bench_persistence,
+    'sqlite': bench_sqlite,
+    'delivery': bench_delivery,
+    'retries': bench_retries,
+    'coalesce': bench_coalesce,
+    'menus': bench_menus,
+    'views': bench_views,
+    'health': bench_health,
+    'metrics': bench_metrics,
+    'loop': bench_loop,
+    'load': bench_load,
+    'e2e': bench_e2e,
+    'cluster': bench_cluster,
+    'memory': bench_memory,
+    'messages': bench_messages,
+    'durations': bench_durations,
+    'startup': bench_startup,
+    'catchup': bench_catchup,
+    'ndjson': bench_ndjson,
+}
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--load-child']:
+        load_child(*sys.argv[2:4])
+        sys.exit()
+    if sys.argv[1:2] == ['--health-child']:
+        health_child(sys.argv[2])
+        sys.exit()
+    if sys.argv[1:2] == ['--suite-child']:
+        load_suite_child(*sys.argv[2:4])
+        sys.exit()
+    if sys.argv[1:2] == ['--peak-child']:
+        peak_child(*sys.argv[2:])
+        sys.exit()
+    if sys.argv[1:2] == ['--cluster-child']:
+        cluster_child(*sys.argv[2:6])
+        sys.exit()
+
+    parser = argparse.ArgumentParser(description='Бенчмарки бота напоминаний')
+    parser.add_argument('scenarios', nargs='*', metavar='сценарий',
+                        help=f"один из: {', '.join(SCENARIOS)}")
+    parser.add_argument('--sizes', type=int, nargs='+', help='load: размеры хранилища')
+    parser.add_argument('--json', metavar='ФАЙЛ', help='load: результаты в JSON ("-" — в stdout)')
+    parser.add_argument('--compare', metavar='ФАЙЛ', help='load: сравнить p99 с прошлым JSON, код 1 при регрессии')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='load: допустимый рост p99 (0.2 = 20%%)')
+    ARGS = parser.parse_args()
+    unknown = set(ARGS.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+    for name in ARGS.scenarios or SCENARIOS:
+        SCENARIOS[name]()
@@ -0,0 +1,467 @@
+"""Локальная замена Discord для сквозных нагрузочных тестов.
+
+REST API и gateway отвечают ровно настолько, чтобы бот подключился
+через обычный bot.run, а симулированные пользователи открывали меню /старт,
+нажимали кнопки, отправляли модальные окна и получали напоминания в ЛС.
+Лимиты запросов повторяют Discord: 50 запросов/с на бота и 5 сообщений за 5 с
+в канал, при превышении — ответ 429 с заголовками X-RateLimit-*.
+
+Запуск сервера с нагрузкой:
+    python fake_discord.py --port 8765 --users 1000
+и бота против него:
+    DISCORD_API_BASE=http://127.0.0.1:8765/api/v10 DISCORD_GATEWAY_URL=ws://127.0.0.1:8765/gateway \\
+    DISCORD_TOKEN=fake python main.py
+Результаты печатаются в stdout одной строкой JSON.
+"""
+
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import random
+import time
+from datetime import datetime
+
+from aiohttp import web, WSMsgType
+
+BOT_USER_ID = 1
+USER_ID_BASE = 10**15  # Пользователи и их ЛС: id канала ЛС совпадает с id пользователя
+COMMAND_CHANNEL_BASE = 2 * 10**15  # Каналы, где пользователи вызывают /старт
+GUILD_ID_BASE = 3 * 10**15
+MEMBER_ID_BASE = 4 * 10**15
+INTENT_GUILD_MEMBERS = 1 << 1
+INTENT_GUILD_PRESENCES = 1 << 8
+HEARTBEAT_INTERVAL_MS = 41250
+# Настоящие 429 от Discord проходят через прокси Google; без Via discord.py
+# считает ответ баном Cloudflare и не повторяет запрос
+RATE_LIMIT_HEADERS = {'Via': '1.1 google'}
+
+def json_response(data, status=200, headers=None):
+    """JSON-ответ с заголовком без charset: discord.py сравнивает его точно"""
+    return web.Response(body=json.dumps(data).encode(), status=status,
+                        headers={'Content-Type': 'application/json', **(headers or {})})
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+class FakeDiscordAPI:
+    """Минимальный REST API Discord с задержкой ответа и глобальным лимитом запросов"""
+    def __init__(self, latency=0.01, global_limit=1000):
+        self.latency = latency
+        self.global_limit = global_limit
+        self.window = collections.deque()
+        self.requests = 0
+        self.rate_limited = 0
+        self.messages = []  # (время, id канала)
+        self.buckets = {}  # маршрут -> (начало окна, запросов в окне)
+        self.message_ids = itertools.count(10**17)
+        self.interaction_waiters = {}  # id взаимодействия -> Future с ответом бота
+        self.failure_rate = 0.0  # доля сообщений, на которые API отвечает 503
+        self.closed_dms = set()  # id каналов ЛС, куда отправка запрещена (403)
+        self.failures = 0
+        self.runner = None
+        self.url = None
+        self.gateway_url = None
+
+    def user(self, user_id):
+        return {'id': str(user_id), 'username': f"user{user_id}", 'discriminator': '0',
+                'avatar': None, 'global_name': None}
+
+    def message(self, channel_id, author, content='', embeds=(), components=(), flags=0):
+        return {
+            'id': str(next(self.message_ids)), 'channel_id': str(channel_id), 'author': author,
+            'content': content, 'timestamp': datetime.now().isoformat(),
+            'edited_timestamp': None, 'tts': False, 'mention_everyone': False, 'mentions': [],
+            'mention_roles': [], 'attachments': [], 'embeds': list(embeds), 'pinned': False, 'type': 0,
+            'components': list(components), 'flags': flags
+        }
+
+    def _over_limit(self):
+        now = time.monotonic()
+        while self.window and now - self.window[0] > 1:
+            self.window.popleft()
+        if len(self.window) >= self.global_limit:
+            return 1 - (now - self.window[0])
+        self.window.append(now)
+        return None
+
+    def _route_limit(self, request, path):
+        """Лимит маршрута: 5 сообщений за 5 с в канал, остальные — общий лимит"""
+        if path[0] == 'channels':
+            key, limit, period = f"{request.method} channels/{path[1]}", 5, 5.0
+        else:
+            key, limit, period = request.method + ' ' + path[0], self.global_limit, 1.0
+        now = time.monotonic()
+        started, used = self.buckets.get(key, (now, 0))
+        if now - started >= period:
+            started, used = now, 0
+        reset_after = period - (now - started)
+        headers = {
+            'X-RateLimit-Limit': str(limit),
+            'X-RateLimit-Remaining': str(max(0, limit - used - 1)),
+            'X-RateLimit-Reset-After': f"{reset_after:.3f}",
+            'X-RateLimit-Bucket': key,
+        }
+        if used >= limit:
+            return reset_after, headers
+        self.buckets[key] = (started, used + 1)
+        return None, headers
+
+    async def handle(self, request):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        path = request.match_info['tail'].split('/')
+        # Ответы на взаимодействия в Discord не входят в лимиты бота
+        if path[0] == 'interactions':
+            return await self.route(request, path)
+        retry_after = self._over_limit()
+        if retry_after is not None:
+            self.rate_limited += 1
+            return json_response(
+                {'message': 'You are being rate limited.', 'retry_after': retry_after, 'global': True},
+                status=429, headers={**RATE_LIMIT_HEADERS, 'Retry-After': f"{retry_after:.3f}",
+                                     'X-RateLimit-Global': 'true', 'X-RateLimit-Scope': 'global'}
+            )
+        retry_after, headers = self._route_limit(request, path)
+        if retry_after is not None:
+            self.rate_limited += 1
+            return json_response(
+                {'message': 'You are being rate limited.', 'retry_after': retry_after, 'global': False},
+                status=429, headers={**headers, **RATE_LIMIT_HEADERS, 'Retry-After': f"{retry_after:.3f}",
+                                     'X-RateLimit-Scope': 'user'}
+            )
+        response = await self.route(request, path)
+        response.headers.update(headers)
+        return response
+
+    async def route(self, request, path):
+        if path == ['users', '@me']:
+            return json_response({**self.user(BOT_USER_ID), 'bot': True})
+        if path == ['oauth2', 'applications', '@me']:
+            return json_response({
+                'id': str(BOT_USER_ID), 'name': 'bench', 'description': '', 'icon': None, 'bot_public': True,
+                'bot_require_code_grant': False, 'owner': self.user(2), 'verify_key': '', 'flags': 0
+            })
+        if path == ['gateway', 'bot']:
+            return json_response({
+                'url': self.gateway_url, 'shards': getattr(self, 'shards', 1),
+                'session_start_limit': {'total': 1000, 'remaining': 1000, 'reset_after': 0, 'max_concurrency': 1}
+            })
+        if path == ['users', '@me', 'channels']:
+            recipient = (await request.json())['recipient_id']
+            return json_response({'id': str(recipient), 'type': 1,
+                                  'recipients': [self.user(recipient)], 'last_message_id': None})
+        if path[0] == 'users':
+            return json_response(self.user(path[1]))
+        if path[0] == 'channels' and path[2:] == ['messages']:
+            if path[1] in self.closed_dms:
+                self.failures += 1
+                return json_response({'message': 'Cannot send messages to this user', 'code': 50007}, status=403)
+            # 503 discord.py сам не повторяет, в отличие от 500 и 502
+            if self.failure_rate and random.random() < self.failure_rate:
+                self.failures += 1
+                return json_response({'message': 'Service Unavailable', 'code': 0}, status=503)
+            self.messages.append((time.time(), path[1]))
+            payload = await request.json()
+            message = self.message(path[1], self.user(BOT_USER_ID), payload.get('content') or '',
+                                   payload.get('embeds') or (), payload.get('components') or ())
+            return json_response(message)
+        if path[0] == 'channels' and path[2:3] == ['messages'] and request.method == 'DELETE':
+            return web.Response(status=204)
+        if path[0] == 'applications' and path[2:] == ['commands'] and request.method == 'PUT':
+            commands = await request.json()
+            return json_response([
+                {**command, 'id': str(next(self.message_ids)), 'application_id': path[1], 'version': '1'}
+                for command in commands
+            ])
+        if path[0] == 'webhooks' and request.method == 'DELETE':
+            return web.Response(status=204)
+        if path[0] == 'interactions' and path[3:] == ['callback']:
+            payload = await request.json()
+            waiter = self.interaction_waiters.pop(path[1], None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(payload)
+            return web.Response(status=204)
+        return json_response({'message': 'Unknown route', 'code': 0}, status=404)
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_route('*', '/api/v10/{tail:.*}', self.handle)
+        return app
+
+    async def start(self, port=0):
+        self.runner = web.AppRunner(self.create_app())
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        self.gateway_url = f"ws://127.0.0.1:{port}/gateway"
+        return f"{self.url}/api/v10"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+class FakeDiscord(FakeDiscordAPI):
+    """REST API и gateway: HELLO, IDENTIFY/READY, heartbeat и события от пользователей.
+
+    Шарды подключаются отдельными соединениями; события из ЛС, как и в Discord,
+    приходят только в шард 0. ready_delay задерживает READY после IDENTIFY — как
+    очередь IDENTIFY и загрузка серверов у крупного бота в Discord.
+    """
+    def __init__(self, latency=0.01, global_limit=50, shards=1, ready_delay=0):
+        super().__init__(latency, global_limit)
+        self.shards = shards
+        self.ready_delay = ready_delay
+        self.ready_at = None  # время отправки последнего READY
+        self.gateways = {}  # номер шарда -> соединение
+        self.sequence = 0
+        self.intents = 0  # из IDENTIFY: от них зависит, что попадёт в GUILD_CREATE
+        self.ready = asyncio.Event()
+        self.interaction_ids = itertools.count(10**17)
+
+    def create_app(self):
+        app = super().create_app()
+        app.router.add_get('/gateway', self.gateway_handler)
+        return app
+
+    async def gateway_handler(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await ws.send_str(json.dumps({'op': 10, 'd': {'heartbeat_interval': HEARTBEAT_INTERVAL_MS}}))
+        async for frame in ws:
+            if frame.type != WSMsgType.TEXT:
+                continue
+            payload = json.loads(frame.data)
+            if payload['op'] == 1:
+                # ACK без задержки приходит раньше, чем discord.py отметит отправку heartbeat
+                await asyncio.sleep(self.latency)
+                await ws.send_str(json.dumps({'op': 11}))
+            elif payload['op'] == 2:
+                shard = payload['d'].get('shard') or [0, 1]
+                self.intents = payload['d'].get('intents', 0)
+                self.gateways[shard[0]] = ws
+                await asyncio.sleep(self.ready_delay)
+                await self.dispatch('READY', {
+                    'v': 10, 'user': {**self.user(BOT_USER_ID), 'bot': True, 'verified': True,
+                                      'mfa_enabled': False, 'flags': 0},
+                    'guilds': [], 'session_id': f"fake-session-{shard[0]}", 'shard': shard,
+                    'resume_gateway_url': self.gateway_url,
+                    'application': {'id': str(BOT_USER_ID), 'flags': 0},
+                }, shard[0])
+                if len(self.gateways) == self.shards:
+                    self.ready_at = time.time()
+                    self.ready.set()
+        self.gateways = {shard_id: gateway for shard_id, gateway in self.gateways.items() if gateway is not ws}
+        return ws
+
+    async def dispatch(self, event, data, shard_id=0):
+        self.sequence += 1
+        await self.gateways[shard_id].send_str(json.dumps({'op': 0, 't': event, 's': self.sequence, 'd': data}))
+
+    def guild(self, index, members):
+        """GUILD_CREATE сервера с members участниками.
+
+        Участники и их статусы попадают в событие, только если бот запросил
+        интенты GUILD_MEMBERS и GUILD_PRESENCES — как после загрузки участников
+        в Discord; без них сервер присылает одного участника — самого бота.
+        """
+        guild_id = str(GUILD_ID_BASE + index)
+        first_member = MEMBER_ID_BASE + index * members
+        member_ids = range(first_member, first_member + members) if self.intents & INTENT_GUILD_MEMBERS else ()
+        roles = [
+            {'id': guild_id, 'name': '@everyone', 'permissions': '0', 'position': 0, 'color': 0,
+             'hoist': False, 'managed': False, 'mentionable': False},
+            {'id': str(int(guild_id) + 1), 'name': 'Администратор', 'permissions': '8', 'position': 1,
+             'color': 0, 'hoist': False, 'managed': False, 'mentionable': False},
+        ]
+        member_list = [
+            {'user': self.user(user_id), 'roles': [], 'joined_at': '2024-01-01T00:00:00+00:00',
+             'deaf': False, 'mute': False, 'flags': 0}
+            for user_id in itertools.chain([BOT_USER_ID], member_ids)
+        ]
+        presences = [
+            {'user': {'id': str(user_id)}, 'status': 'online', 'client_status': {'desktop': 'online'},
+             'activities': [{'name': 'Игра', 'type': 0, 'created_at': 0}]}
+            for user_id in member_ids
+        ] if self.intents & INTENT_GUILD_PRESENCES else []
+        return {
+            'id': guild_id, 'name': f"Сервер {index}", 'icon': None, 'owner_id': str(MEMBER_ID_BASE),
+            'afk_channel_id': None, 'afk_timeout': 300, 'verification_level': 0,
+            'default_message_notifications': 0, 'explicit_content_filter': 0, 'mfa_level': 0,
+            'features': [], 'emojis': [], 'stickers': [], 'roles': roles, 'unavailable': False,
+            'member_count': members + 1, 'large': False, 'joined_at': '2024-01-01T00:00:00+00:00',
+            'channels': [{'id': str(int(guild_id) + 2), 'type': 0, 'name': 'общий', 'position': 0,
+                          'permission_overwrites': [], 'nsfw': False, 'parent_id': None}],
+            'threads': [], 'voice_states': [], 'members': member_list, 'presences': presences,
+            'premium_tier': 0, 'preferred_locale': 'ru', 'nsfw_level': 0, 'system_channel_flags': 0,
+        }
+
+    async def populate(self, guilds, members):
+        """Подключает бота к guilds серверам по members участников"""
+        for index in range(guilds):
+            await self.dispatch('GUILD_CREATE', self.guild(index, members))
+
+    async def interact(self, user_id, channel_id, interaction_type, data, message=None, timeout=30):
+        """Событие INTERACTION_CREATE от пользователя; возвращает ответ бота"""
+        interaction_id = str(next(self.interaction_ids))
+        payload = {
+            'id': interaction_id, 'application_id': str(BOT_USER_ID), 'type': interaction_type,
+            'token': f"token-{interaction_id}", 'version': 1, 'data': data,
+            'channel': {'id': str(channel_id), 'type': 1}, 'channel_id': str(channel_id),
+            'user': self.user(user_id), 'locale': 'ru', 'app_permissions': '0',
+        }
+        if message is not None:
+            payload['message'] = message
+        waiter = self.interaction_waiters[interaction_id] = asyncio.get_running_loop().create_future()
+        await self.dispatch('INTERACTION_CREATE', payload)
+        return await asyncio.wait_for(waiter, timeout)
+
+def find_custom_id(components, prefix):
+    for row in components:
+        for component in row.get('components', ()):
+            if component.get('custom_id', '').startswith(prefix):
+                return component['custom_id']
+    raise LookupError(f"нет кнопки {prefix}")
+
+class LoadDriver:
+    """Симулированные пользователи: /старт, категория, настраиваемый таймер, модальное окно"""
+    STEPS = ('command', 'category_click', 'modal_open', 'modal_submit')
+
+    def __init__(self, server, users, arrival_rate, timer_minutes, think_time):
+        self.server = server
+        self.users = users
+        self.arrival_rate = arrival_rate
+        self.think_time = think_time
+        self.timer_minutes = timer_minutes
+        self.latency = {step: [] for step in self.STEPS}
+        self.errors = collections.Counter()
+        self.deadlines = {}  # id канала ЛС -> ожидаемое время напоминания
+
+    async def think(self):
+        """Пауза пользователя между шагами; заодно бот успевает сохранить модальное окно,
+        которое discord.py регистрирует только после ответа на callback"""
+        await asyncio.sleep(random.uniform(0.5, 1.5) * self.think_time)
+
+    async def simulate_user(self, index):
+        server = self.server
+        user_id = USER_ID_BASE + index
+        channel_id = COMMAND_CHANNEL_BASE + index
+        values = {'Дни': '0', 'Часы': '0', 'Минуты': str(self.timer_minutes)}
+        step = 'command'
+        try:
+            began = time.perf_counter()
+            response = await server.interact(user_id, channel_id, 2, {'id': '1', 'name': 'старт', 'type': 1})
+            self.latency[step].append(time.perf_counter() - began)
+            start_menu = server.message(channel_id, server.user(BOT_USER_ID), embeds=response['data']['embeds'],
+                                        components=response['data']['components'])
+
+            await self.think()
+            step = 'category_click'
+            custom_id = find_custom_id(start_menu['components'], 'm:cat:таймер:')
+            began = time.perf_counter()
+            response = await server.interact(
+                user_id, channel_id, 3, {'custom_id': custom_id, 'component_type': 2}, start_menu)
+            self.latency[step].append(time.perf_counter() - began)
+
+            await self.think()
+            step = 'modal_open'
+            menu = server.message(channel_id, server.user(BOT_USER_ID), embeds=response['data'].get('embeds', ()),
+                                  components=response['data']['components'], flags=64)
+            custom_id = find_custom_id(menu['components'], 'm:sub:таймер:настраиваемый')
+            began = time.perf_counter()
+            modal = await server.interact(
+                user_id, channel_id, 3, {'custom_id': custom_id, 'component_type': 2}, menu)
+            self.latency[step].append(time.perf_counter() - began)
+
+            await self.think()
+            step = 'modal_submit'
+            rows = [
+                {'type': 1, 'components': [{'type': 4, 'custom_id': row['components'][0]['custom_id'],
+                                            'value': values.get(row['components'][0]['label'], 'Нагрузочный тест')}]}
+                for row in modal['data']['components']
+            ]
+            began = time.perf_counter()
+            await server.interact(user_id, channel_id, 5, {'custom_id': modal['data']['custom_id'], 'components': rows})
+            self.latency[step].append(time.perf_counter() - began)
+            self.deadlines[str(user_id)] = time.time() + self.timer_minutes * 60
+        except (asyncio.TimeoutError, LookupError, KeyError) as e:
+            self.errors[f"{step}: {type(e).__name__}"] += 1
+
+    async def run(self, drain_timeout):
+        await self.server.ready.wait()
+        # on_ready бота срабатывает через пару секунд после READY без серверов
+        await asyncio.sleep(3)
+        began = time.time()
+        users = []
+        for index in range(self.users):
+            users.append(asyncio.create_task(self.simulate_user(index)))
+            await asyncio.sleep(1 / self.arrival_rate)
+        await asyncio.gather(*users)
+        interactions_done = time.time()
+
+        # Напоминания: сообщения бота в ЛС симулированных пользователей
+        deadline = max(self.deadlines.values(), default=time.time()) + drain_timeout
+        while time.time() < deadline and len(self.deliveries()) < len(self.deadlines):
+            await asyncio.sleep(0.5)
+        deliveries = self.deliveries()
+        lateness = [sent - self.deadlines[channel] for sent, channel in deliveries]
+        delivery_window = (max(sent for sent, _ in deliveries) - min(sent for sent, _ in deliveries)) \
+            if len(deliveries) > 1 else 0.0
+        return {
+            'users': self.users,
+            'arrival_rate': self.arrival_rate,
+            'think_time': self.think_time,
+            'interaction_seconds': interactions_done - began,
+            'errors': dict(self.errors),
+            'latency_ms': {
+                step: {'p50': percentile(samples, 0.5) * 1e3, 'p99': percentile(samples, 0.99) * 1e3,
+                       'count': len(samples)}
+                for step, samples in self.latency.items()
+            },
+            'deliveries': len(deliveries),
+            'delivery_rate': len(deliveries) / delivery_window if delivery_window else 0.0,
+            'lateness_p50': percentile(lateness, 0.5),
+            'lateness_p99': percentile(lateness, 0.99),
+            'requests': self.server.requests,
+            'rate_limited': self.server.rate_limited,
+        }
+
+    def deliveries(self):
+        return [(sent, channel) for sent, channel in self.server.messages if channel in self.deadlines]
+
+async def serve(args):
+    server = FakeDiscord(latency=args.latency, global_limit=args.global_limit, shards=args.shards,
+                         ready_delay=args.ready_delay)
+    base = await server.start(args.port)
+    print(f"🧪 Заглушка Discord: DISCORD_API_BASE={base} DISCORD_GATEWAY_URL={server.gateway_url}", flush=True)
+    if args.guilds:
+        await server.ready.wait()
+        await server.populate(args.guilds, args.members)
+        print(json.dumps({'guilds': args.guilds, 'members': args.members}), flush=True)
+    if args.users:
+        driver = LoadDriver(server, args.users, args.rate, args.timer_minutes, args.think_time)
+        report = await driver.run(args.drain_timeout)
+        print(json.dumps(report, ensure_ascii=False), flush=True)
+    else:
+        # Только серверы: заглушка работает, пока её не остановят
+        await asyncio.Event().wait()
+    await server.stop()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Локальная замена Discord для нагрузочных тестов')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--users', type=int, default=1000, help='симулированных пользователей')
+    parser.add_argument('--rate', type=float, default=20, help='новых пользователей в секунду')
+    parser.add_argument('--think-time', type=float, default=1.0, help='средняя пауза пользователя между шагами, с')
+    parser.add_argument('--timer-minutes', type=int, default=1, help='таймер, который ставит каждый пользователь')
+    parser.add_argument('--latency', type=float, default=0.01, help='задержка ответа REST, с')
+    parser.add_argument('--global-limit', type=int, default=50, help='запросов в секунду до ответа 429')
+    parser.add_argument('--guilds', type=int, default=0, help='серверов, к которым подключён бот')
+    parser.add_argument('--members', type=int, default=100, help='участников на сервер')
+    parser.add_argument('--shards', type=int, default=1, help='шардов в ответе /gateway/bot')
+    parser.add_argument('--ready-delay', type=float, default=0, help='задержка READY после IDENTIFY, с')
+    parser.add_argument('--drain-timeout', type=float, default=120, help='сколько ждать доставки после срока, с')
+    asyncio.run(serve(parser.parse_args()))
@@ -1,42 +1,380 @@
 import discord
-from discord.ext import commands, tasks
+from discord import app_commands
+from discord.ext import tasks
 import os
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
+from datetime import datetime
+import argparse
 import asyncio
+import bisect
+import collections
+import copy
+import functools
+import hashlib
+import hmac
 import json
-from flask import Flask
-from threading import Thread
-import requests
+import math
+import random
+import re
+import heapq
+import secrets
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import zlib
+
+import aiohttp
+import yarl
+from aiohttp import web
 
 # ============================================================================
-# ВЕБ-СЕРВЕР ДЛЯ ПОДДЕРЖАНИЯ РАБОТЫ НА REPLIT
+# МЕТРИКИ В ФОРМАТЕ PROMETHEUS
 # ============================================================================
 
-# Создаем Flask приложение (веб-сервер)
-app = Flask('')
+METRICS = []
+
+def format_sample(name, label, label_value, value, extra=''):
+    labels = []
+    if label is not None and label_value is not None:
+        escaped = str(label_value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        labels.append(f'{label}="{escaped}"')
+    if extra:
+        labels.append(extra)
+    return f"{name}{{{','.join(labels)}}} {value}" if labels else f"{name} {value}"
+
+class Counter:
+    """Счётчик, по желанию с одной меткой"""
+    def __init__(self, name, help_text, label=None):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.values = collections.defaultdict(int)
+        METRICS.append(self)
+
+    def inc(self, label_value=None, amount=1):
+        self.values[label_value] += amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for label_value, value in self.values.items():
+            yield format_sample(self.name, self.label, label_value, value)
+
+class CallbackMetric:
+    """Значение, которое считывается из состояния бота в момент запроса /metrics"""
+    def __init__(self, name, help_text, kind, callback):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.callback = callback
+        METRICS.append(self)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield f"{self.name} {self.callback()}"
+
+class Histogram:
+    """Гистограмма с фиксированными границами: наблюдение — бинарный поиск и два сложения"""
+    def __init__(self, name, help_text, buckets, label=None):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.label = label
+        self.series = {}  # значение метки -> [счётчики по корзинам, сумма, количество]
+        METRICS.append(self)
+
+    def observe(self, value, label_value=None):
+        series = self.series.get(label_value)
+        if series is None:
+            series = self.series[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for label_value, (counts, total, count) in self.series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield format_sample(f"{self.name}_bucket", self.label, label_value, cumulative, f'le="{bound}"')
+            yield format_sample(f"{self.name}_bucket", self.label, label_value, count, 'le="+Inf"')
+            yield format_sample(f"{self.name}_sum", self.label, label_value, total)
+            yield format_sample(f"{self.name}_count", self.label, label_value, count)
+
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+async def metrics_endpoint(request):
+    return web.Response(
+        body=render_metrics().encode(),
+        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+    )
+
+FAST_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+REQUEST_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+LATENESS_BUCKETS = (0.5, 1, 2, 5, 10, 30, 60, 300, 900, 3600)
+
+TICK_DURATION = Histogram(
+    'reminder_bot_tick_duration_seconds', 'Длительность тика check_reminders', FAST_BUCKETS)
+FIRING_LATENESS = Histogram(
+    'reminder_bot_firing_lateness_seconds', 'Опоздание доставки относительно срока напоминания', LATENESS_BUCKETS)
+DM_SEND_LATENCY = Histogram(
+    'reminder_bot_dm_send_seconds', 'Время отправки личного сообщения, включая ожидание лимитов', REQUEST_BUCKETS)
+SAVE_DURATION = Histogram(
+    'reminder_bot_save_duration_seconds', 'Длительность сохранения данных', FAST_BUCKETS)
+HANDLER_LATENCY = Histogram(
+    'reminder_bot_handler_seconds', 'Время обработки команд, модальных окон и кнопок', FAST_BUCKETS, label='handler')
+DELIVERY_FAILURES = Counter(
+    'reminder_bot_delivery_failures_total', 'Неудачные доставки по типу исключения', label='exception')
+DELIVERY_RETRIES = Counter(
+    'reminder_bot_delivery_retries_total', 'Напоминаний, поставленных на повтор доставки')
+DELIVERED_AFTER_RETRY = Counter(
+    'reminder_bot_delivered_after_retry_total', 'Напоминаний, доставленных с повторной попытки')
+DEAD_LETTERS = Counter(
+    'reminder_bot_dead_letters_total', 'Напоминаний, отложенных в недоставленные, по типу исключения', label='exception')
+
+LOOP_LAG = Histogram(
+    'reminder_bot_loop_lag_seconds', 'Опоздание пробуждения event loop', FAST_BUCKETS)
+LOOP_STALLS = Counter(
+    'reminder_bot_loop_stalls_total', 'Блокировок event loop дольше порога по задаче-виновнику', label='task')
+
+CallbackMetric('reminder_bot_reminders_pending', 'Напоминаний в хранилище, ожидающих срока или доставки',
+               'gauge', lambda: pending_reminders_count())
+CallbackMetric('reminder_bot_oldest_overdue_seconds', 'Опоздание самого старого наступившего, но не доставленного напоминания',
+               'gauge', lambda: oldest_overdue(time.time()))
+CallbackMetric('reminder_bot_delivery_queue_batches', 'Пачек в очереди доставки',
+               'gauge', lambda: delivery_pipeline.queue.qsize())
+CallbackMetric('reminder_bot_reminders_fired_total', 'Наступивших напоминаний, переданных на доставку',
+               'counter', lambda: delivery_pipeline.reminders_fired)
+CallbackMetric('reminder_bot_reminders_delivered_total', 'Доставленных напоминаний',
+               'counter', lambda: delivery_pipeline.delivered)
+CallbackMetric('reminder_bot_reminders_failed_total', 'Недоставленных напоминаний',
+               'counter', lambda: delivery_pipeline.failed)
+CallbackMetric('reminder_bot_catchup_backlog', 'Просроченных за время простоя напоминаний, ещё не переданных на доставку',
+               'gauge', lambda: len(catch_up.backlog))
+CallbackMetric('reminder_bot_catchup_drain_seconds', 'За сколько секунд доставлены просроченные за время простоя напоминания',
+               'gauge', lambda: catch_up.drain_seconds or 0)
+CallbackMetric('reminder_bot_delivery_retries_pending', 'Напоминаний, ожидающих повторной доставки',
+               'gauge', lambda: len(delivery_pipeline.attempts))
+CallbackMetric('reminder_bot_dms_sent_total', 'Отправленных личных сообщений',
+               'counter', lambda: delivery_pipeline.dms_sent)
+CallbackMetric('reminder_bot_rate_limited_total', 'Ответов 429 при доставке',
+               'counter', lambda: delivery_pipeline.rate_limited)
+CallbackMetric('reminder_bot_dm_cache_gateway_hits_total', 'Личных каналов из кэша gateway',
+               'counter', lambda: dm_channel_cache.gateway_hits)
+CallbackMetric('reminder_bot_dm_cache_hits_total', 'Попаданий в кэш личных каналов',
+               'counter', lambda: dm_channel_cache.hits)
+CallbackMetric('reminder_bot_dm_cache_misses_total', 'Промахов кэша личных каналов',
+               'counter', lambda: dm_channel_cache.misses)
+CallbackMetric('reminder_bot_menu_cache_hits_total', 'Попаданий в кэш отрисовки меню',
+               'counter', lambda: menu_cache.hits)
+CallbackMetric('reminder_bot_menu_cache_misses_total', 'Промахов кэша отрисовки меню',
+               'counter', lambda: menu_cache.misses)
+CallbackMetric('reminder_bot_persistence_flushes_total', 'Записей накопленных изменений на диск',
+               'counter', lambda: persistence_writer.flushes)
+CallbackMetric('reminder_bot_persistence_lag_seconds', 'Время от изменения до записи на диск в последней записи',
+               'gauge', lambda: persistence_writer.last_lag)
+CallbackMetric('reminder_bot_persistence_max_lag_seconds', 'Наибольшее время от изменения до записи на диск',
+               'gauge', lambda: persistence_writer.max_lag)
+
+def timed(handler_name):
+    """Записывает время работы обработчика в HANDLER_LATENCY"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            began = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                HANDLER_LATENCY.observe(time.perf_counter() - began, handler_name)
+        return wrapper
+    return decorator
+
+# ============================================================================
+# МОНИТОРИНГ EVENT LOOP
+# ============================================================================
+
+STALL_STACK_DEPTH = 15
 
-@app.route('/')
-def home():
-    return "🤖 Бот напоминаний работает! Статус: онлайн"
+def describe_task(task):
+    """Имя корутины задачи для отчёта о блокировке"""
+    if task is None:
+        return 'обратный вызов вне задачи'
+    coro = task.get_coro()
+    return getattr(coro, '__qualname__', None) or task.get_name()
 
-@app.route('/ping')
-def ping():
-    return "pong", 200
+class LoopMonitor:
+    """Замер задержек event loop и поиск виновников блокировок.
 
-@app.route('/health')
-def health():
-    return "🤖 Бот напоминаний работает! Статус: онлайн", 200
+    Задача-пульс просыпается каждые interval секунд и записывает опоздание.
+    Поток-наблюдатель раз в threshold / 2 проверяет пульс; если его нет дольше
+    порога, loop занят, и наблюдатель снимает стек потока loop и текущую задачу.
+    Стек снимается только во время блокировки, поэтому в обычной работе
+    монитор стоит одно пробуждение за interval.
+    """
+    MAX_STALLS = 20
 
-def run_webserver():
-    """Запускает веб-сервер в отдельном потоке"""
-    app.run(host='0.0.0.0', port=5000)
+    def __init__(self):
+        self.interval = None
+        self.threshold = None
+        self.stalls = collections.deque(maxlen=self.MAX_STALLS)
+        self.stall_count = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._loop = None
+        self._loop_thread_id = None
+        self._last_beat = 0.0
+        self._capture = None
+        self._task = None
+        self._stop = threading.Event()
+
+    def start(self, interval, threshold):
+        if self._task is not None:
+            return
+        self.interval = interval
+        self.threshold = threshold
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        threading.Thread(target=self._watchdog, name='loop-watchdog', daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _heartbeat(self):
+        while True:
+            previous = self._last_beat
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._last_beat = now
+            lag = max(0.0, now - previous - self.interval)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            LOOP_LAG.observe(lag)
+
+            # Снимок относится к этой блокировке, только если снят после предыдущего пульса
+            capture, self._capture = self._capture, None
+            if lag >= self.threshold:
+                self._record_stall(lag, capture if capture and capture['beat'] == previous else None)
+
+    def _watchdog(self):
+        while not self._stop.wait(self.threshold / 2):
+            beat = self._last_beat
+            if self._capture is None and time.monotonic() - beat > self.threshold:
+                self._capture = self._capture_stack(beat)
+
+    def _capture_stack(self, beat):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = traceback.extract_stack(frame) if frame is not None else []
+        # Виновник — самый глубокий кадр кода бота, а не библиотек
+        where = next((entry for entry in reversed(stack) if entry.filename == __file__), None)
+        if where is None and stack:
+            where = stack[-1]
+        return {
+            'beat': beat,
+            'task': describe_task(asyncio.current_task(self._loop)),
+            'where': f"{os.path.basename(where.filename)}:{where.lineno} в {where.name}" if where else 'неизвестно',
+            'stack': [line.rstrip() for line in traceback.format_list(stack[-STALL_STACK_DEPTH:])],
+        }
+
+    def _record_stall(self, lag, capture):
+        if capture is None:
+            capture = {'task': 'неизвестно', 'where': 'стек не снят: блокировка короче периода наблюдателя', 'stack': []}
+        stall = {
+            'at': datetime.now().isoformat(timespec='seconds'),
+            'seconds': round(lag, 3),
+            'task': capture['task'],
+            'where': capture['where'],
+            'stack': capture['stack'],
+        }
+        self.stalls.append(stall)
+        self.stall_count += 1
+        LOOP_STALLS.inc(stall['task'])
+        print(f"🐢 Event loop заблокирован на {lag:.2f} с: {stall['task']} ({stall['where']})")
+
+    def report(self, details=True):
+        """Сводка задержек; без details у блокировок остаются только время и длительность"""
+        stalls = list(self.stalls)
+        if not details:
+            stalls = [{'at': stall['at'], 'seconds': stall['seconds']} for stall in stalls]
+        return {
+            'interval': self.interval,
+            'threshold': self.threshold,
+            'last_lag': round(self.last_lag, 4),
+            'max_lag': round(self.max_lag, 4),
+            'stalls': self.stall_count,
+            'recent_stalls': stalls,
+        }
 
-def keep_alive():
-    """Запускает веб-сервер для поддержания работы на Replit"""
-    t = Thread(target=run_webserver)
-    t.daemon = True
-    t.start()
+loop_monitor = LoopMonitor()
+
+async def loop_health(request):
+    # Порт проверок открыт наружу (fly.toml), поэтому стеки с путями к файлам —
+    # только по LOOP_REPORT_STACKS=1; в лог блокировки пишутся всегда
+    report = loop_monitor.report(details=LOOP_REPORT_STACKS)
+    return web.json_response(report, dumps=functools.partial(json.dumps, ensure_ascii=False))
+
+# ============================================================================
+# ВЕБ-СЕРВЕР ДЛЯ ПРОВЕРКИ РАБОТОСПОСОБНОСТИ
+# ============================================================================
+
+STATUS_TEXT = "🤖 Бот напоминаний работает! Статус: онлайн"
+
+async def home(request):
+    return web.Response(text=STATUS_TEXT)
+
+async def ping(request):
+    return web.Response(text="pong")
+
+async def health(request):
+    return web.Response(text=STATUS_TEXT)
+
+class HealthServer:
+    """HTTP-сервер проверок на event loop бота: без отдельного потока и блокирующих вызовов"""
+    def __init__(self):
+        self.runner = None
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_get('/', home)
+        app.router.add_get('/ping', ping)
+        app.router.add_get('/health', health)
+        app.router.add_get('/health/loop', loop_health)
+        app.router.add_get('/metrics', metrics_endpoint)
+        if CLUSTER_COUNT > 1:
+            app.router.add_post('/cluster/reminders', cluster_add_reminder)
+            app.router.add_get('/cluster/reminders/{user_id}', cluster_user_reminders)
+            app.router.add_post('/cluster/categories', cluster_category_changed)
+        return app
+
+    async def start(self, port):
+        self.runner = web.AppRunner(self.create_app(), access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, '0.0.0.0', port).start()
+        print(f"🌐 Веб-сервер проверок слушает порт {port}")
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+health_server = HealthServer()
 
 # ============================================================================
 # ОСНОВНОЙ КОД БОТА
@@ -46,16 +384,232 @@ def keep_alive():
 load_dotenv()
 
 # Настройка бота
-intents = discord.Intents.all()
-bot = commands.Bot(command_prefix='/', intents=intents, help_command=None)
+# minimal — только события, которые использует бот, и почти без кэшей; full — Intents.all()
+GATEWAY_MODE = os.getenv('GATEWAY_MODE', 'minimal')
+MESSAGE_CACHE_SIZE = int(os.getenv('MESSAGE_CACHE_SIZE', '100'))
+
+def gateway_options():
+    """Интенты и кэши discord.py для выбранного режима gateway"""
+    if GATEWAY_MODE == 'full':
+        return {'intents': discord.Intents.all()}
+    intents = discord.Intents.none()
+    # Команды — слэш-команды, сообщения боту не нужны; остаются каналы и роли
+    # серверов, по которым is_admin узнаёт названия ролей
+    intents.guilds = True
+    return {
+        'intents': intents,
+        # Роли автора приходят вместе с взаимодействием, кэш участников не нужен
+        'member_cache_flags': discord.MemberCacheFlags.none(),
+        'chunk_guilds_at_startup': False,
+        'max_messages': MESSAGE_CACHE_SIZE,
+    }
+
+GATEWAY_OPTIONS = gateway_options()
+intents = GATEWAY_OPTIONS['intents']
+
+# Кластер: CLUSTER_COUNT процессов, у каждого свои шарды и своя часть напоминаний
+CLUSTER_ID = int(os.getenv('CLUSTER_ID', '0'))
+CLUSTER_COUNT = int(os.getenv('CLUSTER_COUNT', '1'))
+# Число шардов одинаково во всех процессах; без кластера и SHARD_COUNT — сколько рекомендует Discord
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '0')) or (CLUSTER_COUNT if CLUSTER_COUNT > 1 else None)
+CLUSTER_SECRET = os.getenv('CLUSTER_SECRET', '')
+
+def shard_options():
+    """Шарды процесса: каждый CLUSTER_COUNT-й, начиная с CLUSTER_ID"""
+    if SHARD_COUNT is None:
+        return {}
+    return {
+        'shard_count': SHARD_COUNT,
+        'shard_ids': [shard_id for shard_id in range(SHARD_COUNT) if shard_id % CLUSTER_COUNT == CLUSTER_ID],
+    }
+
+class ReminderBot(discord.AutoShardedClient):
+    """Бот со слэш-командами и фоновыми службами, которые запускаются и останавливаются вместе с ним.
+
+    Это клиент, а не commands.Bot: текстовых команд нет, и сообщения не разбираются.
+    """
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.tree = app_commands.CommandTree(self)
+
+    async def setup_hook(self):
+        # Выполняется один раз за запуск, после входа по токену и до подключения
+        # к gateway: напоминания доставляются через REST, не дожидаясь READY,
+        # а переподключения gateway состояние не трогают
+        started = time.perf_counter()
+        load_data()
+        cache_subcategory_durations()
+        dead_letters.load()
+        init_default_categories()
+        catch_up.start(time.time())
+        check_reminders.start()
+        if PERSISTENCE_MODE == 'journal':
+            journal_compaction.start()
+        if PERSISTENCE_MODE == 'sqlite':
+            sqlite_window_refill.start()
+        print(f"⏱️ Данные загружены, планировщик запущен за {(time.perf_counter() - started) * 1e3:.0f} мс")
+        persistence_writer.start()
+        delivery_pipeline.start()
+        if LOOP_MONITOR_INTERVAL > 0:
+            loop_monitor.start(LOOP_MONITOR_INTERVAL, LOOP_STALL_THRESHOLD)
+        try:
+            await health_server.start(HEALTH_PORT)
+        except OSError as e:
+            print(f"❌ Не удалось запустить веб-сервер проверок: {e}")
+        # Один раз на процесс: кнопки всех меню, включая отправленные до перезапуска
+        self.add_dynamic_items(MenuButton)
+        # Команды общие для всех процессов кластера, синхронизирует их первый
+        if CLUSTER_ID == 0:
+            await sync_command_tree(self.tree)
+        try:
+            self.loop.add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(self.close()))
+        except NotImplementedError:
+            pass
+
+    async def close(self):
+        if not self.is_closed():
+            await health_server.stop()
+            loop_monitor.stop()
+            catch_up.stop()
+            await delivery_pipeline.stop()
+            await cluster_link.close()
+            await persistence_writer.close()
+            print("💾 Данные сохранены перед остановкой")
+        await super().close()
+
+bot = ReminderBot(
+    # Статус уходит в IDENTIFY и восстанавливается при каждом переподключении сам
+    activity=discord.Activity(type=discord.ActivityType.listening, name="/старт - Умные напоминания"),
+    **GATEWAY_OPTIONS, **shard_options()
+)
 
 # Хранилища данных
 reminders = {}
+user_index = {}  # user_id -> множество reminder_id
 categories_data = {}
 USERS_FILE = 'users_data.json'
 CATEGORIES_FILE = 'categories.json'
+JOURNAL_FILE = 'data.journal'
+DATABASE_FILE = 'reminders.db'
+COMMAND_TREE_HASH_FILE = 'command_tree.hash'
+DEAD_LETTERS_FILE = 'dead_letters.jsonl'
+PERSISTENCE_MODE = os.getenv('PERSISTENCE_MODE', 'snapshot')  # snapshot, journal или sqlite
+JOURNAL_COMPACT_MINUTES = float(os.getenv('JOURNAL_COMPACT_MINUTES', '10'))
+PERSISTENCE_FLUSH_SECONDS = float(os.getenv('PERSISTENCE_FLUSH_SECONDS', '1'))
+# Режим snapshot копирует всё хранилище в цикле событий; копии занимают не больше этой доли времени
+SNAPSHOT_LOOP_SHARE = float(os.getenv('SNAPSHOT_LOOP_SHARE', '0.01'))
+SQLITE_WINDOW_HOURS = float(os.getenv('SQLITE_WINDOW_HOURS', '24'))
+DELIVERY_WORKERS = int(os.getenv('DELIVERY_WORKERS', '8'))
+DELIVERY_GLOBAL_RATE = float(os.getenv('DELIVERY_GLOBAL_RATE', '40'))  # запросов/с, лимит Discord — 50
+DELIVERY_ROUTE_RATE = float(os.getenv('DELIVERY_ROUTE_RATE', '1'))  # сообщений/с в один ЛС, лимит — 5 за 5 с
+DELIVERY_ROUTE_BURST = int(os.getenv('DELIVERY_ROUTE_BURST', '5'))
+# Повтор после временной ошибки: задержка удваивается от DELIVERY_RETRY_BASE до
+# DELIVERY_RETRY_MAX секунд, после DELIVERY_MAX_ATTEMPTS попыток — в недоставленные
+DELIVERY_MAX_ATTEMPTS = int(os.getenv('DELIVERY_MAX_ATTEMPTS', '5'))
+DELIVERY_RETRY_BASE = float(os.getenv('DELIVERY_RETRY_BASE', '5'))
+DELIVERY_RETRY_MAX = float(os.getenv('DELIVERY_RETRY_MAX', '600'))
+NDJSON_BATCH = int(os.getenv('NDJSON_BATCH', '1000'))  # записей в пачке импорта и экспорта NDJSON
+DEAD_LETTERS_KEPT = int(os.getenv('DEAD_LETTERS_KEPT', '1000'))  # последних недоставленных в памяти для /недоставленные
+HEALTH_PORT = int(os.getenv('PORT', '8080'))  # fly.toml: internal_port = 8080
+# Процессы кластера слушают соседние порты; адреса можно задать явно через CLUSTER_PEERS
+CLUSTER_PEERS = os.getenv('CLUSTER_PEERS', '').split(',') if os.getenv('CLUSTER_PEERS') else [
+    f"http://127.0.0.1:{HEALTH_PORT + cluster_id}" for cluster_id in range(CLUSTER_COUNT)
+]
+if CLUSTER_COUNT > 1 and HEALTH_PORT:
+    HEALTH_PORT += CLUSTER_ID
+DISCORD_API_BASE = os.getenv('DISCORD_API_BASE')  # Для нагрузочных тестов: REST API fake_discord.py
+DISCORD_GATEWAY_URL = os.getenv('DISCORD_GATEWAY_URL')  # и его gateway
+LOOP_MONITOR_INTERVAL = float(os.getenv('LOOP_MONITOR_INTERVAL', '0.1'))  # 0 — монитор выключен
+LOOP_STALL_THRESHOLD = float(os.getenv('LOOP_STALL_THRESHOLD', '0.25'))  # секунд блокировки до снятия стека
+LOOP_REPORT_STACKS = os.getenv('LOOP_REPORT_STACKS', '0') == '1'  # стеки блокировок в /health/loop
+DM_CACHE_SIZE = int(os.getenv('DM_CACHE_SIZE', '10000'))
+DM_CACHE_TTL = float(os.getenv('DM_CACHE_TTL', '3600'))
+# Окно объединения: напоминания одного пользователя, наступающие в пределах окна,
+# уходят одним сообщением (0 — каждое напоминание отдельным сообщением)
+DELIVERY_COALESCE_SECONDS = float(os.getenv('DELIVERY_COALESCE_SECONDS', '0'))
+# Догоняющая доставка: просроченные за время простоя напоминания уходят не быстрее
+# CATCHUP_RATE в секунду на бота, остальная пропускная способность — наступающим вовремя
+CATCHUP_RATE = float(os.getenv('CATCHUP_RATE', '10'))
+LATE_MARK_SECONDS = float(os.getenv('LATE_MARK_SECONDS', '60'))  # с какого опоздания сообщение помечается
 ADMIN_ROLES = ['Администратор', 'Директор']  # Роли с правами администратора
 
+def cluster_file(path):
+    """Файл данных своей части кластера: users_data.json -> users_data.cluster1.json"""
+    if CLUSTER_COUNT == 1:
+        return path
+    base, extension = os.path.splitext(path)
+    return f"{base}.cluster{CLUSTER_ID}{extension}"
+
+# Первый запуск кластера читает общие файлы однопроцессного бота и оставляет свою часть
+SHARED_USERS_FILE, SHARED_CATEGORIES_FILE = USERS_FILE, CATEGORIES_FILE
+USERS_FILE, CATEGORIES_FILE, JOURNAL_FILE, DATABASE_FILE, DEAD_LETTERS_FILE = map(
+    cluster_file, (USERS_FILE, CATEGORIES_FILE, JOURNAL_FILE, DATABASE_FILE, DEAD_LETTERS_FILE)
+)
+
+# ============================================================================
+# МОДЕЛЬ НАПОМИНАНИЯ
+# ============================================================================
+
+class Reminder:
+    """Компактная запись напоминания.
+
+    Срок хранится целым числом секунд epoch (с округлением вверх, чтобы
+    напоминание не сработало раньше срока), категория — интернированными
+    ключами categories_data вместо копии отображаемой строки.
+    """
+    __slots__ = ('user_id', 'end_ts', 'category_key', 'sub_key', 'message', 'label')
+
+    def __init__(self, user_id, end_ts, category_key, sub_key, message, label=None):
+        self.user_id = int(user_id)
+        self.end_ts = math.ceil(end_ts)
+        self.category_key = sys.intern(category_key) if category_key else None
+        self.sub_key = sys.intern(sub_key) if sub_key else None
+        self.message = message
+        self.label = sys.intern(label) if label else None
+
+    @property
+    def category(self):
+        """Отображаемое название «Категория - Подкатегория»"""
+        category = categories_data.get(self.category_key)
+        if category:
+            subcategory = category['subcategories'].get(self.sub_key)
+            if subcategory:
+                return f"{category['name']} - {subcategory['name']}"
+        return self.label or '❔ Удалённая категория'
+
+    @property
+    def end_time(self):
+        return datetime.fromtimestamp(self.end_ts)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Чтение записи из users_data.json, включая старый формат без ключей"""
+        end_time = data['end_time']
+        if isinstance(end_time, str):
+            end_time = datetime.fromisoformat(end_time).timestamp()
+        message = data['message']
+        if message is not None:
+            message = sys.intern(message)
+        # Сохранённое название остаётся запасным на случай удаления категории;
+        # после интернирования оно одно на все напоминания категории
+        return cls(
+            data['user_id'], end_time, data.get('category_key'), data.get('sub_key'),
+            message, data.get('category')
+        )
+
+    def to_dict(self):
+        """Запись в формате users_data.json"""
+        data = {
+            'message': self.message,
+            'end_time': self.end_time.isoformat(),
+            'user_id': self.user_id,
+            'category': self.category
+        }
+        if self.category_key:
+            data['category_key'] = self.category_key
+            data['sub_key'] = self.sub_key
+        return data
+
 # ============================================================================
 # СИСТЕМА ХРАНЕНИЯ ДАННЫХ
 # ============================================================================
@@ -63,27 +617,765 @@ ADMIN_ROLES = ['Администратор', 'Директор']  # Роли с
 def load_data():
     """Загрузка данных из файлов при запуске бота"""
     global reminders, categories_data
+    # Категории заменяются целиком — отрисованные меню больше не актуальны
+    menu_cache.bump()
+    if PERSISTENCE_MODE == 'sqlite':
+        load_from_sqlite()
+        return
     try:
-        if os.path.exists(USERS_FILE):
-            with open(USERS_FILE, 'r', encoding='utf-8') as f:
-                reminders = json.load(f)
-        if os.path.exists(CATEGORIES_FILE):
-            with open(CATEGORIES_FILE, 'r', encoding='utf-8') as f:
+        users_file = USERS_FILE if os.path.exists(USERS_FILE) else SHARED_USERS_FILE
+        if os.path.exists(users_file):
+            # Снимок читается по одной записи: в памяти не бывает всего файла сразу
+            reminders = {
+                reminder_id: Reminder.from_dict(reminder_data)
+                for reminder_id, reminder_data in iter_json_object(users_file)
+                if owns_user(reminder_data['user_id'])
+            }
+        categories_file = CATEGORIES_FILE if os.path.exists(CATEGORIES_FILE) else SHARED_CATEGORIES_FILE
+        if os.path.exists(categories_file):
+            with open(categories_file, 'r', encoding='utf-8') as f:
                 categories_data = json.load(f)
+        replayed = replay_journal()
+        rebuild_indexes()
         print("✅ Данные успешно загружены")
+        if replayed:
+            print(f"📜 Из журнала восстановлено изменений: {replayed}")
+            compact_journal()
     except Exception as e:
         print(f"❌ Ошибка загрузки данных: {e}")
 
+def write_json_atomic(path, data):
+    """Атомарная запись JSON: временный файл, fsync и переименование"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+def write_reminders_atomic(path, items):
+    """Атомарная запись users_data.json по одному напоминанию, без словаря всех записей в памяти"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write('{')
+        separator = '\n'
+        for reminder_id, reminder in items:
+            f.write(f"{separator}  {json.dumps(reminder_id, ensure_ascii=False)}: "
+                    f"{json.dumps(reminder.to_dict(), ensure_ascii=False)}")
+            separator = ',\n'
+        f.write('\n}\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+json_decoder = json.JSONDecoder()
+
+def iter_json_object(path, chunk_size=1 << 16):
+    """Пары ключ-значение JSON-объекта верхнего уровня, прочитанные из файла кусками"""
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer, position, eof = '', 0, False
+
+        def read_more():
+            nonlocal buffer, position, eof
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+
+        def skip_space():
+            nonlocal position
+            while True:
+                while position < len(buffer) and buffer[position].isspace():
+                    position += 1
+                if position < len(buffer) or eof:
+                    return
+                read_more()
+
+        def expect(chars):
+            nonlocal position
+            skip_space()
+            if position >= len(buffer) or buffer[position] not in chars:
+                raise ValueError(f"{path}: ожидался один из символов {chars!r}")
+            position += 1
+            return buffer[position - 1]
+
+        def value():
+            nonlocal position
+            skip_space()
+            while True:
+                try:
+                    result, end = json_decoder.raw_decode(buffer, position)
+                except ValueError:
+                    if eof:
+                        raise
+                    read_more()
+                    continue
+                # Число в конце куска могло оборваться на середине
+                if end == len(buffer) and not eof:
+                    read_more()
+                    continue
+                position = end
+                return result
+
+        read_more()
+        expect('{')
+        char = expect('"}')
+        while char == '"':
+            position -= 1
+            key = value()
+            expect(':')
+            yield key, value()
+            if expect(',}') == '}':
+                break
+            char = expect('"')
+
+def persisted_reminders():
+    """Напоминания, которые должны быть на диске: хранилище и ещё не доставленные пачки очереди"""
+    if not delivery_pipeline.pending:
+        return reminders
+    return {**delivery_pipeline.pending, **reminders}
+
+def take_snapshot():
+    """Копия состояния для записи в фоновом потоке"""
+    return dict(persisted_reminders()), copy.deepcopy(categories_data)
+
+def write_snapshot(reminders_snapshot, categories_snapshot):
+    write_reminders_atomic(USERS_FILE, reminders_snapshot.items())
+    write_json_atomic(CATEGORIES_FILE, categories_snapshot)
+
 def save_data():
     """Сохранение данных в файлы"""
     try:
-        with open(USERS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(reminders, f, ensure_ascii=False, indent=2)
-        with open(CATEGORIES_FILE, 'w', encoding='utf-8') as f:
-            json.dump(categories_data, f, ensure_ascii=False, indent=2)
+        write_snapshot(persisted_reminders(), categories_data)
     except Exception as e:
         print(f"❌ Ошибка сохранения данных: {e}")
 
+# ----------------------------------------------------------------------------
+# Журнал изменений (PERSISTENCE_MODE=journal)
+# ----------------------------------------------------------------------------
+# Каждое изменение дописывается в журнал одной компактной строкой JSON,
+# периодическое сжатие пишет свежий снимок и очищает журнал.
+
+journal_file = None
+
+def append_journal(records):
+    """Дописывает записи в журнал изменений"""
+    global journal_file
+    if journal_file is None:
+        journal_file = open(JOURNAL_FILE, 'a', encoding='utf-8')
+    journal_file.write(''.join(
+        json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n' for record in records
+    ))
+    journal_file.flush()
+    os.fsync(journal_file.fileno())
+
+def apply_journal_record(record):
+    """Применяет запись журнала к данным в памяти"""
+    op = record['op']
+    if op == 'add':
+        reminders[record['id']] = Reminder.from_dict(record['reminder'])
+    elif op == 'del':
+        for reminder_id in record['ids']:
+            reminders.pop(reminder_id, None)
+    elif op == 'category':
+        categories_data[record['key']] = record['data']
+    elif op == 'category_del':
+        categories_data.pop(record['key'], None)
+
+def replay_journal():
+    """Применяет хвост журнала поверх загруженного снимка"""
+    if not os.path.exists(JOURNAL_FILE):
+        return 0
+    replayed = 0
+    with open(JOURNAL_FILE, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Недописанная строка после аварийной остановки
+                print("⚠️ Пропущена повреждённая запись журнала")
+                continue
+            apply_journal_record(record)
+            replayed += 1
+    return replayed
+
+def compact_journal(snapshot=None):
+    """Записывает свежий снимок и очищает журнал"""
+    global journal_file
+    write_snapshot(*(snapshot or (persisted_reminders(), categories_data)))
+    if journal_file is not None:
+        journal_file.close()
+        journal_file = None
+    if os.path.exists(JOURNAL_FILE):
+        open(JOURNAL_FILE, 'w').close()
+
+@tasks.loop(minutes=JOURNAL_COMPACT_MINUTES)
+async def journal_compaction():
+    """Периодическое сжатие журнала"""
+    if journal_file is not None:
+        await persistence_writer.flush(compact=True)
+
+# ----------------------------------------------------------------------------
+# Хранилище SQLite (PERSISTENCE_MODE=sqlite)
+# ----------------------------------------------------------------------------
+# В памяти держатся только напоминания ближайших SQLITE_WINDOW_HOURS часов,
+# остальные лежат в базе и подгружаются по индексу end_time по мере приближения.
+
+class SqliteStore:
+    """Напоминания и категории в SQLite с WAL-журналом и индексами по сроку и пользователю"""
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS reminders (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            end_time INTEGER NOT NULL,
+            category_key TEXT,
+            sub_key TEXT,
+            message TEXT,
+            label TEXT
+        );
+        CREATE INDEX IF NOT EXISTS reminders_end_time ON reminders (end_time);
+        CREATE INDEX IF NOT EXISTS reminders_user_id ON reminders (user_id, end_time);
+        CREATE TABLE IF NOT EXISTS categories (
+            key TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path):
+        # Пишет только поток фоновой записи; цикл событий читает своим соединением,
+        # WAL позволяет читать параллельно с записью
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(self.SCHEMA)
+        self.reader = sqlite3.connect(path, check_same_thread=False)
+        self.path = path
+        self._local = threading.local()  # соединения потоков, которые читают списки пользователей
+        self.beyond_horizon = 0  # напоминаний в базе позже окна памяти на момент последней записи
+
+    @staticmethod
+    def _reminder(row):
+        user_id, end_time, category_key, sub_key, message, label = row
+        return Reminder(user_id, end_time, category_key, sub_key, message, label)
+
+    def is_empty(self):
+        return self.reader.execute(
+            'SELECT NOT EXISTS (SELECT 1 FROM reminders) AND NOT EXISTS (SELECT 1 FROM categories)'
+        ).fetchone()[0]
+
+    def load_categories(self):
+        return {
+            key: json.loads(data)
+            for key, data in self.reader.execute('SELECT key, data FROM categories')
+        }
+
+    def reminders_between(self, after, until):
+        """Напоминания со сроком в (after, until] по индексу end_time"""
+        rows = self.reader.execute(
+            'SELECT id, user_id, end_time, category_key, sub_key, message, label '
+            'FROM reminders WHERE end_time > ? AND end_time <= ? ORDER BY end_time',
+            (after, until)
+        )
+        for row in rows:
+            yield row[0], self._reminder(row[1:])
+
+    def user_reminders(self, user_id, after):
+        """Напоминания пользователя со сроком позже after по индексу user_id; вызывается в потоке"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.path)
+        rows = connection.execute(
+            'SELECT id, user_id, end_time, category_key, sub_key, message, label '
+            'FROM reminders WHERE user_id = ? AND end_time > ? ORDER BY end_time',
+            (user_id, after)
+        )
+        return [(row[0], self._reminder(row[1:])) for row in rows]
+
+    def count_after(self, after, connection=None):
+        """Пересчитывает напоминания со сроком позже after по индексу end_time"""
+        connection = connection or self.connection
+        self.beyond_horizon = connection.execute(
+            'SELECT COUNT(*) FROM reminders WHERE end_time > ?', (after,)
+        ).fetchone()[0]
+
+    def apply(self, records):
+        """Применяет записи изменений (формат журнала) одной транзакцией"""
+        with self.connection:
+            for record in records:
+                op = record['op']
+                if op == 'add':
+                    reminder = Reminder.from_dict(record['reminder'])
+                    self.connection.execute(
+                        'INSERT OR REPLACE INTO reminders VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (record['id'], reminder.user_id, reminder.end_ts, reminder.category_key,
+                         reminder.sub_key, reminder.message, reminder.label or reminder.category)
+                    )
+                elif op == 'del':
+                    self.connection.executemany(
+                        'DELETE FROM reminders WHERE id = ?', [(rid,) for rid in record['ids']]
+                    )
+                elif op == 'category':
+                    self.connection.execute(
+                        'INSERT OR REPLACE INTO categories VALUES (?, ?)',
+                        (record['key'], json.dumps(record['data'], ensure_ascii=False))
+                    )
+                elif op == 'category_del':
+                    self.connection.execute('DELETE FROM categories WHERE key = ?', (record['key'],))
+
+    def migrate_from_json(self, users_file, categories_file):
+        """Однократный перенос данных из users_data.json и categories.json"""
+        records = []
+        if os.path.exists(categories_file):
+            with open(categories_file, 'r', encoding='utf-8') as f:
+                for key, data in json.load(f).items():
+                    records.append({'op': 'category', 'key': key, 'data': data})
+        migrated = 0
+        if os.path.exists(users_file):
+            for reminder_id, data in iter_json_object(users_file):
+                records.append({'op': 'add', 'id': reminder_id, 'reminder': data})
+                if len(records) >= NDJSON_BATCH:
+                    self.apply(records)
+                    migrated += len(records)
+                    records = []
+        self.apply(records)
+        return migrated + len(records)
+
+sqlite_store = None
+memory_horizon = float('inf')  # напоминания позже этого срока в память не загружаются
+
+def load_from_sqlite():
+    """Загрузка категорий и ближайших напоминаний из базы"""
+    global sqlite_store, categories_data, memory_horizon
+    try:
+        sqlite_store = SqliteStore(DATABASE_FILE)
+        if sqlite_store.is_empty() and (os.path.exists(USERS_FILE) or os.path.exists(CATEGORIES_FILE)):
+            migrated = sqlite_store.migrate_from_json(USERS_FILE, CATEGORIES_FILE)
+            print(f"📦 Перенесено записей из JSON в SQLite: {migrated}")
+        categories_data = sqlite_store.load_categories()
+        reminders.clear()
+        memory_horizon = int(time.time() + SQLITE_WINDOW_HOURS * 3600)
+        for reminder_id, reminder in sqlite_store.reminders_between(float('-inf'), memory_horizon):
+            reminders[reminder_id] = reminder
+        sqlite_store.count_after(memory_horizon, sqlite_store.reader)
+        rebuild_indexes()
+        print("✅ Данные успешно загружены")
+    except Exception as e:
+        print(f"❌ Ошибка загрузки данных: {e}")
+
+@tasks.loop(hours=SQLITE_WINDOW_HOURS / 2)
+async def sqlite_window_refill():
+    """Подгрузка напоминаний, чей срок вошёл в окно памяти"""
+    global memory_horizon
+    until = int(time.time() + SQLITE_WINDOW_HOURS * 3600)
+    if until <= memory_horizon:
+        return
+    previous, memory_horizon = memory_horizon, until
+    rows = with_unflushed(
+        sqlite_store.reminders_between(previous, until),
+        lambda reminder: previous < reminder.end_ts <= until
+    )
+    for reminder_id, reminder in rows:
+        add_reminder(reminder_id, reminder)
+
+def with_unflushed(rows, matches, records=None):
+    """Строки базы с наложенными изменениями, которые фоновая запись ещё не применила.
+
+    Без этого чтение сразу после создания или удаления напоминания видело бы
+    базу на PERSISTENCE_FLUSH_SECONDS в прошлом. records — изменения, снятые до
+    чтения базы; по умолчанию текущие.
+    """
+    found = dict(rows)
+    for record in persistence_writer.unflushed() if records is None else records:
+        if record['op'] == 'add':
+            reminder = Reminder.from_dict(record['reminder'])
+            if matches(reminder):
+                found[record['id']] = reminder
+            else:
+                found.pop(record['id'], None)
+        elif record['op'] == 'del':
+            for reminder_id in record['ids']:
+                found.pop(reminder_id, None)
+    return found.items()
+
+# ----------------------------------------------------------------------------
+# Фоновая запись изменений
+# ----------------------------------------------------------------------------
+
+def prepare_persistence_job(records, compact=False):
+    """Готовит запись накопленных изменений; сама функция выполняется в потоке"""
+    if PERSISTENCE_MODE == 'sqlite':
+        horizon = memory_horizon
+        def job():
+            sqlite_store.apply(records)
+            # Для метрики ожидающих: в памяти только окно, остальное считаем в базе
+            sqlite_store.count_after(horizon)
+        return job
+    if PERSISTENCE_MODE == 'journal':
+        snapshot = take_snapshot() if compact else None
+
+        def job():
+            if records:
+                append_journal(records)
+            if compact:
+                compact_journal(snapshot)
+        return job
+    snapshot = take_snapshot()
+    return lambda: write_snapshot(*snapshot)
+
+class PersistenceWriter:
+    """Фоновая запись изменений на диск.
+
+    Обработчики только отмечают состояние изменённым. Всё, что накопилось за
+    PERSISTENCE_FLUSH_SECONDS, сериализуется и сохраняется одной записью в
+    рабочем потоке, не блокируя цикл событий.
+    """
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval
+        self._records = []
+        self._dirty_since = None
+        self._dirty = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._inflight = None
+        self._inflight_records = []
+        self.flushes = 0
+        self.copy_seconds = 0.0  # сколько цикл событий копировал состояние для последней записи
+        self.last_lag = 0.0  # секунд от первого изменения до записи на диск
+        self.max_lag = 0.0
+
+    def submit(self, record):
+        """Отмечает изменение; в режиме snapshot сама запись не нужна"""
+        if PERSISTENCE_MODE != 'snapshot':
+            self._records.append(record)
+        if self._dirty_since is None:
+            self._dirty_since = time.monotonic()
+            self._dirty.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await self._dirty.wait()
+            # Полный снимок копируется за O(n): на большом хранилище записи реже,
+            # чтобы копии не отнимали у цикла событий больше SNAPSHOT_LOOP_SHARE
+            await asyncio.sleep(max(self.flush_interval, self.copy_seconds / SNAPSHOT_LOOP_SHARE))
+            await self.flush()
+
+    async def flush(self, compact=False):
+        """Записывает накопленные изменения"""
+        async with self._lock:
+            if self._dirty_since is None and not compact:
+                return
+            self._dirty.clear()
+            records, self._records = self._records, []
+            dirty_since, self._dirty_since = self._dirty_since, None
+            began = time.perf_counter()
+            job = prepare_persistence_job(records, compact)
+            self.copy_seconds = time.perf_counter() - began
+            # Запись не прерывается отменой задачи: её дожидается close()
+            self._inflight_records = records
+            self._inflight = asyncio.ensure_future(asyncio.to_thread(job))
+            try:
+                await asyncio.shield(self._inflight)
+            except Exception as e:
+                print(f"❌ Ошибка сохранения данных: {e}")
+                self._records[:0] = records
+                if self._dirty_since is None:
+                    self._dirty_since = dirty_since
+                self._dirty.set()
+                return
+            finally:
+                self._inflight = None
+                self._inflight_records = []
+            SAVE_DURATION.observe(time.perf_counter() - began)
+            self.flushes += 1
+            if dirty_since is not None:
+                self.last_lag = time.monotonic() - dirty_since
+                self.max_lag = max(self.max_lag, self.last_lag)
+
+    def unflushed(self):
+        """Записи изменений, которых ещё нет на диске, в порядке поступления"""
+        return self._inflight_records + self._records
+
+    def flush_sync(self):
+        """Синхронная запись вне цикла событий (скрипты и бенчмарки)"""
+        records, self._records = self._records, []
+        self._dirty_since = None
+        self._dirty.clear()
+        prepare_persistence_job(records)()
+
+    async def close(self):
+        """Останавливает фоновую запись и сохраняет всё несохранённое"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        inflight = self._inflight
+        if inflight is not None:
+            await asyncio.wait([inflight])
+        await self.flush()
+
+persistence_writer = PersistenceWriter(PERSISTENCE_FLUSH_SECONDS)
+
+def record_change(record):
+    """Отмечает изменение для фоновой записи"""
+    persistence_writer.submit(record)
+
+def record_reminder_added(reminder_id, reminder):
+    record_change({'op': 'add', 'id': reminder_id, 'reminder': reminder.to_dict()})
+
+def record_reminders_removed(reminder_ids):
+    record_change({'op': 'del', 'ids': list(reminder_ids)})
+
+def record_category_changed(category_key):
+    menu_cache.bump()
+    record = {'op': 'category', 'key': category_key, 'data': categories_data[category_key]}
+    record_change(record)
+    cluster_link.broadcast(record)
+
+def record_category_deleted(category_key):
+    menu_cache.bump()
+    record = {'op': 'category_del', 'key': category_key}
+    record_change(record)
+    cluster_link.broadcast(record)
+
+# ----------------------------------------------------------------------------
+# Потоковый импорт и экспорт (NDJSON)
+# ----------------------------------------------------------------------------
+# Строка файла — запись в формате журнала: {"op": "category", ...} или
+# {"op": "add", ...}. Записи читаются и пишутся пачками по NDJSON_BATCH, так что
+# память не зависит от размера файла, а прерванный перенос продолжается с
+# последней сохранённой пачки (файл FILE.progress). Повторный импорт той же
+# записи безопасен: напоминание с тем же id перезаписывается.
+
+def parse_deadline_bound(text):
+    """Граница интервала сроков: 'ДД.ММ.ГГГГ ЧЧ:ММ', 'ДД.ММ.ГГГГ' или ISO 8601 -> секунды epoch"""
+    for date_format in ('%d.%m.%Y %H:%M', '%d.%m.%Y'):
+        try:
+            return datetime.strptime(text, date_format).timestamp()
+        except ValueError:
+            pass
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        raise ValueError(f"не удалось разобрать дату {text!r}: ожидалось ДД.ММ.ГГГГ [ЧЧ:ММ] или ISO 8601")
+
+class ReminderFilter:
+    """Отбор записей для импорта и экспорта: пользователь, категория и интервал сроков [after, before)"""
+    def __init__(self, user_id=None, category_key=None, after=None, before=None):
+        self.user_id = user_id
+        self.category_key = category_key
+        self.after = after
+        self.before = before
+
+    def matches(self, reminder):
+        return (
+            (self.user_id is None or reminder.user_id == self.user_id)
+            and (self.category_key is None or reminder.category_key == self.category_key)
+            and (self.after is None or reminder.end_ts >= self.after)
+            and (self.before is None or reminder.end_ts < self.before)
+        )
+
+    def matches_category(self, category_key):
+        return self.category_key is None or category_key == self.category_key
+
+def export_records(categories, items, reminder_filter):
+    """Записи экспорта: сначала категории, затем напоминания из items по одному.
+
+    На каждую прочитанную запись отдаётся строка или None, если запись не прошла
+    фильтр, — по их числу экспорт продолжается после перерыва.
+    """
+    for key, data in categories.items():
+        yield {'op': 'category', 'key': key, 'data': data} if reminder_filter.matches_category(key) else None
+    for reminder_id, reminder in items:
+        if reminder_filter.matches(reminder):
+            yield {'op': 'add', 'id': reminder_id, 'reminder': reminder.to_dict()}
+        else:
+            yield None
+
+def write_ndjson_export(path, categories, items, reminder_filter, resume=False):
+    """Пишет экспорт в path пачками с контрольной точкой; возвращает число строк"""
+    progress_file = f"{path}.progress"
+    progress = {'records': 0, 'bytes': 0, 'lines': 0}
+    if resume and os.path.exists(progress_file):
+        with open(progress_file, 'r', encoding='utf-8') as f:
+            progress = json.load(f)
+    with open(path, 'r+b' if progress['bytes'] else 'wb') as out:
+        # Всё, что дописано после контрольной точки, пишется заново
+        out.seek(progress['bytes'])
+        out.truncate()
+        batch = []
+        consumed = 0
+        for record in export_records(categories, items, reminder_filter):
+            consumed += 1
+            if consumed <= progress['records']:
+                continue
+            if record is not None:
+                batch.append(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+            if len(batch) >= NDJSON_BATCH:
+                progress = flush_ndjson_batch(out, batch, progress_file, consumed, progress['lines'])
+                batch = []
+        progress = flush_ndjson_batch(out, batch, progress_file, consumed, progress['lines'])
+    os.remove(progress_file)
+    return progress['lines']
+
+def flush_ndjson_batch(out, batch, progress_file, consumed, lines):
+    """Дописывает пачку строк на диск и сохраняет контрольную точку после неё"""
+    out.write(''.join(line + '\n' for line in batch).encode('utf-8'))
+    out.flush()
+    os.fsync(out.fileno())
+    progress = {'records': consumed, 'bytes': out.tell(), 'lines': lines + len(batch)}
+    write_json_atomic(progress_file, progress)
+    return progress
+
+def iter_ndjson_batches(path, offset=0):
+    """Пачки (записи, смещение после пачки) из файла NDJSON, начиная с байта offset"""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        batch = []
+        for line in f:
+            offset += len(line)
+            if line.strip():
+                batch.append(json.loads(line))
+            if len(batch) >= NDJSON_BATCH:
+                yield batch, offset
+                batch = []
+        yield batch, offset
+
+SUBCATEGORY_FIELDS = ('name', 'type', 'time', 'message')
+
+def check_imported_category(key, data):
+    """Проверяет категорию из файла импорта до того, как она попадёт в данные; ValueError при ошибке"""
+    if not isinstance(data, dict) or not isinstance(data.get('name'), str) \
+            or not isinstance(data.get('subcategories'), dict):
+        raise ValueError(f"категория {key!r}: нужны поля name и subcategories")
+    for sub_key, subcat in data['subcategories'].items():
+        if not isinstance(subcat, dict) or any(field not in subcat for field in SUBCATEGORY_FIELDS) \
+                or subcat['type'] not in ('fixed', 'custom'):
+            raise ValueError(
+                f"подкатегория {key!r}/{sub_key!r}: нужны поля {', '.join(SUBCATEGORY_FIELDS)}, type — fixed или custom"
+            )
+
+def import_filter(records, reminder_filter):
+    """Записи импорта, прошедшие фильтр; напоминания чужих процессов кластера пропускаются"""
+    selected = []
+    skipped = 0
+    for record in records:
+        op = record.get('op')
+        if op == 'category' and reminder_filter.matches_category(record['key']):
+            check_imported_category(record['key'], record['data'])
+            selected.append(record)
+        elif op == 'add':
+            reminder = Reminder.from_dict(record['reminder'])
+            if reminder_filter.matches(reminder) and owns_user(reminder.user_id):
+                selected.append(record)
+            else:
+                skipped += 1
+        else:
+            skipped += 1
+    return selected, skipped
+
+def read_journal_tail():
+    """Хвост журнала поверх снимка: добавленные и удалённые напоминания, изменения категорий.
+
+    Журнал сжимается каждые JOURNAL_COMPACT_MINUTES, поэтому хвост невелик.
+    """
+    added, deleted, category_records = {}, set(), []
+    if os.path.exists(JOURNAL_FILE):
+        with open(JOURNAL_FILE, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record['op'] == 'add':
+                    added[record['id']] = record['reminder']
+                    deleted.discard(record['id'])
+                elif record['op'] == 'del':
+                    for reminder_id in record['ids']:
+                        added.pop(reminder_id, None)
+                        deleted.add(reminder_id)
+                else:
+                    category_records.append(record)
+    return added, deleted, category_records
+
+def stored_categories():
+    """Категории из файлов данных остановленного бота"""
+    if PERSISTENCE_MODE == 'sqlite':
+        return SqliteStore(DATABASE_FILE).load_categories()
+    categories = {}
+    categories_file = CATEGORIES_FILE if os.path.exists(CATEGORIES_FILE) else SHARED_CATEGORIES_FILE
+    if os.path.exists(categories_file):
+        with open(categories_file, 'r', encoding='utf-8') as f:
+            categories = json.load(f)
+    for record in read_journal_tail()[2]:
+        if record['op'] == 'category':
+            categories[record['key']] = record['data']
+        else:
+            categories.pop(record['key'], None)
+    return categories
+
+def iter_stored_reminders():
+    """Все напоминания из файлов данных остановленного бота, по одному"""
+    if PERSISTENCE_MODE == 'sqlite':
+        yield from SqliteStore(DATABASE_FILE).reminders_between(float('-inf'), float('inf'))
+        return
+    added, deleted, _ = read_journal_tail()
+    users_file = USERS_FILE if os.path.exists(USERS_FILE) else SHARED_USERS_FILE
+    if os.path.exists(users_file):
+        for reminder_id, data in iter_json_object(users_file):
+            if reminder_id not in deleted and reminder_id not in added and owns_user(data['user_id']):
+                yield reminder_id, Reminder.from_dict(data)
+    for reminder_id, data in added.items():
+        yield reminder_id, Reminder.from_dict(data)
+
+def import_into_files(path, reminder_filter, resume=False):
+    """Импорт NDJSON в файлы данных остановленного бота: в базу или в журнал, пачками"""
+    progress_file = f"{path}.progress"
+    offset = 0
+    totals = {'reminders': 0, 'categories': 0, 'skipped': 0}
+    if resume and os.path.exists(progress_file):
+        with open(progress_file, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+        offset, totals = saved['offset'], saved['totals']
+    store = SqliteStore(DATABASE_FILE) if PERSISTENCE_MODE == 'sqlite' else None
+    for records, offset in iter_ndjson_batches(path, offset):
+        selected, skipped = import_filter(records, reminder_filter)
+        if selected:
+            # Журнал применяется при следующем запуске бота, в режиме snapshot тоже
+            if store is not None:
+                store.apply(selected)
+            else:
+                append_journal(selected)
+        totals['skipped'] += skipped
+        for record in selected:
+            totals['reminders' if record['op'] == 'add' else 'categories'] += 1
+        write_json_atomic(progress_file, {'offset': offset, 'totals': totals})
+    os.remove(progress_file)
+    return totals
+
+def run_ndjson_cli(argv):
+    """python main.py export|import ФАЙЛ [фильтры] — перенос данных остановленного бота"""
+    parser = argparse.ArgumentParser(prog='main.py', description='Потоковый импорт и экспорт напоминаний в NDJSON')
+    parser.add_argument('command', choices=('export', 'import'))
+    parser.add_argument('file', help='файл NDJSON')
+    parser.add_argument('--user', type=int, help='только напоминания пользователя с этим id')
+    parser.add_argument('--category', help='только категория с этим ключом и её напоминания')
+    parser.add_argument('--after', type=parse_deadline_bound, help='срок не раньше: ДД.ММ.ГГГГ [ЧЧ:ММ] или ISO 8601')
+    parser.add_argument('--before', type=parse_deadline_bound, help='срок раньше')
+    parser.add_argument('--resume', action='store_true', help='продолжить с контрольной точки ФАЙЛ.progress')
+    args = parser.parse_args(argv)
+    reminder_filter = ReminderFilter(args.user, args.category, args.after, args.before)
+    began = time.perf_counter()
+    if args.command == 'export':
+        lines = write_ndjson_export(args.file, stored_categories(), iter_stored_reminders(), reminder_filter,
+                                    args.resume)
+        print(f"📤 Экспортировано строк: {lines} в {args.file} за {time.perf_counter() - began:.1f} с")
+    else:
+        totals = import_into_files(args.file, reminder_filter, args.resume)
+        print(f"📥 Импортировано напоминаний: {totals['reminders']}, категорий: {totals['categories']}, "
+              f"пропущено: {totals['skipped']} за {time.perf_counter() - began:.1f} с")
+
 def init_default_categories():
     """Инициализация стандартных категорий при первом запуске"""
     if not categories_data:
@@ -91,30 +1383,97 @@ def init_default_categories():
             'name': '⏰ Таймер',
             'subcategories': {
                 'настраиваемый': {'name': '🔄 Настраиваемый таймер', 'type': 'custom', 'time': None, 'message': None},
-                'оплата_дома': {'name': '🏠 Оплата дома', 'type': 'fixed', 'time': '0д 0ч 1м', 'message': 'Время оплатить дом!'},
-                'оплата_недвижимости': {'name': '🏢 Оплата недвижимости', 'type': 'fixed', 'time': '0д 0ч 2м', 'message': 'Время оплатить недвижимость!'}
+                'оплата_дома': {'name': '🏠 Оплата дома', 'type': 'fixed', 'time': '0д 0ч 1м', 'duration_seconds': 60, 'message': 'Время оплатить дом!'},
+                'оплата_недвижимости': {'name': '🏢 Оплата недвижимости', 'type': 'fixed', 'time': '0д 0ч 2м', 'duration_seconds': 120, 'message': 'Время оплатить недвижимость!'}
             }
         }
         categories_data['фарм'] = {
             'name': '🌾 Фарм',
             'subcategories': {
                 'настраиваемый': {'name': '🔄 Настраиваемый таймер', 'type': 'custom', 'time': None, 'message': None},
-                'билетики': {'name': '🎫 Билетики', 'type': 'fixed', 'time': '0д 1ч 0м', 'message': 'Проверить билетики!'},
-                'квесты': {'name': '📜 Квесты', 'type': 'fixed', 'time': '0д 2ч 0м', 'message': 'Время квестов!'}
+                'билетики': {'name': '🎫 Билетики', 'type': 'fixed', 'time': '0д 1ч 0м', 'duration_seconds': 3600, 'message': 'Проверить билетики!'},
+                'квесты': {'name': '📜 Квесты', 'type': 'fixed', 'time': '0д 2ч 0м', 'duration_seconds': 7200, 'message': 'Время квестов!'}
             }
         }
         categories_data['задания_клуба'] = {
             'name': '🏁 Задания клуба',
             'subcategories': {
                 'настраиваемый': {'name': '🔄 Настраиваемый таймер', 'type': 'custom', 'time': None, 'message': None},
-                'реднеки': {'name': '🤠 Реднеки', 'type': 'fixed', 'time': '0д 0ч 1м', 'message': 'Задание Реднеки!'},
-                'мото_клуб': {'name': '🏍️ Мото клуб', 'type': 'fixed', 'time': '0д 0ч 1м', 'message': 'Задание Мото-клуба!'},
-                'epsilon': {'name': '👽 Epsilon', 'type': 'fixed', 'time': '0д 0ч 1м', 'message': 'Задание Epsilon!'}
+                'реднеки': {'name': '🤠 Реднеки', 'type': 'fixed', 'time': '0д 0ч 1м', 'duration_seconds': 60, 'message': 'Задание Реднеки!'},
+                'мото_клуб': {'name': '🏍️ Мото клуб', 'type': 'fixed', 'time': '0д 0ч 1м', 'duration_seconds': 60, 'message': 'Задание Мото-клуба!'},
+                'epsilon': {'name': '👽 Epsilon', 'type': 'fixed', 'time': '0д 0ч 1м', 'duration_seconds': 60, 'message': 'Задание Epsilon!'}
             }
         }
-        save_data()
+        for category_key in categories_data:
+            record_category_changed(category_key)
         print("✅ Стандартные категории инициализированы")
 
+def add_reminder(reminder_id, reminder):
+    """Добавление напоминания в хранилище, планировщик и индекс пользователя"""
+    if reminder.end_ts > memory_horizon:
+        # В режиме sqlite далёкие напоминания остаются только в базе
+        return
+    reminders[reminder_id] = reminder
+    user_index.setdefault(reminder.user_id, set()).add(reminder_id)
+    reminder_scheduler.insert(reminder_id, reminder.end_ts)
+
+def requeue_reminder(reminder_id, reminder, at):
+    """Возвращает напоминание в хранилище со сработкой в момент at; срок в записи не меняется"""
+    reminders[reminder_id] = reminder
+    user_index.setdefault(reminder.user_id, set()).add(reminder_id)
+    reminder_scheduler.insert(reminder_id, at)
+
+def remove_reminder(reminder_id):
+    """Удаление напоминания (доставленного или отменённого) из всех структур"""
+    reminder = reminders.pop(reminder_id, None)
+    if reminder is None:
+        return None
+    reminder_scheduler.cancel(reminder_id)
+    user_reminders = user_index.get(reminder.user_id)
+    if user_reminders is not None:
+        user_reminders.discard(reminder_id)
+        if not user_reminders:
+            del user_index[reminder.user_id]
+    return reminder
+
+def owns_user(user_id):
+    """Напоминания пользователя хранит и доставляет ровно один процесс кластера"""
+    return CLUSTER_COUNT == 1 or cluster_of(user_id) == CLUSTER_ID
+
+def cluster_of(user_id):
+    # crc32, а не остаток от деления: младшие биты snowflake — счётчик, почти всегда нулевой
+    return zlib.crc32(str(user_id).encode()) % CLUSTER_COUNT
+
+async def schedule_reminder(reminder):
+    """Сохраняет новое напоминание в процессе кластера, которому принадлежит пользователь"""
+    reminder_id = f"{reminder.user_id}_{datetime.now().timestamp()}"
+    if owns_user(reminder.user_id):
+        add_reminder(reminder_id, reminder)
+        record_reminder_added(reminder_id, reminder)
+    else:
+        await cluster_link.add_reminder(reminder_id, reminder)
+    return reminder_id
+
+# Ошибки связи с процессом-владельцем: он упал, перезапускается или не успел ответить
+CLUSTER_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+CLUSTER_UNAVAILABLE = '❌ Сервер с вашими напоминаниями сейчас недоступен. Попробуйте через минуту.'
+
+async def defer_for_handoff(interaction: discord.Interaction, user_id):
+    """Откладывает ответ, если данные пользователя у другого процесса кластера.
+
+    На ответ взаимодействию Discord даёт 3 с, а запрос владельцу может занять до
+    ClusterLink.TIMEOUT; после defer ответ уходит через followup.
+    """
+    if not owns_user(user_id):
+        await interaction.response.defer(ephemeral=True, thinking=True)
+
+async def reply(interaction: discord.Interaction, content=None, **kwargs):
+    """Ответ на взаимодействие — сразу или после defer"""
+    if interaction.response.is_done():
+        await interaction.followup.send(content, **kwargs)
+    else:
+        await interaction.response.send_message(content, **kwargs)
+
 def is_admin(user):
     """Проверка прав администратора у пользователя"""
     if isinstance(user, discord.Member):
@@ -125,35 +1484,46 @@ def is_admin(user):
 # ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
 # ============================================================================
 
-def parse_time_string(time_str):
-    """Парсинг строки времени в секунды (например: '2ч30м' -> 9000)"""
-    time_str = time_str.lower().replace(' ', '')
-    total_seconds = 0
-    current_num = ''
+DURATION_UNITS = {
+    **dict.fromkeys(('н', 'нед', 'неделя', 'недели', 'недель', 'неделю', 'w', 'wk', 'week', 'weeks'), 604800),
+    **dict.fromkeys(('д', 'дн', 'день', 'дня', 'дней', 'd', 'day', 'days'), 86400),
+    **dict.fromkeys(('ч', 'час', 'часа', 'часов', 'h', 'hr', 'hrs', 'hour', 'hours'), 3600),
+    **dict.fromkeys(('м', 'мин', 'минута', 'минуты', 'минут', 'минуту', 'm', 'min', 'mins', 'minute', 'minutes'), 60),
+    **dict.fromkeys(('с', 'сек', 'секунда', 'секунды', 'секунд', 'секунду', 's', 'sec', 'secs', 'second', 'seconds'), 1),
+}
+# Число и единица; между парами допускаются пробелы и запятые
+DURATION_TOKEN = re.compile(r'[\s,]*(\d+)\s*([a-zа-яё]+)[\s,]*')
 
-    for char in time_str:
-        if char.isdigit():
-            current_num += char
-        else:
-            if current_num:
-                num = int(current_num)
-                if char == 'с':
-                    total_seconds += num
-                elif char == 'м':
-                    total_seconds += num * 60
-                elif char == 'ч':
-                    total_seconds += num * 3600
-                elif char == 'д':
-                    total_seconds += num * 86400
-                current_num = ''
+def parse_time_string(time_str):
+    """Парсинг строки времени в секунды: '2ч30м' -> 9000, '1w 2d', '90 сек'.
 
+    Некорректная строка — ValueError с указанием места ошибки.
+    """
+    text = time_str.lower()
+    if not text.strip():
+        raise ValueError('пустая строка времени')
+    total_seconds = 0
+    position = 0
+    while position < len(text):
+        match = DURATION_TOKEN.match(text, position)
+        if match is None:
+            raise ValueError(f"не удалось разобрать время {time_str!r}: ожидалось число и единица с позиции {position}")
+        number, unit = match.groups()
+        multiplier = DURATION_UNITS.get(unit)
+        if multiplier is None:
+            raise ValueError(f"неизвестная единица времени {unit!r} в {time_str!r}")
+        total_seconds += int(number) * multiplier
+        position = match.end()
     return total_seconds
 
 def format_time(seconds):
-    """Форматирование секунд в читаемую строку"""
-    days = int(seconds // 86400)
-    hours = int((seconds % 86400) // 3600)
-    minutes = int((seconds % 3600) // 60)
+    """Форматирование секунд в читаемую строку; parse_time_string читает её обратно"""
+    # Срок мог пройти между выборкой и показом: отрицательный остаток — это ноль
+    seconds = max(0, int(seconds))
+    days = seconds // 86400
+    hours = seconds % 86400 // 3600
+    minutes = seconds % 3600 // 60
+    seconds = seconds % 60
 
     parts = []
     if days > 0:
@@ -162,6 +1532,8 @@ def format_time(seconds):
         parts.append(f"{hours}ч")
     if minutes > 0:
         parts.append(f"{minutes}м")
+    if seconds > 0:
+        parts.append(f"{seconds}с")
 
     return " ".join(parts) if parts else "0сек"
 
@@ -169,53 +1541,315 @@ def calculate_seconds(days: int, hours: int, minutes: int):
     """Вычисление общего количества секунд из дней, часов и минут"""
     return days * 86400 + hours * 3600 + minutes * 60
 
-# ============================================================================
-# СИСТЕМА САМО-ПИНГА ДЛЯ ПОДДЕРЖАНИЯ АКТИВНОСТИ
-# ============================================================================
-
-@tasks.loop(minutes=4)
-async def self_ping():
-    """Само-пинг для поддержания активности Replit"""
-    try:
-        response = requests.get('http://127.0.0.1:5000/ping', timeout=5)
-        print(f"✅ Self-ping: {response.status_code}")
-    except Exception as e:
-        print(f"❌ Self-ping failed: {e}")
+def set_fixed_duration(subcat, days, hours, minutes):
+    """Время fixed-подкатегории: строка для показа и готовое число секунд для нажатий"""
+    subcat['time'] = f"{days}д {hours}ч {minutes}м"
+    subcat['duration_seconds'] = calculate_seconds(days, hours, minutes)
+
+def cache_subcategory_durations():
+    """Досчитывает duration_seconds подкатегориям, сохранённым до появления поля"""
+    for category in categories_data.values():
+        for subcat in category['subcategories'].values():
+            if subcat['type'] != 'fixed' or 'duration_seconds' in subcat:
+                continue
+            try:
+                subcat['duration_seconds'] = parse_time_string(subcat['time'] or '')
+            except ValueError as e:
+                subcat['duration_seconds'] = None
+                print(f"⚠️ Подкатегория {subcat['name']}: {e}")
 
 # ============================================================================
-# ГЛАВНОЕ МЕНЮ - КАТЕГОРИИ
+# ПЛАНИРОВЩИК НАПОМИНАНИЙ
 # ============================================================================
 
-class StartMenu(discord.ui.View):
-    """Главное меню с выбором категорий"""
+class ReminderScheduler:
+    """Общий интерфейс планировщиков: insert / cancel / pop_due / next_deadline.
+
+    Ожидание ближайшего срабатывания реализовано здесь, хранение — в наследниках.
+    """
     def __init__(self):
-        super().__init__(timeout=180)
+        self._wakeup = asyncio.Event()
+        self._armed_for = None
+
+    def _notify(self, deadline):
+        """Будит ожидание, если новое напоминание раньше запланированного пробуждения"""
+        if self._armed_for is None or deadline < self._armed_for:
+            self._wakeup.set()
+
+    async def wait_next(self):
+        """Спит до ближайшего дедлайна или до вставки более раннего напоминания"""
+        self._wakeup.clear()
+        deadline = self.next_deadline()
+        self._armed_for = deadline
+        timeout = None if deadline is None else deadline - time.time()
+        if timeout is not None and timeout <= 0:
+            return
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._armed_for = None
 
-    @discord.ui.button(label='⏰ Таймер', style=discord.ButtonStyle.primary, emoji='⏰')
-    async def timer_category(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await show_subcategories(interaction, 'таймер')
+class HeapScheduler(ReminderScheduler):
+    """Очередь напоминаний на min-heap, упорядоченная по времени срабатывания.
 
-    @discord.ui.button(label='🌾 Фарм', style=discord.ButtonStyle.success, emoji='🌾')
-    async def farm_category(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await show_subcategories(interaction, 'фарм')
+    Вставка и срабатывание стоят O(log n), отменённые записи удаляются лениво.
+    """
+    def __init__(self):
+        super().__init__()
+        self._heap = []
+        self._deadlines = {}
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def clear(self):
+        self._heap.clear()
+        self._deadlines.clear()
+        self._wakeup.set()
+
+    def insert(self, reminder_id, deadline):
+        """Добавляет напоминание"""
+        self._deadlines[reminder_id] = deadline
+        heapq.heappush(self._heap, (deadline, reminder_id))
+        self._notify(deadline)
+
+    def cancel(self, reminder_id):
+        """Отменяет напоминание; запись в куче будет пропущена при извлечении"""
+        if self._deadlines.pop(reminder_id, None) is None:
+            return
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._heap = [(d, rid) for d, rid in self._heap if self._deadlines.get(rid) == d]
+            heapq.heapify(self._heap)
+
+    def _drop_stale(self):
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def next_deadline(self):
+        """Время ближайшего срабатывания или None, если очередь пуста"""
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now):
+        """Извлекает все напоминания со сроком не позже now"""
+        due = []
+        self._drop_stale()
+        while self._heap and self._heap[0][0] <= now:
+            deadline, reminder_id = heapq.heappop(self._heap)
+            del self._deadlines[reminder_id]
+            due.append(reminder_id)
+            self._drop_stale()
+        return due
+
+class TimingWheelScheduler(ReminderScheduler):
+    """Иерархическое колесо таймеров с ярусами секунд, минут, часов и дней.
+
+    Далёкие напоминания лежат в грубых корзинах и спускаются в более точные
+    ярусы по мере приближения срока. Точность срабатывания — одна секунда.
+    """
+    DAY_SLOTS = 1024  # больше максимальных 999 дней FixedTimerSetupModal
 
-    @discord.ui.button(label='🏁 Задания клуба', style=discord.ButtonStyle.danger, emoji='🏁')
-    async def club_category(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await show_subcategories(interaction, 'задания_клуба')
+    def __init__(self):
+        super().__init__()
+        self.clear()
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def clear(self):
+        self._cursor = int(time.time())
+        self._deadlines = {}
+        self._expired = []
+        self._overflow = []
+        # ярус -> (список корзин, размер корзины в секундах)
+        self._seconds = [[] for _ in range(60)]
+        self._minutes = [[] for _ in range(60)]
+        self._hours = [[] for _ in range(24)]
+        self._days = [[] for _ in range(self.DAY_SLOTS)]
+        self._tier_sizes = [0, 0, 0, 0]
+        self._wakeup.set()
+
+    def _place(self, reminder_id, deadline):
+        """Кладёт напоминание в корзину самого точного подходящего яруса"""
+        cursor = self._cursor
+        if deadline <= cursor:
+            self._expired.append(reminder_id)
+        elif deadline // 60 == cursor // 60:
+            self._seconds[deadline % 60].append(reminder_id)
+            self._tier_sizes[0] += 1
+        elif deadline // 3600 == cursor // 3600:
+            self._minutes[deadline // 60 % 60].append(reminder_id)
+            self._tier_sizes[1] += 1
+        elif deadline // 86400 == cursor // 86400:
+            self._hours[deadline // 3600 % 24].append(reminder_id)
+            self._tier_sizes[2] += 1
+        elif deadline // 86400 - cursor // 86400 < self.DAY_SLOTS:
+            self._days[deadline // 86400 % self.DAY_SLOTS].append(reminder_id)
+            self._tier_sizes[3] += 1
+        else:
+            self._overflow.append(reminder_id)
+
+    def _cascade(self, tier, wheel, index):
+        """Переносит корзину грубого яруса в более точные"""
+        bucket = wheel[index]
+        wheel[index] = []
+        self._tier_sizes[tier] -= len(bucket)
+        for reminder_id in bucket:
+            deadline = self._deadlines.get(reminder_id)
+            if deadline is not None:
+                self._place(reminder_id, deadline)
+
+    def insert(self, reminder_id, deadline):
+        """Добавляет напоминание"""
+        deadline = int(-(-deadline // 1))
+        self._deadlines[reminder_id] = deadline
+        self._place(reminder_id, deadline)
+        self._notify(deadline)
+
+    def cancel(self, reminder_id):
+        """Отменяет напоминание; запись в корзине будет пропущена при срабатывании"""
+        self._deadlines.pop(reminder_id, None)
+
+    def _advance(self):
+        """Сдвигает курсор к следующей секунде или сразу к границе, если ярусы пусты"""
+        cursor = self._cursor
+        if self._tier_sizes[0] == 0:
+            if self._tier_sizes[1] == 0:
+                if self._tier_sizes[2] == 0:
+                    step = 86400
+                else:
+                    step = 3600
+            else:
+                step = 60
+            return cursor - cursor % step + step
+        return cursor + 1
+
+    def _collect(self, reminder_ids, now, due):
+        for reminder_id in reminder_ids:
+            deadline = self._deadlines.get(reminder_id)
+            # Отменённые и перенесённые на более поздний срок записи пропускаются:
+            # для актуального срока при вставке создаётся отдельная запись
+            if deadline is not None and deadline <= now:
+                del self._deadlines[reminder_id]
+                due.append(reminder_id)
+
+    def pop_due(self, now):
+        """Извлекает все напоминания со сроком не позже now"""
+        due = []
+        target = int(now)
+        expired, self._expired = self._expired, []
+        self._collect(expired, target, due)
+
+        while self._cursor < target:
+            self._cursor = min(self._advance(), target)
+            cursor = self._cursor
+            if cursor % 60 == 0:
+                if cursor % 3600 == 0:
+                    if cursor % 86400 == 0:
+                        day = cursor // 86400 % self.DAY_SLOTS
+                        if day == 0:
+                            overflow, self._overflow = self._overflow, []
+                            for reminder_id in overflow:
+                                deadline = self._deadlines.get(reminder_id)
+                                if deadline is not None:
+                                    self._place(reminder_id, deadline)
+                        self._cascade(3, self._days, day)
+                    self._cascade(2, self._hours, cursor // 3600 % 24)
+                self._cascade(1, self._minutes, cursor // 60 % 60)
+            bucket = self._seconds[cursor % 60]
+            if bucket:
+                self._seconds[cursor % 60] = []
+                self._tier_sizes[0] -= len(bucket)
+                self._collect(bucket, target, due)
+            expired, self._expired = self._expired, []
+            self._collect(expired, target, due)
+        return due
+
+    def next_deadline(self):
+        """Время следующего пробуждения: ближайший срок или граница каскада корзины"""
+        if not self._deadlines:
+            return None
+        if self._expired:
+            return self._cursor
+        cursor = self._cursor
+        if self._tier_sizes[0]:
+            for offset in range(1, 60 - cursor % 60):
+                if self._seconds[(cursor + offset) % 60]:
+                    return cursor + offset
+        if self._tier_sizes[1]:
+            for offset in range(1, 60 - cursor // 60 % 60):
+                if self._minutes[(cursor // 60 + offset) % 60]:
+                    return (cursor // 60 + offset) * 60
+        if self._tier_sizes[2]:
+            for offset in range(1, 24 - cursor // 3600 % 24):
+                if self._hours[(cursor // 3600 + offset) % 24]:
+                    return (cursor // 3600 + offset) * 3600
+        # На границе оборота колеса дней записи за горизонтом раскладываются заново
+        # и могут оказаться раньше следующей непустой корзины
+        cycle_end = (cursor // 86400 // self.DAY_SLOTS + 1) * self.DAY_SLOTS * 86400
+        for offset in range(1, self.DAY_SLOTS + 1):
+            if self._days[(cursor // 86400 + offset) % self.DAY_SLOTS]:
+                wake = (cursor // 86400 + offset) * 86400
+                return min(wake, cycle_end) if self._overflow else wake
+        # Остались только записи за горизонтом колеса дней
+        return cycle_end
+
+SCHEDULER_ENGINE = os.getenv('SCHEDULER_ENGINE', 'heap')  # heap или wheel
+
+reminder_scheduler = TimingWheelScheduler() if SCHEDULER_ENGINE == 'wheel' else HeapScheduler()
+
+def rebuild_indexes():
+    """Заполнение планировщика и индекса пользователей из хранилища"""
+    reminder_scheduler.clear()
+    user_index.clear()
+    for reminder_id, reminder in reminders.items():
+        reminder_scheduler.insert(reminder_id, reminder.end_ts)
+        user_index.setdefault(reminder.user_id, set()).add(reminder_id)
 
-    @discord.ui.button(label='⚙️ Управление', style=discord.ButtonStyle.secondary, emoji='⚙️', row=1)
-    async def admin_panel(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if not is_admin(interaction.user):
-            await interaction.response.send_message('❌ Недостаточно прав! Только для администраторов.', ephemeral=True)
-            return
-        await show_admin_categories(interaction)
+# ============================================================================
+# КЭШ ОТРИСОВКИ МЕНЮ
+# ============================================================================
 
-async def show_subcategories(interaction: discord.Interaction, category_key: str):
-    """Отображение подкатегорий выбранной категории"""
-    if category_key not in categories_data:
-        await interaction.response.send_message('❌ Категория не найдена!', ephemeral=True)
-        return
+class MenuRenderCache:
+    """Готовые эмбеды и раскладки кнопок меню категорий.
 
+    Меню меняются только при правке категорий администратором, поэтому
+    отрисованный результат хранится по (вид меню, ключ категории) до смены
+    версии конфигурации. Версию поднимает каждое изменение categories_data.
+    """
+    def __init__(self):
+        self.version = 0
+        self.enabled = True
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def bump(self):
+        self.version += 1
+        self.entries.clear()
+
+    def get(self, kind, key, render):
+        if not self.enabled:
+            return render(key)
+        entry = self.entries.get((kind, key))
+        if entry is not None and entry[0] == self.version:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        payload = render(key)
+        self.entries[(kind, key)] = (self.version, payload)
+        return payload
+
+menu_cache = MenuRenderCache()
+
+def button_label(name):
+    """Подпись кнопки в пределах лимита Discord в 80 символов"""
+    return name[:77] + "..." if len(name) > 80 else name
+
+def render_subcategories(category_key):
+    """Эмбед и кнопки меню подкатегорий для пользователей"""
     category = categories_data[category_key]
 
     embed = discord.Embed(
@@ -224,8 +1858,6 @@ async def show_subcategories(interaction: discord.Interaction, category_key: str
         color=0x00ff00
     )
 
-    view = SubcategoryMenu(category_key)
-
     for key, subcat in category['subcategories'].items():
         time_info = f" | ⏰ {subcat['time']}" if subcat['time'] else ""
         embed.add_field(
@@ -234,82 +1866,11 @@ async def show_subcategories(interaction: discord.Interaction, category_key: str
             inline=False
         )
 
-    await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
-
-class SubcategoryMenu(discord.ui.View):
-    """Меню подкатегорий с кнопками"""
-    def __init__(self, category_key: str):
-        super().__init__(timeout=180)
-        self.category_key = category_key
-
-        category = categories_data[category_key]
-        for key, subcat in category['subcategories'].items():
-            button_label = subcat['name']
-            if len(button_label) > 80:
-                button_label = button_label[:77] + "..."
-
-            button = discord.ui.Button(
-                label=button_label,
-                style=discord.ButtonStyle.primary,
-                custom_id=f"sub_{key}"
-            )
-            button.callback = self.create_callback(key)
-            self.add_item(button)
-
-    def create_callback(self, sub_key):
-        async def callback(interaction: discord.Interaction):
-            await self.handle_subcategory(interaction, sub_key)
-        return callback
-
-    async def handle_subcategory(self, interaction: discord.Interaction, sub_key: str):
-        category = categories_data[self.category_key]
-        subcategory = category['subcategories'].get(sub_key)
-
-        if not subcategory:
-            await interaction.response.send_message('❌ Подкатегория не найдена!', ephemeral=True)
-            return
-
-        if subcategory['type'] == 'custom':
-            await self.handle_custom_timer(interaction, self.category_key, sub_key)
-        elif subcategory['type'] == 'fixed':
-            await self.handle_fixed_timer(interaction, self.category_key, sub_key)
-
-    async def handle_custom_timer(self, interaction: discord.Interaction, category_key: str, sub_key: str):
-        modal = CustomTimerModal(category_key, sub_key)
-        await interaction.response.send_modal(modal)
-
-    async def handle_fixed_timer(self, interaction: discord.Interaction, category_key: str, sub_key: str):
-        category = categories_data[category_key]
-        subcategory = category['subcategories'][sub_key]
-
-        total_seconds = parse_time_string(subcategory['time'])
-        end_time = datetime.now() + timedelta(seconds=total_seconds)
-
-        reminder_id = f"{interaction.user.id}_{datetime.now().timestamp()}"
-        reminders[reminder_id] = {
-            'message': subcategory['message'],
-            'end_time': end_time.isoformat(),
-            'user_id': interaction.user.id,
-            'category': f"{category['name']} - {subcategory['name']}"
-        }
-
-        save_data()
+    buttons = tuple((key, button_label(subcat['name'])) for key, subcat in category['subcategories'].items())
+    return embed, buttons
 
-        await interaction.response.send_message(
-            f"✅ **Напоминание установлено!**\n"
-            f"📁 **Категория:** {category['name']} - {subcategory['name']}\n"
-            f"⏰ **Через:** {subcategory['time']}\n"
-            f"📝 **Сообщение:** {subcategory['message']}\n"
-            f"🕐 **Сработает:** {end_time.strftime('%d.%m.%Y в %H:%M:%S')}",
-            ephemeral=True
-        )
-
-# ============================================================================
-# АДМИНИСТРАТИВНОЕ МЕНЮ - УПРАВЛЕНИЕ КАТЕГОРИЯМИ
-# ============================================================================
-
-async def show_admin_categories(interaction: discord.Interaction):
-    """Показывает меню управления категориями для администраторов"""
+def render_admin_categories(_=None):
+    """Эмбед и кнопки списка категорий для администраторов"""
     embed = discord.Embed(
         title='⚙️ Управление категориями',
         description='Выберите категорию для управления:',
@@ -330,48 +1891,11 @@ async def show_admin_categories(interaction: discord.Interaction):
         inline=False
     )
 
-    view = AdminCategoriesMenu()
-    await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
-
-class AdminCategoriesMenu(discord.ui.View):
-    """Меню управления категориями для администраторов"""
-    def __init__(self):
-        super().__init__(timeout=180)
-        self.create_buttons()
-
-    def create_buttons(self):
-        for key, category in categories_data.items():
-            button_label = category['name']
-            if len(button_label) > 80:
-                button_label = button_label[:77] + "..."
-
-            button = discord.ui.Button(
-                label=button_label,
-                style=discord.ButtonStyle.primary,
-                custom_id=f"admin_cat_{key}"
-            )
-            button.callback = self.create_category_callback(key)
-            self.add_item(button)
+    buttons = tuple((key, button_label(category['name'])) for key, category in categories_data.items())
+    return embed, buttons
 
-        add_button = discord.ui.Button(
-            label='➕ Создать категорию',
-            style=discord.ButtonStyle.success,
-            custom_id="add_category"
-        )
-        add_button.callback = self.add_category_callback
-        self.add_item(add_button)
-
-    def create_category_callback(self, category_key):
-        async def callback(interaction: discord.Interaction):
-            await show_category_management(interaction, category_key)
-        return callback
-
-    async def add_category_callback(self, interaction: discord.Interaction):
-        modal = AddCategoryModal()
-        await interaction.response.send_modal(modal)
-
-async def show_category_management(interaction: discord.Interaction, category_key: str):
-    """Показывает меню управления конкретной категорией"""
+def render_category_management(category_key):
+    """Эмбед управления конкретной категорией"""
     category = categories_data[category_key]
 
     embed = discord.Embed(
@@ -397,38 +1921,10 @@ async def show_category_management(interaction: discord.Interaction, category_ke
             inline=False
         )
 
-    view = CategoryManagementMenu(category_key)
-    await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
-
-class CategoryManagementMenu(discord.ui.View):
-    """Меню управления конкретной категорией"""
-    def __init__(self, category_key: str):
-        super().__init__(timeout=180)
-        self.category_key = category_key
-
-    @discord.ui.button(label='✏️ Редактировать категорию', style=discord.ButtonStyle.primary)
-    async def edit_category(self, interaction: discord.Interaction, button: discord.ui.Button):
-        modal = EditCategoryModal(self.category_key)
-        await interaction.response.send_modal(modal)
-
-    @discord.ui.button(label='📝 Управление подкатегориями', style=discord.ButtonStyle.secondary)
-    async def manage_subcategories(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await show_subcategories_management(interaction, self.category_key)
-
-    @discord.ui.button(label='🗑️ Удалить категорию', style=discord.ButtonStyle.danger)
-    async def delete_category(self, interaction: discord.Interaction, button: discord.ui.Button):
-        category_name = categories_data[self.category_key]['name']
-        del categories_data[self.category_key]
-        save_data()
-
-        await interaction.response.send_message(
-            f"✅ **Категория удалена!**\n"
-            f"🗑️ {category_name}",
-            ephemeral=True
-        )
+    return embed
 
-async def show_subcategories_management(interaction: discord.Interaction, category_key: str):
-    """Показывает меню управления подкатегориями"""
+def render_subcategories_management(category_key):
+    """Эмбед и кнопки управления подкатегориями"""
     category = categories_data[category_key]
 
     embed = discord.Embed(
@@ -445,56 +1941,214 @@ async def show_subcategories_management(interaction: discord.Interaction, catego
             inline=False
         )
 
-    view = SubcategoriesManagementMenu(category_key)
+    buttons = tuple((key, button_label(subcat['name'])) for key, subcat in category['subcategories'].items())
+    return embed, buttons
+
+# ============================================================================
+# КНОПКИ МЕНЮ, ПЕРЕЖИВАЮЩИЕ ПЕРЕЗАПУСК
+# ============================================================================
+
+MAX_KEY_IN_CUSTOM_ID = 40  # custom_id ограничен 100 символами
+
+def encode_menu_key(key):
+    """Ключ категории для custom_id; длинный ключ заменяется контрольной суммой"""
+    if len(key) <= MAX_KEY_IN_CUSTOM_ID:
+        return key
+    return f"~{zlib.crc32(key.encode()):08x}"
+
+def decode_menu_key(token, candidates):
+    """Обратное преобразование: ищет ключ среди существующих"""
+    if not token.startswith('~'):
+        return token
+    for key in candidates:
+        if encode_menu_key(key) == token:
+            return key
+    return None
+
+class MenuButton(discord.ui.DynamicItem[discord.ui.Button], template=r'm:(?P<action>[a-z_]+):(?P<cat>[^:]*):(?P<sub>[^:]*)'):
+    """Кнопка любого меню категорий.
+
+    Действие и ключи записаны в custom_id, а сам класс регистрируется один раз
+    в setup_hook, поэтому кнопки работают без живого View на каждое сообщение,
+    без таймаута и после перезапуска бота.
+    """
+    def __init__(self, action: str, category_key: str = '', sub_key: str = '', *,
+                 label: str, style: discord.ButtonStyle, emoji=None, row=None):
+        super().__init__(discord.ui.Button(
+            label=label,
+            style=style,
+            emoji=emoji,
+            row=row,
+            custom_id=f"m:{action}:{encode_menu_key(category_key)}:{encode_menu_key(sub_key)}"
+        ))
+        self.action = action
+        self.category_key = category_key
+        self.sub_key = sub_key
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        category_key = decode_menu_key(match['cat'], categories_data)
+        category = categories_data.get(category_key)
+        sub_key = decode_menu_key(match['sub'], category['subcategories'] if category else ())
+        return cls(match['action'], category_key or '', sub_key or '', label=item.label, style=item.style)
+
+    async def callback(self, interaction: discord.Interaction):
+        await dispatch_menu_action(interaction, self.action, self.category_key, self.sub_key)
+
+class MenuView(discord.ui.View):
+    """Раскладка кнопок меню без таймаута.
+
+    Нажатия обрабатывает MenuButton по custom_id, поэтому View нужен только для
+    отрисовки и сразу останавливается: остановленный View discord.py не хранит и
+    не заводит для него таймер, а один экземпляр можно отправлять много раз.
+    """
+    def __init__(self):
+        super().__init__(timeout=None)
+        self.stop()
+
+async def send_menu(interaction: discord.Interaction, embed: discord.Embed, view: MenuView):
     await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
 
-class SubcategoriesManagementMenu(discord.ui.View):
-    """Меню управления подкатегориями"""
+# ============================================================================
+# ГЛАВНОЕ МЕНЮ - КАТЕГОРИИ
+# ============================================================================
+
+class StartMenu(MenuView):
+    """Главное меню с выбором категорий"""
+    def __init__(self):
+        super().__init__()
+        self.add_item(MenuButton('cat', 'таймер', label='⏰ Таймер', style=discord.ButtonStyle.primary, emoji='⏰'))
+        self.add_item(MenuButton('cat', 'фарм', label='🌾 Фарм', style=discord.ButtonStyle.success, emoji='🌾'))
+        self.add_item(MenuButton('cat', 'задания_клуба', label='🏁 Задания клуба',
+                                 style=discord.ButtonStyle.danger, emoji='🏁'))
+        self.add_item(MenuButton('admin', label='⚙️ Управление', style=discord.ButtonStyle.secondary,
+                                 emoji='⚙️', row=1))
+
+async def show_subcategories(interaction: discord.Interaction, category_key: str):
+    """Отображение подкатегорий выбранной категории"""
+    if category_key not in categories_data:
+        await interaction.response.send_message('❌ Категория не найдена!', ephemeral=True)
+        return
+
+    embed, _ = menu_cache.get('subcategories', category_key, render_subcategories)
+    view = menu_cache.get('subcategories_view', category_key, SubcategoryMenu)
+    await send_menu(interaction, embed, view)
+
+class SubcategoryMenu(MenuView):
+    """Меню подкатегорий с кнопками"""
     def __init__(self, category_key: str):
-        super().__init__(timeout=180)
-        self.category_key = category_key
-        self.create_buttons()
+        super().__init__()
+        _, buttons = menu_cache.get('subcategories', category_key, render_subcategories)
+        for key, label in buttons:
+            self.add_item(MenuButton('sub', category_key, key, label=label, style=discord.ButtonStyle.primary))
 
-    def create_buttons(self):
-        category = categories_data[self.category_key]
+async def handle_subcategory(interaction: discord.Interaction, category_key: str, sub_key: str):
+    subcategory = categories_data[category_key]['subcategories'][sub_key]
 
-        for key, subcat in category['subcategories'].items():
-            button_label = subcat['name']
-            if len(button_label) > 80:
-                button_label = button_label[:77] + "..."
+    if subcategory['type'] == 'custom':
+        await handle_custom_timer(interaction, category_key, sub_key)
+    elif subcategory['type'] == 'fixed':
+        await handle_fixed_timer(interaction, category_key, sub_key)
 
-            button = discord.ui.Button(
-                label=button_label,
-                style=discord.ButtonStyle.primary
-            )
-            button.callback = self.create_subcategory_callback(key)
-            self.add_item(button)
+async def handle_custom_timer(interaction: discord.Interaction, category_key: str, sub_key: str):
+    modal = CustomTimerModal(category_key, sub_key)
+    await interaction.response.send_modal(modal)
 
-        add_button = discord.ui.Button(
-            label='➕ Добавить подкатегорию',
-            style=discord.ButtonStyle.success
-        )
-        add_button.callback = self.add_subcategory_callback
-        self.add_item(add_button)
+async def handle_fixed_timer(interaction: discord.Interaction, category_key: str, sub_key: str):
+    category = categories_data[category_key]
+    subcategory = category['subcategories'][sub_key]
 
-        back_button = discord.ui.Button(
-            label='↩️ Назад к категориям',
-            style=discord.ButtonStyle.secondary
-        )
-        back_button.callback = self.back_callback
-        self.add_item(back_button)
+    total_seconds = subcategory.get('duration_seconds')
+    if not total_seconds:
+        await interaction.response.send_message('❌ Время для этой подкатегории не настроено!', ephemeral=True)
+        return
+    reminder = Reminder(
+        interaction.user.id, math.ceil(time.time() + total_seconds),
+        category_key, sub_key, subcategory['message']
+    )
+    end_time = reminder.end_time
+
+    await defer_for_handoff(interaction, interaction.user.id)
+    try:
+        await schedule_reminder(reminder)
+    except CLUSTER_ERRORS as e:
+        print(f"❌ Не удалось передать напоминание владельцу: {e}")
+        await reply(interaction, CLUSTER_UNAVAILABLE, ephemeral=True)
+        return
 
-    def create_subcategory_callback(self, sub_key):
-        async def callback(interaction: discord.Interaction):
-            await show_subcategory_management(interaction, self.category_key, sub_key)
-        return callback
+    await reply(
+        interaction,
+        f"✅ **Напоминание установлено!**\n"
+        f"📁 **Категория:** {category['name']} - {subcategory['name']}\n"
+        f"⏰ **Через:** {subcategory['time']}\n"
+        f"📝 **Сообщение:** {subcategory['message']}\n"
+        f"🕐 **Сработает:** {end_time.strftime('%d.%m.%Y в %H:%M:%S')}",
+        ephemeral=True
+    )
 
-    async def add_subcategory_callback(self, interaction: discord.Interaction):
-        modal = AddSubcategoryModal(self.category_key)
-        await interaction.response.send_modal(modal)
+# ============================================================================
+# АДМИНИСТРАТИВНОЕ МЕНЮ - УПРАВЛЕНИЕ КАТЕГОРИЯМИ
+# ============================================================================
 
-    async def back_callback(self, interaction: discord.Interaction):
-        await show_admin_categories(interaction)
+async def show_admin_categories(interaction: discord.Interaction):
+    """Показывает меню управления категориями для администраторов"""
+    embed, _ = menu_cache.get('admin_categories', None, render_admin_categories)
+    view = menu_cache.get('admin_categories_view', None, lambda _: AdminCategoriesMenu())
+    await send_menu(interaction, embed, view)
+
+class AdminCategoriesMenu(MenuView):
+    """Меню управления категориями для администраторов"""
+    def __init__(self):
+        super().__init__()
+        _, buttons = menu_cache.get('admin_categories', None, render_admin_categories)
+        for key, label in buttons:
+            self.add_item(MenuButton('cat_open', key, label=label, style=discord.ButtonStyle.primary))
+        self.add_item(MenuButton('cat_add', label='➕ Создать категорию', style=discord.ButtonStyle.success))
+
+async def show_category_management(interaction: discord.Interaction, category_key: str):
+    """Показывает меню управления конкретной категорией"""
+    embed = menu_cache.get('category_management', category_key, render_category_management)
+    view = menu_cache.get('category_management_view', category_key, CategoryManagementMenu)
+    await send_menu(interaction, embed, view)
+
+class CategoryManagementMenu(MenuView):
+    """Меню управления конкретной категорией"""
+    def __init__(self, category_key: str):
+        super().__init__()
+        self.add_item(MenuButton('cat_edit', category_key, label='✏️ Редактировать категорию',
+                                 style=discord.ButtonStyle.primary))
+        self.add_item(MenuButton('cat_subs', category_key, label='📝 Управление подкатегориями',
+                                 style=discord.ButtonStyle.secondary))
+        self.add_item(MenuButton('cat_del', category_key, label='🗑️ Удалить категорию',
+                                 style=discord.ButtonStyle.danger))
+
+async def delete_category(interaction: discord.Interaction, category_key: str):
+    category_name = categories_data[category_key]['name']
+    del categories_data[category_key]
+    record_category_deleted(category_key)
+
+    await interaction.response.send_message(
+        f"✅ **Категория удалена!**\n"
+        f"🗑️ {category_name}",
+        ephemeral=True
+    )
+
+async def show_subcategories_management(interaction: discord.Interaction, category_key: str):
+    """Показывает меню управления подкатегориями"""
+    embed, _ = menu_cache.get('subcategories_management', category_key, render_subcategories_management)
+    view = menu_cache.get('subcategories_management_view', category_key, SubcategoriesManagementMenu)
+    await send_menu(interaction, embed, view)
+
+class SubcategoriesManagementMenu(MenuView):
+    """Меню управления подкатегориями"""
+    def __init__(self, category_key: str):
+        super().__init__()
+        _, buttons = menu_cache.get('subcategories_management', category_key, render_subcategories_management)
+        for key, label in buttons:
+            self.add_item(MenuButton('sub_open', category_key, key, label=label, style=discord.ButtonStyle.primary))
+        self.add_item(MenuButton('sub_add', category_key, label='➕ Добавить подкатегорию',
+                                 style=discord.ButtonStyle.success))
+        self.add_item(MenuButton('back_cats', label='↩️ Назад к категориям', style=discord.ButtonStyle.secondary))
 
 async def show_subcategory_management(interaction: discord.Interaction, category_key: str, sub_key: str):
     """Показывает меню управления конкретной подкатегорией"""
@@ -513,45 +2167,87 @@ async def show_subcategory_management(interaction: discord.Interaction, category
     if subcat['message']:
         embed.add_field(name="Сообщение", value=subcat['message'], inline=True)
 
-    view = SubcategoryManagementMenu(category_key, sub_key)
-    await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
+    await send_menu(interaction, embed, SubcategoryManagementMenu(category_key, sub_key))
 
-class SubcategoryManagementMenu(discord.ui.View):
+class SubcategoryManagementMenu(MenuView):
     """Меню управления конкретной подкатегорией"""
     def __init__(self, category_key: str, sub_key: str):
-        super().__init__(timeout=180)
-        self.category_key = category_key
-        self.sub_key = sub_key
-
-    @discord.ui.button(label='✏️ Редактировать', style=discord.ButtonStyle.primary)
-    async def edit(self, interaction: discord.Interaction, button: discord.ui.Button):
-        modal = EditSubcategoryModal(self.category_key, self.sub_key)
-        await interaction.response.send_modal(modal)
-
-    @discord.ui.button(label='🗑️ Удалить', style=discord.ButtonStyle.danger)
-    async def delete(self, interaction: discord.Interaction, button: discord.ui.Button):
-        category = categories_data[self.category_key]
-        subcat_name = category['subcategories'][self.sub_key]['name']
-
-        if len(category['subcategories']) <= 1:
-            await interaction.response.send_message(
-                "❌ Нельзя удалить последнюю подкатегорию в категории!",
-                ephemeral=True
-            )
-            return
+        super().__init__()
+        self.add_item(MenuButton('sub_edit', category_key, sub_key, label='✏️ Редактировать',
+                                 style=discord.ButtonStyle.primary))
+        self.add_item(MenuButton('sub_del', category_key, sub_key, label='🗑️ Удалить',
+                                 style=discord.ButtonStyle.danger))
+        self.add_item(MenuButton('back_subs', category_key, label='↩️ Назад', style=discord.ButtonStyle.secondary))
 
-        del category['subcategories'][self.sub_key]
-        save_data()
+async def delete_subcategory(interaction: discord.Interaction, category_key: str, sub_key: str):
+    category = categories_data[category_key]
+    subcat_name = category['subcategories'][sub_key]['name']
 
+    if len(category['subcategories']) <= 1:
         await interaction.response.send_message(
-            f"✅ **Подкатегория удалена!**\n"
-            f"🗑️ {subcat_name}",
+            "❌ Нельзя удалить последнюю подкатегорию в категории!",
             ephemeral=True
         )
+        return
+
+    del category['subcategories'][sub_key]
+    record_category_changed(category_key)
+
+    await interaction.response.send_message(
+        f"✅ **Подкатегория удалена!**\n"
+        f"🗑️ {subcat_name}",
+        ephemeral=True
+    )
+
+# ============================================================================
+# ОБРАБОТКА НАЖАТИЙ НА КНОПКИ МЕНЮ
+# ============================================================================
 
-    @discord.ui.button(label='↩️ Назад', style=discord.ButtonStyle.secondary)
-    async def back(self, interaction: discord.Interaction, button: discord.ui.Button):
-        await show_subcategories_management(interaction, self.category_key)
+# действие -> (обработчик, нужна категория, нужна подкатегория, только для админов)
+MENU_ACTIONS = {
+    'cat': (lambda i, c, s: show_subcategories(i, c), True, False, False),
+    'sub': (handle_subcategory, True, True, False),
+    'admin': (lambda i, c, s: show_admin_categories(i), False, False, True),
+    'cat_open': (lambda i, c, s: show_category_management(i, c), True, False, True),
+    'cat_add': (lambda i, c, s: i.response.send_modal(AddCategoryModal()), False, False, True),
+    'cat_edit': (lambda i, c, s: i.response.send_modal(EditCategoryModal(c)), True, False, True),
+    'cat_subs': (lambda i, c, s: show_subcategories_management(i, c), True, False, True),
+    'cat_del': (lambda i, c, s: delete_category(i, c), True, False, True),
+    'sub_open': (show_subcategory_management, True, True, True),
+    'sub_add': (lambda i, c, s: i.response.send_modal(AddSubcategoryModal(c)), True, False, True),
+    'sub_edit': (lambda i, c, s: i.response.send_modal(EditSubcategoryModal(c, s)), True, True, True),
+    'sub_del': (delete_subcategory, True, True, True),
+    'back_cats': (lambda i, c, s: show_admin_categories(i), False, False, True),
+    'back_subs': (lambda i, c, s: show_subcategories_management(i, c), True, False, True),
+}
+
+async def dispatch_menu_action(interaction: discord.Interaction, action: str, category_key: str, sub_key: str):
+    """Единая точка обработки нажатий на кнопки всех меню категорий"""
+    began = time.perf_counter()
+    try:
+        await run_menu_action(interaction, action, category_key, sub_key)
+    finally:
+        HANDLER_LATENCY.observe(time.perf_counter() - began, f"menu:{action}")
+
+async def run_menu_action(interaction: discord.Interaction, action: str, category_key: str, sub_key: str):
+    entry = MENU_ACTIONS.get(action)
+    if entry is None:
+        await interaction.response.send_message('❌ Это меню устарело, откройте его заново.', ephemeral=True)
+        return
+    handler, needs_category, needs_subcategory, admin_only = entry
+
+    # Кнопка могла остаться от старого сообщения, поэтому права проверяются на каждое нажатие
+    if admin_only and not is_admin(interaction.user):
+        await interaction.response.send_message('❌ Недостаточно прав! Только для администраторов.', ephemeral=True)
+        return
+    if needs_category and category_key not in categories_data:
+        await interaction.response.send_message('❌ Категория не найдена!', ephemeral=True)
+        return
+    if needs_subcategory and sub_key not in categories_data[category_key]['subcategories']:
+        await interaction.response.send_message('❌ Подкатегория не найдена!', ephemeral=True)
+        return
+
+    await handler(interaction, category_key, sub_key)
 
 # ============================================================================
 # МОДАЛЬНЫЕ ОКНА ДЛЯ АДМИНИСТРАТИВНЫХ ФУНКЦИЙ
@@ -565,9 +2261,9 @@ class AddCategoryModal(discord.ui.Modal, title='Создание новой ка
         max_length=50
     )
 
+    @timed('AddCategoryModal.on_submit')
     async def on_submit(self, interaction: discord.Interaction):
         try:
-            import re
             key_base = re.sub(r'[^a-zA-Z0-9_]', '', self.name_input.value.lower().replace(' ', '_'))
             key = key_base
 
@@ -588,7 +2284,7 @@ class AddCategoryModal(discord.ui.Modal, title='Создание новой ка
                 }
             }
 
-            save_data()
+            record_category_changed(key)
 
             await interaction.response.send_message(
                 f"✅ **Новая категория создана!**\n"
@@ -616,10 +2312,11 @@ class EditCategoryModal(discord.ui.Modal, title='Редактирование к
         )
         self.add_item(self.name_input)
 
+    @timed('EditCategoryModal.on_submit')
     async def on_submit(self, interaction: discord.Interaction):
         try:
             categories_data[self.category_key]['name'] = self.name_input.value
-            save_data()
+            record_category_changed(self.category_key)
 
             await interaction.response.send_message(
                 f"✅ **Категория обновлена!**\n"
@@ -652,6 +2349,7 @@ class AddSubcategoryModal(discord.ui.Modal, title='Добавление подк
         max_length=10
     )
 
+    @timed('AddSubcategoryModal.on_submit')
     async def on_submit(self, interaction: discord.Interaction):
         try:
             category = categories_data[self.category_key]
@@ -661,7 +2359,6 @@ class AddSubcategoryModal(discord.ui.Modal, title='Добавление подк
                 await interaction.response.send_message('❌ Тип должен быть "custom" или "fixed"!', ephemeral=True)
                 return
 
-            import re
             key_base = re.sub(r'[^a-zA-Z0-9_]', '', self.name_input.value.lower().replace(' ', '_'))
             key = key_base
 
@@ -674,18 +2371,19 @@ class AddSubcategoryModal(discord.ui.Modal, title='Добавление подк
                 'name': self.name_input.value,
                 'type': subcat_type,
                 'time': None,
+                'duration_seconds': None,
                 'message': None
             }
 
             if subcat_type == 'fixed':
                 category['subcategories'][key] = new_subcat
-                save_data()
+                record_category_changed(self.category_key)
                 
                 modal = FixedTimerSetupModal(self.category_key, key, new_subcat)
                 await interaction.response.send_modal(modal)
             else:
                 category['subcategories'][key] = new_subcat
-                save_data()
+                record_category_changed(self.category_key)
 
                 await interaction.response.send_message(
                     f"✅ **Новая подкатегория добавлена!**\n"
@@ -716,32 +2414,24 @@ class EditSubcategoryModal(discord.ui.Modal, title='Редактирование
         self.add_item(self.name_input)
 
         if subcat['type'] == 'fixed':
-            time_str = subcat['time'] or '0д 0ч 0м'
-            time_parts = {'д': '0', 'ч': '0', 'м': '0'}
-            current_num = ''
-
-            for char in time_str:
-                if char.isdigit():
-                    current_num += char
-                elif char in time_parts and current_num:
-                    time_parts[char] = current_num
-                    current_num = ''
+            days, rest = divmod(subcat.get('duration_seconds') or 0, 86400)
+            hours, rest = divmod(rest, 3600)
 
             self.days_input = discord.ui.TextInput(
                 label='Дни (для fixed)',
-                default=time_parts['д'],
+                default=str(days),
                 required=True,
                 max_length=3
             )
             self.hours_input = discord.ui.TextInput(
                 label='Часы (для fixed)',
-                default=time_parts['ч'],
+                default=str(hours),
                 required=True,
                 max_length=2
             )
             self.minutes_input = discord.ui.TextInput(
                 label='Минуты (для fixed)',
-                default=time_parts['м'],
+                default=str(rest // 60),
                 required=True,
                 max_length=2
             )
@@ -757,13 +2447,12 @@ class EditSubcategoryModal(discord.ui.Modal, title='Редактирование
             self.add_item(self.minutes_input)
             self.add_item(self.message_input)
 
+    @timed('EditSubcategoryModal.on_submit')
     async def on_submit(self, interaction: discord.Interaction):
         try:
             category = categories_data[self.category_key]
             subcat = category['subcategories'][self.sub_key]
 
-            subcat['name'] = self.name_input.value
-
             if subcat['type'] == 'fixed':
                 days = int(self.days_input.value)
                 hours = int(self.hours_input.value)
@@ -781,10 +2470,12 @@ class EditSubcategoryModal(discord.ui.Modal, title='Редактирование
                     await interaction.response.send_message('❌ Минуты не могут быть больше 59!', ephemeral=True)
                     return
 
-                subcat['time'] = f"{days}д {hours}ч {minutes}м"
+                set_fixed_duration(subcat, days, hours, minutes)
                 subcat['message'] = self.message_input.value
 
-            save_data()
+            # Имя меняется только после проверки, чтобы не оставить правку без записи
+            subcat['name'] = self.name_input.value
+            record_category_changed(self.category_key)
 
             await interaction.response.send_message(
                 f"✅ **Подкатегория обновлена!**\n"
@@ -835,6 +2526,7 @@ class FixedTimerSetupModal(discord.ui.Modal, title='Настройка Fixed т
         max_length=100
     )
 
+    @timed('FixedTimerSetupModal.on_submit')
     async def on_submit(self, interaction: discord.Interaction):
         try:
             days = int(self.days_input.value)
@@ -854,12 +2546,12 @@ class FixedTimerSetupModal(discord.ui.Modal, title='Настройка Fixed т
                 await interaction.response.send_message('❌ Минуты не могут быть больше 59!', ephemeral=True)
                 return
 
-            self.subcat_data['time'] = f"{days}д {hours}ч {minutes}м"
+            set_fixed_duration(self.subcat_data, days, hours, minutes)
             self.subcat_data['message'] = message
 
             category = categories_data[self.category_key]
             category['subcategories'][self.sub_key] = self.subcat_data
-            save_data()
+            record_category_changed(self.category_key)
 
             await interaction.response.send_message(
                 f"✅ **Fixed-таймер настроен!**\n"
@@ -915,6 +2607,7 @@ class CustomTimerModal(discord.ui.Modal, title='Настраиваемый та
         max_length=100
     )
 
+    @timed('CustomTimerModal.on_submit')
     async def on_submit(self, interaction: discord.Interaction):
         try:
             days = int(self.days_input.value)
@@ -940,24 +2633,27 @@ class CustomTimerModal(discord.ui.Modal, title='Настраиваемый та
                 await interaction.response.send_message('❌ Время не может быть нулевым!', ephemeral=True)
                 return
 
-            end_time = datetime.now() + timedelta(seconds=total_seconds)
-
             category = categories_data[self.category_key]
             subcategory = category['subcategories'][self.sub_key]
 
-            reminder_id = f"{interaction.user.id}_{datetime.now().timestamp()}"
-            reminders[reminder_id] = {
-                'message': message,
-                'end_time': end_time.isoformat(),
-                'user_id': interaction.user.id,
-                'category': f"{category['name']} - {subcategory['name']}"
-            }
-
-            save_data()
+            reminder = Reminder(
+                interaction.user.id, math.ceil(time.time() + total_seconds),
+                self.category_key, self.sub_key, message
+            )
+            end_time = reminder.end_time
+
+            await defer_for_handoff(interaction, interaction.user.id)
+            try:
+                await schedule_reminder(reminder)
+            except CLUSTER_ERRORS as e:
+                print(f"❌ Не удалось передать напоминание владельцу: {e}")
+                await reply(interaction, CLUSTER_UNAVAILABLE, ephemeral=True)
+                return
 
             time_str = format_time(total_seconds)
 
-            await interaction.response.send_message(
+            await reply(
+                interaction,
                 f"✅ **Настраиваемый таймер установлен!**\n"
                 f"📁 **Категория:** {category['name']} - {subcategory['name']}\n"
                 f"⏰ **Через:** {time_str} ({days}д {hours}ч {minutes}м)\n"
@@ -969,7 +2665,7 @@ class CustomTimerModal(discord.ui.Modal, title='Настраиваемый та
         except ValueError:
             await interaction.response.send_message('❌ Ошибка! Введите корректные числовые значения.', ephemeral=True)
         except Exception as e:
-            await interaction.response.send_message('❌ Произошла ошибка при установке таймера!', ephemeral=True)
+            await reply(interaction, '❌ Произошла ошибка при установке таймера!', ephemeral=True)
 
 # ============================================================================
 # КОМАНДЫ БОТА
@@ -977,26 +2673,42 @@ class CustomTimerModal(discord.ui.Modal, title='Настраиваемый та
 
 @bot.event
 async def on_ready():
+    # Приходит и после каждого полного переподключения: здесь только лог,
+    # данные и планировщик поднимает setup_hook
     print('═' * 50)
-    print(f'✅ Бот {bot.user.name if bot.user else "Discord Bot"} запущен!')
+    print(f'✅ Бот {bot.user.name if bot.user else "Discord Bot"} подключён к gateway!')
     if bot.user:
         print(f'🆔 ID: {bot.user.id}')
     print(f'🌐 Серверов: {len(bot.guilds)}')
     print('═' * 50)
 
-    activity = discord.Activity(
-        type=discord.ActivityType.listening,
-        name="/старт - Умные напоминания"
-    )
-    await bot.change_presence(activity=activity)
+def command_tree_hash(tree):
+    """Хэш определений слэш-команд в том виде, в каком они уходят в Discord"""
+    payload = [command.to_dict(tree) for command in tree.get_commands()]
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
 
-    load_data()
-    init_default_categories()
-    check_reminders.start()
-    self_ping.start()
+async def sync_command_tree(tree):
+    """Синхронизирует слэш-команды с Discord, только если их определения изменились"""
+    digest = command_tree_hash(tree)
+    try:
+        with open(COMMAND_TREE_HASH_FILE, 'r', encoding='utf-8') as f:
+            if f.read().strip() == digest:
+                print("✅ Слэш-команды не изменились, синхронизация не нужна")
+                return
+    except OSError:
+        pass
+    try:
+        synced = await tree.sync()
+    except discord.HTTPException as e:
+        print(f"❌ Не удалось синхронизировать слэш-команды: {e}")
+        return
+    with open(COMMAND_TREE_HASH_FILE, 'w', encoding='utf-8') as f:
+        f.write(digest)
+    print(f"🔄 Синхронизировано слэш-команд: {len(synced)}")
 
-@bot.command()
-async def старт(ctx):
+@bot.tree.command(name='старт', description='Открыть главное меню напоминаний')
+@timed('старт')
+async def старт(interaction: discord.Interaction):
     embed = discord.Embed(
         title='🤖 Умная система напоминаний',
         description=(
@@ -1020,45 +2732,132 @@ async def старт(ctx):
 
     embed.set_footer(text='Выберите категорию ниже • Меню закроется через 3 минуты')
 
-    message = await ctx.send(embed=embed, view=StartMenu())
+    view = menu_cache.get('start_view', None, lambda _: StartMenu())
+    await interaction.response.send_message(embed=embed, view=view, delete_after=180)
+
+REMINDERS_PAGE_SIZE = 25  # лимит полей в embed
+
+def get_user_reminders(user_id):
+    """Активные напоминания пользователя в памяти, отсортированные по сроку; O(k log k)"""
+    now = time.time()
+    user_reminders = [
+        reminders[reminder_id] for reminder_id in user_index.get(user_id, ())
+    ]
+    # Сработавшие, но ещё не доставленные напоминания не показываются
+    user_reminders = [reminder for reminder in user_reminders if reminder.end_ts > now]
+    user_reminders.sort(key=lambda reminder: reminder.end_ts)
+    return user_reminders
+
+async def local_user_reminders(user_id):
+    """Напоминания пользователя этого процесса.
+
+    В режиме sqlite в памяти только ближайшие, поэтому список читается из базы —
+    в потоке, чтобы большой список или занятая база не держали цикл событий.
+    Ещё не записанные изменения накладываются уже в цикле.
+    """
+    if sqlite_store is None:
+        return get_user_reminders(user_id)
+    now = time.time()
+    # Изменения берутся до запроса: записанные, пока он шёл, иначе не попали бы никуда
+    unflushed = persistence_writer.unflushed()
+    rows = await asyncio.to_thread(sqlite_store.user_reminders, user_id, now)
+    user_reminders = [
+        reminder for _, reminder in with_unflushed(
+            rows, lambda reminder: reminder.user_id == user_id and reminder.end_ts > now, unflushed
+        )
+    ]
+    user_reminders.sort(key=lambda reminder: reminder.end_ts)
+    return user_reminders
 
-    async def delete_message():
-        await asyncio.sleep(180)
-        try:
-            await message.delete()
-        except:
-            pass
+async def fetch_user_reminders(user_id):
+    """Напоминания пользователя из процесса кластера, который ими владеет"""
+    if owns_user(user_id):
+        return await local_user_reminders(user_id)
+    return await cluster_link.user_reminders(user_id)
 
-    asyncio.create_task(delete_message())
+def build_reminders_page(user_reminders, page):
+    """Embed со страницей списка напоминаний"""
+    pages = max(1, -(-len(user_reminders) // REMINDERS_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
 
-@bot.command()
-async def моинапоминания(ctx):
-    user_reminders = {k: v for k, v in reminders.items() 
-                     if v['user_id'] == ctx.author.id}
+    embed = discord.Embed(title='⏰ Ваши напоминания', color=0xffa500)
+    now = time.time()
+    start = page * REMINDERS_PAGE_SIZE
+    for reminder in user_reminders[start:start + REMINDERS_PAGE_SIZE]:
+        time_str = format_time(reminder.end_ts - now)
+        embed.add_field(
+            name=f"📁 {reminder.category}",
+            value=f'⏰ Осталось: {time_str}\n📝 {reminder.message}',
+            inline=False
+        )
 
-    if not user_reminders:
-        await ctx.send('⏰ У вас нет активных напоминаний!', ephemeral=True)
-        return
+    if pages > 1:
+        embed.set_footer(text=f'Страница {page + 1} из {pages} • Всего: {len(user_reminders)}')
+    return embed, page, pages
 
-    embed = discord.Embed(title='⏰ Ваши напоминания', color=0xffa500)
+class RemindersPager(discord.ui.View):
+    """Перелистывание списка напоминаний, если их больше 25"""
+    def __init__(self, user_id: int, page: int, pages: int):
+        super().__init__(timeout=180)
+        self.user_id = user_id
+        self.page = page
+        self.previous_page.disabled = page <= 0
+        self.next_page.disabled = page >= pages - 1
+
+    async def show_page(self, interaction: discord.Interaction, page: int):
+        if interaction.user.id != self.user_id:
+            await interaction.response.send_message('❌ Это не ваш список напоминаний!', ephemeral=True)
+            return
 
-    for reminder_id, reminder_data in user_reminders.items():
-        end_time = datetime.fromisoformat(reminder_data['end_time'])
-        time_left = end_time - datetime.now()
+        remote = not owns_user(self.user_id)
+        if remote:
+            await interaction.response.defer()
+        try:
+            user_reminders = await fetch_user_reminders(self.user_id)
+        except CLUSTER_ERRORS as e:
+            print(f"❌ Не удалось получить напоминания у владельца: {e}")
+            await reply(interaction, CLUSTER_UNAVAILABLE, ephemeral=True)
+            return
+        embed, self.page, pages = build_reminders_page(user_reminders, page)
+        self.previous_page.disabled = self.page <= 0
+        self.next_page.disabled = self.page >= pages - 1
+        if remote:
+            await interaction.edit_original_response(embed=embed, view=self)
+        else:
+            await interaction.response.edit_message(embed=embed, view=self)
 
-        if time_left.total_seconds() > 0:
-            time_str = format_time(time_left.total_seconds())
+    @discord.ui.button(label='◀️ Назад', style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.show_page(interaction, self.page - 1)
 
-            embed.add_field(
-                name=f"📁 {reminder_data['category']}",
-                value=f'⏰ Осталось: {time_str}\n📝 {reminder_data["message"]}',
-                inline=False
-            )
+    @discord.ui.button(label='Вперёд ▶️', style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.show_page(interaction, self.page + 1)
+
+@bot.tree.command(name='моинапоминания', description='Показать активные напоминания')
+@timed('моинапоминания')
+async def моинапоминания(interaction: discord.Interaction):
+    await defer_for_handoff(interaction, interaction.user.id)
+    try:
+        user_reminders = await fetch_user_reminders(interaction.user.id)
+    except CLUSTER_ERRORS as e:
+        print(f"❌ Не удалось получить напоминания у владельца: {e}")
+        await reply(interaction, CLUSTER_UNAVAILABLE, ephemeral=True)
+        return
+
+    if not user_reminders:
+        await reply(interaction, '⏰ У вас нет активных напоминаний!', ephemeral=True)
+        return
 
-    await ctx.send(embed=embed, ephemeral=True)
+    embed, page, pages = build_reminders_page(user_reminders, 0)
+    if pages > 1:
+        await reply(interaction, embed=embed, view=RemindersPager(interaction.user.id, page, pages), ephemeral=True)
+    else:
+        await reply(interaction, embed=embed, ephemeral=True)
 
-@bot.command()
-async def помощь(ctx):
+@bot.tree.command(name='помощь', description='Справка по боту напоминаний')
+@timed('помощь')
+async def помощь(interaction: discord.Interaction):
     embed = discord.Embed(
         title='📖 Помощь по боту напоминаний',
         description=(
@@ -1076,7 +2875,9 @@ async def помощь(ctx):
             '• **🏁 Задания клуба** - Клубные активности\n\n'
 
             '**⚙️ Для администраторов:**\n'
-            'Доступно управление категориями через кнопку "Управление" в главном меню\n\n'
+            'Доступно управление категориями через кнопку "Управление" в главном меню\n'
+            '`/недоставленные` - Напоминания, которые не удалось доставить\n'
+            '`/экспорт` и `/импорт` - Перенос напоминаний и категорий файлом NDJSON\n\n'
 
             '**💡 Особенности:**\n'
             '• Автоматическая отправка напоминаний в ЛС\n'
@@ -1087,50 +2888,758 @@ async def помощь(ctx):
         color=0x9370DB
     )
 
-    await ctx.send(embed=embed)
+    await interaction.response.send_message(embed=embed)
+
+DEAD_LETTERS_SHOWN = 10
+
+@bot.tree.command(name='недоставленные', description='Напоминания, которые не удалось доставить (для администраторов)')
+@timed('недоставленные')
+async def недоставленные(interaction: discord.Interaction):
+    if not is_admin(interaction.user):
+        await interaction.response.send_message('❌ Недостаточно прав! Только для администраторов.', ephemeral=True)
+        return
+
+    embed = discord.Embed(
+        title=f'📭 Недоставленные напоминания ({dead_letters.total})',
+        description=(
+            f'🔁 Ждут повторной доставки: {len(delivery_pipeline.attempts)}\n'
+            f'✅ Доставлено с повторной попытки: {DELIVERED_AFTER_RETRY.values[None]}'
+        ),
+        color=0xff4500
+    )
+    for entry in reversed(list(dead_letters.entries)[-DEAD_LETTERS_SHOWN:]):
+        reminder = entry['reminder']
+        embed.add_field(
+            name=f"👤 {reminder['user_id']} • {reminder['category']}",
+            value=(
+                f"💬 {reminder['message']}\n"
+                f"❌ {entry['error'][:200]}\n"
+                f"🔁 Попыток: {entry['attempts']} • {entry['failed_at']}"
+            ),
+            inline=False
+        )
+    if not dead_letters.entries:
+        embed.add_field(name='✅ Пусто', value='Все напоминания доставлены', inline=False)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+def export_to_temp_file(reminder_filter, categories, items):
+    """Пишет экспорт во временный файл (в потоке); в режиме sqlite читает базу своим соединением.
+
+    Категории и напоминания копируются заранее в цикле событий: он меняет их,
+    пока поток пишет файл.
+    """
+    if items is None:
+        items = SqliteStore(DATABASE_FILE).reminders_between(float('-inf'), float('inf'))
+    handle, path = tempfile.mkstemp(suffix='.ndjson')
+    os.close(handle)
+    lines = write_ndjson_export(path, categories, items, reminder_filter)
+    return path, lines
+
+@bot.tree.command(name='экспорт', description='Выгрузить напоминания и категории в NDJSON (для администраторов)')
+@app_commands.describe(
+    пользователь='Только напоминания этого пользователя',
+    категория='Ключ категории, например таймер или фарм',
+    после='Срок не раньше: ДД.ММ.ГГГГ [ЧЧ:ММ]',
+    до='Срок раньше: ДД.ММ.ГГГГ [ЧЧ:ММ]'
+)
+@timed('экспорт')
+async def экспорт(interaction: discord.Interaction, пользователь: discord.User = None,
+                  категория: str = None, после: str = None, до: str = None):
+    if not is_admin(interaction.user):
+        await interaction.response.send_message('❌ Недостаточно прав! Только для администраторов.', ephemeral=True)
+        return
+    try:
+        reminder_filter = ReminderFilter(
+            пользователь.id if пользователь else None, категория,
+            parse_deadline_bound(после) if после else None,
+            parse_deadline_bound(до) if до else None
+        )
+    except ValueError as e:
+        await interaction.response.send_message(f'❌ {e}', ephemeral=True)
+        return
+
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    # В режиме sqlite в памяти только ближайшие напоминания — полный список в базе
+    if PERSISTENCE_MODE == 'sqlite':
+        await persistence_writer.flush()
+    # Тот же набор, что пишет снимок: с напоминаниями в очереди доставки и ждущими повтора
+    items = None if PERSISTENCE_MODE == 'sqlite' else list(persisted_reminders().items())
+    categories = copy.deepcopy(categories_data)
+    path, lines = await asyncio.to_thread(export_to_temp_file, reminder_filter, categories, items)
+    try:
+        size = os.path.getsize(path)
+        if size > interaction.guild.filesize_limit:
+            await interaction.followup.send(
+                f'⚠️ Экспорт занимает {size / 1024 / 1024:.1f} МБ — больше лимита вложений сервера. '
+                f'Остановите бота и выполните `python main.py export ФАЙЛ` на сервере.',
+                ephemeral=True
+            )
+            return
+        await interaction.followup.send(
+            f'📤 Экспортировано строк: {lines}',
+            file=discord.File(path, filename='reminders.ndjson'), ephemeral=True
+        )
+    finally:
+        os.remove(path)
+
+async def import_batch(records, totals):
+    """Применяет пачку записей импорта к работающему боту; повторная запись с тем же id заменяет прежнюю"""
+    for record in records:
+        if record['op'] == 'category':
+            check_imported_category(record['key'], record['data'])
+            categories_data[record['key']] = record['data']
+            cache_subcategory_durations()
+            record_category_changed(record['key'])
+            totals['categories'] += 1
+            continue
+        reminder = Reminder.from_dict(record['reminder'])
+        if owns_user(reminder.user_id):
+            remove_reminder(record['id'])
+            add_reminder(record['id'], reminder)
+            record_reminder_added(record['id'], reminder)
+        else:
+            await cluster_link.add_reminder(record['id'], reminder)
+        totals['reminders'] += 1
+
+@bot.tree.command(name='импорт', description='Загрузить напоминания и категории из NDJSON (для администраторов)')
+@app_commands.describe(файл='Файл NDJSON, выгруженный командой /экспорт или python main.py export')
+@timed('импорт')
+async def импорт(interaction: discord.Interaction, файл: discord.Attachment):
+    if not is_admin(interaction.user):
+        await interaction.response.send_message('❌ Недостаточно прав! Только для администраторов.', ephemeral=True)
+        return
+
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    totals = {'reminders': 0, 'categories': 0}
+    error = None
+    try:
+        # Вложение читается по строкам, в памяти не больше одной пачки
+        async with aiohttp.ClientSession() as session:
+            async with session.get(файл.url) as response:
+                response.raise_for_status()
+                batch = []
+                async for line in response.content:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if record.get('op') not in ('add', 'category'):
+                        raise ValueError(f"неизвестная запись {record.get('op')!r}")
+                    batch.append(record)
+                    if len(batch) >= NDJSON_BATCH:
+                        await import_batch(batch, totals)
+                        batch = []
+                        # Пачка применена — даём поработать доставке и другим командам
+                        await asyncio.sleep(0)
+                await import_batch(batch, totals)
+    except CLUSTER_ERRORS + (ValueError, KeyError) as e:
+        error = e
+
+    summary = f"напоминаний: {totals['reminders']}, категорий: {totals['categories']}"
+    if error is not None:
+        await interaction.followup.send(
+            f'❌ Импорт остановлен: {error}\nДо ошибки применено {summary}. '
+            f'Повторный импорт того же файла безопасен.',
+            ephemeral=True
+        )
+        return
+    print(f"📥 Импорт от {interaction.user}: {summary}")
+    await interaction.followup.send(f'✅ Импортировано {summary}', ephemeral=True)
 
 # ============================================================================
-# ФОНОВАЯ ПРОВЕРКА НАПОМИНАНИЙ
+# ДОСТАВКА НАПОМИНАНИЙ
 # ============================================================================
 
-@tasks.loop(seconds=10)
-async def check_reminders():
-    now = datetime.now()
-    reminders_to_remove = []
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity за раз"""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_idle(self):
+        now = time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+    def pause(self, seconds):
+        """Блокирует ведро на время retry_after из ответа 429"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class DMChannelCache:
+    """LRU-кэш открытых личных каналов с вытеснением по TTL.
+
+    Порядок поиска: кэш пользователей шлюза (bot.get_user), затем этот кэш,
+    и только потом API. Канал из кэша позволяет отправить напоминание одним
+    HTTP-запросом вместо fetch_user и отправки.
+    """
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self.gateway_hits = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        user = bot.get_user(user_id)
+        if user is not None and user.dm_channel is not None:
+            self.gateway_hits += 1
+            return user.dm_channel
+
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            channel, expires_at = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return channel
+            del self._entries[user_id]
+        self.misses += 1
+        return None
+
+    def put(self, user_id, channel):
+        self._entries[user_id] = (channel, time.monotonic() + self.ttl)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        self._entries.pop(user_id, None)
+
+dm_channel_cache = DMChannelCache(DM_CACHE_SIZE, DM_CACHE_TTL)
+
+def lateness_note(reminder):
+    """Пометка для напоминания, доставленного заметно позже срока"""
+    late = time.time() - reminder.end_ts
+    if late < LATE_MARK_SECONDS:
+        return ''
+    return f"\n⌛ С опозданием на {format_time(late)}"
+
+def format_reminder_message(reminder):
+    return (
+        f"⏰ **НАПОМИНАНИЕ**\n"
+        f"📁 {reminder.category}\n"
+        f"💬 {reminder.message}"
+        f"{lateness_note(reminder)}"
+    )
 
-    for reminder_id, reminder_data in reminders.items():
-        if 'end_time' in reminder_data:
-            end_time = datetime.fromisoformat(reminder_data['end_time'])
+DIGEST_MAX_FIELDS = 25  # Лимит полей в одном эмбеде Discord
 
-            if now >= end_time:
+def build_reminders_digest(reminders_batch):
+    """Один эмбед со всеми напоминаниями пачки (не больше DIGEST_MAX_FIELDS)"""
+    embed = discord.Embed(
+        title=f"⏰ Напоминания ({len(reminders_batch)})",
+        color=0xffa500
+    )
+    for reminder in reminders_batch:
+        embed.add_field(name=f"📁 {reminder.category}", value=f"💬 {reminder.message}{lateness_note(reminder)}",
+                        inline=False)
+    return embed
+
+def retry_after_from(error):
+    """Время ожидания из ответа 429 и признак глобального лимита"""
+    if isinstance(error, discord.RateLimited):
+        return error.retry_after, False
+    headers = getattr(error.response, 'headers', {}) or {}
+    retry_after = float(headers.get('Retry-After', 1))
+    is_global = headers.get('X-RateLimit-Global', '').lower() == 'true' or \
+        headers.get('X-RateLimit-Scope') == 'global'
+    return retry_after, is_global
+
+def is_permanent_failure(error):
+    """Ошибки, которые повтор не исправит: ЛС закрыты или пользователя больше нет"""
+    if isinstance(error, discord.Forbidden):
+        return True
+    return isinstance(error, discord.NotFound) and error.code == 10013  # Unknown User
+
+def retry_delay(attempts):
+    """Экспоненциальная задержка перед повтором со случайной половиной против одновременных повторов"""
+    delay = min(DELIVERY_RETRY_MAX, DELIVERY_RETRY_BASE * 2 ** (attempts - 1))
+    return random.uniform(delay / 2, delay)
+
+class DeadLetterStore:
+    """Недоставленные напоминания: строки JSON в DEAD_LETTERS_FILE, последние — в памяти"""
+    def __init__(self, path, kept):
+        self.path = path
+        self.entries = collections.deque(maxlen=kept)
+        self.total = 0
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
                 try:
-                    user = await bot.fetch_user(reminder_data['user_id'])
-                    await user.send(
-                        f"⏰ **НАПОМИНАНИЕ**\n"
-                        f"📁 {reminder_data['category']}\n"
-                        f"💬 {reminder_data['message']}"
-                    )
-                    reminders_to_remove.append(reminder_id)
-                    print(f"📨 Отправлено напоминание пользователю {user.name}")
-                except Exception as e:
-                    print(f"❌ Ошибка отправки напоминания: {e}")
-                    reminders_to_remove.append(reminder_id)
+                    self.entries.append(json.loads(line))
+                except ValueError:
+                    continue
+                self.total += 1
+
+    def add(self, reminder_id, reminder, error, attempts):
+        entry = {
+            'id': reminder_id, 'reminder': reminder.to_dict(), 'attempts': attempts,
+            'error': f"{type(error).__name__}: {error}", 'failed_at': datetime.now().isoformat(timespec='seconds'),
+        }
+        self.entries.append(entry)
+        self.total += 1
+        DEAD_LETTERS.inc(type(error).__name__)
+        # Редкая короткая запись без fsync: тик и отправители её не ждут
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n')
+        print(f"📭 Напоминание {reminder_id} не доставлено после попыток: {attempts} ({entry['error']})")
+
+dead_letters = DeadLetterStore(DEAD_LETTERS_FILE, DEAD_LETTERS_KEPT)
+
+class DeliveryPipeline:
+    """Очередь доставки с пулом отправителей и учётом лимитов Discord.
+
+    Планировщик только кладёт наступившие напоминания в очередь пачками одного
+    пользователя; отправка идёт параллельно в DELIVERY_WORKERS задачах через общее
+    ведро токенов и ведро на каждый личный канал. Ответ 429 приостанавливает
+    соответствующее ведро.
+
+    Временная ошибка возвращает недоставленные напоминания пачки в планировщик
+    с экспоненциальной задержкой; ошибка, которую повтор не исправит, и
+    исчерпанные попытки отправляют их в недоставленные (dead_letters).
+    """
+    MAX_RATE_LIMIT_RETRIES = 5
+
+    def __init__(self, workers, global_rate):
+        self.workers = workers
+        self.queue = asyncio.Queue()
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.route_buckets = {}
+        self._tasks = []
+        self.delivered = 0
+        self.failed = 0
+        self.rate_limited = 0
+        self.reminders_fired = 0
+        self.dms_sent = 0
+        self.attempts = {}  # id напоминания -> неудачных попыток, пока оно ждёт повтора
+        self._pending_deadlines = {}  # id пачки -> самый ранний срок в ней
+        # Снятые с хранилища, но ещё не доставленные: снимок пишет их вместе с хранилищем
+        self.pending = {}
+        self._on_done = {}  # id пачки -> вызов после доставки или снятия с доставки
+
+    def submit(self, batch, on_done=None):
+        """Ставит в очередь пачку [(reminder_id, reminder), ...] одного пользователя"""
+        self.reminders_fired += len(batch)
+        self.pending.update(batch)
+        if on_done is not None:
+            self._on_done[id(batch)] = on_done
+        self._pending_deadlines[id(batch)] = min(reminder.end_ts for _, reminder in batch)
+        self.queue.put_nowait(batch)
+
+    def oldest_overdue(self, now):
+        """Сколько секунд ждёт самое старое наступившее напоминание в очереди или в отправке"""
+        if not self._pending_deadlines:
+            return 0.0
+        return max(0.0, now - min(self._pending_deadlines.values()))
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def _route_bucket(self, user_id):
+        bucket = self.route_buckets.get(user_id)
+        if bucket is None:
+            if len(self.route_buckets) > 10000:
+                self.route_buckets = {
+                    key: value for key, value in self.route_buckets.items() if not value.is_idle()
+                }
+            bucket = self.route_buckets[user_id] = TokenBucket(DELIVERY_ROUTE_RATE, DELIVERY_ROUTE_BURST)
+        return bucket
+
+    async def _worker(self):
+        while True:
+            batch = await self.queue.get()
+            sent = set()
+            try:
+                await self.deliver(batch, sent)
+                finished = [reminder_id for reminder_id, _ in batch]
+            except Exception as e:
+                DELIVERY_FAILURES.inc(type(e).__name__)
+                print(f"❌ Ошибка отправки напоминания: {e}")
+                finished = list(sent) + self._fail([item for item in batch if item[0] not in sent], e)
+            finally:
+                self._pending_deadlines.pop(id(batch), None)
+                self.queue.task_done()
+                on_done = self._on_done.pop(id(batch), None)
+                if on_done is not None:
+                    on_done()
+            # При отмене на остановке бота записи остаются и будут доставлены после запуска
+            for reminder_id, _ in batch:
+                self.pending.pop(reminder_id, None)
+            record_reminders_removed(finished)
+
+    def _fail(self, failed, error):
+        """Повтор или недоставленные для напоминаний пачки, которые не ушли; возвращает снятые с доставки"""
+        dropped = []
+        for reminder_id, reminder in failed:
+            attempts = self.attempts.pop(reminder_id, 0) + 1
+            if is_permanent_failure(error) or attempts >= DELIVERY_MAX_ATTEMPTS:
+                self.failed += 1
+                dead_letters.add(reminder_id, reminder, error, attempts)
+                dropped.append(reminder_id)
+            else:
+                # Запись остаётся в хранилище: после перезапуска её доставит догоняющая доставка
+                self.attempts[reminder_id] = attempts
+                DELIVERY_RETRIES.inc()
+                requeue_reminder(reminder_id, reminder, time.time() + retry_delay(attempts))
+        return dropped
+
+    async def _call(self, route_bucket, request):
+        """Выполняет запрос к API с ожиданием токенов и повтором после 429"""
+        for _ in range(self.MAX_RATE_LIMIT_RETRIES):
+            await route_bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                return await request()
+            except (discord.RateLimited, discord.HTTPException) as e:
+                if isinstance(e, discord.HTTPException) and e.status != 429:
+                    raise
+                self.rate_limited += 1
+                retry_after, is_global = retry_after_from(e)
+                (self.global_bucket if is_global else route_bucket).pause(retry_after)
+        raise RuntimeError('превышено число повторов после ответа 429')
+
+    async def deliver(self, batch, sent):
+        """Отправляет пачку; id отправленных напоминаний добавляются в sent"""
+        user_id = batch[0][1].user_id
+        route_bucket = self._route_bucket(user_id)
+        channel = dm_channel_cache.get(user_id)
+        if channel is None:
+            channel = await self._call(route_bucket, lambda: bot.create_dm(discord.Object(id=user_id)))
+            dm_channel_cache.put(user_id, channel)
+
+        try:
+            if len(batch) == 1:
+                reminder = batch[0][1]
+                await self._send(route_bucket, lambda: channel.send(format_reminder_message(reminder)), batch, sent)
+            else:
+                # Частями по DIGEST_MAX_FIELDS, чтобы уложиться в лимит эмбеда
+                for start in range(0, len(batch), DIGEST_MAX_FIELDS):
+                    part = batch[start:start + DIGEST_MAX_FIELDS]
+                    digest = [reminder for _, reminder in part]
+                    await self._send(route_bucket, lambda: channel.send(embed=build_reminders_digest(digest)),
+                                     part, sent)
+        except discord.NotFound:
+            dm_channel_cache.invalidate(user_id)
+            raise
+        print(f"📨 Отправлено напоминаний: {len(batch)} пользователю {getattr(channel.recipient, 'name', user_id)}")
+
+    async def _send(self, route_bucket, request, part, sent):
+        began = time.perf_counter()
+        await self._call(route_bucket, request)
+        DM_SEND_LATENCY.observe(time.perf_counter() - began)
+        now = time.time()
+        for reminder_id, reminder in part:
+            FIRING_LATENESS.observe(max(0.0, now - reminder.end_ts))
+            if self.attempts.pop(reminder_id, None):
+                DELIVERED_AFTER_RETRY.inc()
+            sent.add(reminder_id)
+        self.delivered += len(part)
+        self.dms_sent += 1
+
+    def dms_per_reminder(self):
+        return self.dms_sent / self.delivered if self.delivered else 0.0
+
+# Глобальный лимит Discord считается на токен, поэтому делится между процессами кластера
+delivery_pipeline = DeliveryPipeline(DELIVERY_WORKERS, DELIVERY_GLOBAL_RATE / CLUSTER_COUNT)
+
+class CatchUpDelivery:
+    """Догоняющая доставка напоминаний, срок которых прошёл, пока бот не работал.
+
+    При запуске все напоминания со сроком раньше запуска снимаются с планировщика
+    и подаются в очередь доставки не быстрее rate в секунду, самые старые первыми.
+    Наступающие вовремя напоминания check_reminders ставит в ту же очередь между
+    ними и не ждут всего хвоста. Пока хвост не передан, записи остаются в
+    хранилище: после остановки они снова попадут в догоняющую доставку.
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self.bucket = TokenBucket(rate, 1)
+        self.backlog = collections.deque()
+        self.total = 0
+        self.drain_seconds = None
+        self._outstanding = 0  # пачек хвоста в очереди доставки и в отправке
+        self._drained = None
+        self._task = None
+
+    def start(self, now):
+        due = reminder_scheduler.pop_due(now)
+        if not due:
+            return
+        due.sort(key=lambda reminder_id: reminders[reminder_id].end_ts)
+        self.backlog.extend(due)
+        self.total = len(due)
+        print(f"⏳ Просрочено за время простоя: {self.total}, догоняющая доставка по {self.rate:g} в секунду")
+        self._drained = asyncio.Event()
+        self._task = asyncio.create_task(self._run(time.monotonic()))
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def oldest_deadline(self):
+        """Срок самого старого напоминания хвоста, ещё не переданного в очередь доставки"""
+        for reminder_id in self.backlog:
+            # Отменённые остаются в хвосте до своей очереди
+            reminder = reminders.get(reminder_id)
+            if reminder is not None:
+                return reminder.end_ts
+        return None
+
+    def _batch_done(self):
+        self._outstanding -= 1
+        if self._outstanding == 0:
+            self._drained.set()
+
+    async def _run(self, began):
+        while self.backlog:
+            await self.bucket.acquire()
+            # Напоминание могли отменить или объединить с соседним, пока оно ждало
+            for batch in collect_due_batches([self.backlog.popleft()], time.time()):
+                self._outstanding += 1
+                delivery_pipeline.submit(batch, self._batch_done)
+        # Ждём только пачки хвоста: очередь может не пустеть из-за текущих напоминаний
+        if self._outstanding:
+            self._drained.clear()
+            await self._drained.wait()
+        self.drain_seconds = time.monotonic() - began
+        print(f"✅ Догоняющая доставка завершена: {self.total} напоминаний за {self.drain_seconds:.1f} с")
+
+catch_up = CatchUpDelivery(CATCHUP_RATE / CLUSTER_COUNT)
+
+def pending_reminders_count():
+    """Все ожидающие напоминания: в планировщике, в доставке и, в режиме sqlite, далёкие из базы"""
+    count = len(reminders) + len(delivery_pipeline.pending)
+    if sqlite_store is not None:
+        count += sqlite_store.beyond_horizon
+    return count
+
+def oldest_overdue(now):
+    """Опоздание самого старого наступившего напоминания: в очереди доставки или в догоняющем хвосте"""
+    overdue = delivery_pipeline.oldest_overdue(now)
+    deadline = catch_up.oldest_deadline()
+    if deadline is not None:
+        overdue = max(overdue, now - deadline)
+    return overdue
 
-    for reminder_id in reminders_to_remove:
-        del reminders[reminder_id]
+# ============================================================================
+# ФОНОВАЯ ПРОВЕРКА НАПОМИНАНИЙ
+# ============================================================================
 
-    if reminders_to_remove:
-        save_data()
+@tasks.loop()
+async def check_reminders():
+    """Ждёт ближайший дедлайн и ставит наступившие напоминания в очередь доставки"""
+    await reminder_scheduler.wait_next()
+    began = time.perf_counter()
+    due = reminder_scheduler.pop_due(time.time())
+
+    # Отправка идёт в очереди доставки, тик не ждёт сети
+    for batch in collect_due_batches(due, time.time()):
+        delivery_pipeline.submit(batch)
+    TICK_DURATION.observe(time.perf_counter() - began)
+
+def collect_due_batches(due, now):
+    """Снимает наступившие напоминания и группирует их в пачки на отправку.
+
+    При DELIVERY_COALESCE_SECONDS > 0 напоминания одного пользователя идут одной
+    пачкой, и к ней присоединяются его напоминания с дедлайном в пределах окна —
+    они приходят чуть раньше срока, но тем же сообщением.
+    """
+    if DELIVERY_COALESCE_SECONDS <= 0:
+        batches = []
+        for reminder_id in due:
+            reminder = remove_reminder(reminder_id)
+            if reminder is not None:
+                batches.append([(reminder_id, reminder)])
+        return batches
+
+    by_user = {}
+    for reminder_id in due:
+        reminder = remove_reminder(reminder_id)
+        if reminder is not None:
+            by_user.setdefault(reminder.user_id, []).append((reminder_id, reminder))
+
+    horizon = now + DELIVERY_COALESCE_SECONDS
+    for user_id, batch in by_user.items():
+        # Ждущие повтора сохраняют прежний срок, но уходят только после своей задержки
+        upcoming = [
+            reminder_id for reminder_id in user_index.get(user_id, ())
+            if reminders[reminder_id].end_ts <= horizon and reminder_id not in delivery_pipeline.attempts
+        ]
+        for reminder_id in upcoming:
+            batch.append((reminder_id, remove_reminder(reminder_id)))
+        batch.sort(key=lambda item: item[1].end_ts)
+    return list(by_user.values())
 
 # ============================================================================
-# ЗАПУСК БОТА
+# КЛАСТЕР ПРОЦЕССОВ
 # ============================================================================
+# Напоминание пользователя живёт только в процессе-владельце (owns_user).
+# Взаимодействие может прийти в любой процесс — например, все ЛС идут через
+# шард 0, — поэтому создание и чтение напоминаний чужих пользователей
+# передаются владельцу через его веб-сервер проверок. Изменения категорий
+# рассылаются всем процессам.
+
+class ClusterLink:
+    """HTTP-связь с остальными процессами кластера"""
+    TIMEOUT = 5
+
+    def __init__(self, peers, secret):
+        self.peers = peers
+        self.secret = secret
+        self.session = None
+        self.handoffs = 0
+        self.remote_reads = 0
+        self.broadcasts = 0
+        self._tasks = set()
+
+    async def _request(self, method, cluster_id, path, payload=None):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.TIMEOUT))
+        async with self.session.request(
+            method, self.peers[cluster_id] + path, json=payload, headers={'X-Cluster-Secret': self.secret}
+        ) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def add_reminder(self, reminder_id, reminder):
+        """Передаёт новое напоминание процессу-владельцу пользователя"""
+        await self._request('POST', cluster_of(reminder.user_id), '/cluster/reminders',
+                            {'id': reminder_id, 'reminder': reminder.to_dict()})
+        self.handoffs += 1
+
+    async def user_reminders(self, user_id):
+        """Список напоминаний пользователя у процесса-владельца"""
+        data = await self._request('GET', cluster_of(user_id), f'/cluster/reminders/{user_id}')
+        self.remote_reads += 1
+        return [Reminder.from_dict(reminder_data) for reminder_data in data]
+
+    def broadcast(self, record):
+        """Рассылает изменение категорий остальным процессам, не дожидаясь ответа"""
+        for cluster_id in range(CLUSTER_COUNT):
+            if cluster_id != CLUSTER_ID:
+                task = asyncio.create_task(self._send_record(cluster_id, record))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _send_record(self, cluster_id, record):
+        try:
+            await self._request('POST', cluster_id, '/cluster/categories', record)
+            self.broadcasts += 1
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"❌ Процесс кластера {cluster_id} не получил изменение категорий: {e}")
+
+    async def close(self):
+        if self._tasks:
+            await asyncio.wait(self._tasks)
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+cluster_link = ClusterLink(CLUSTER_PEERS, CLUSTER_SECRET)
+
+def cluster_authorized(request):
+    return bool(CLUSTER_SECRET) and hmac.compare_digest(request.headers.get('X-Cluster-Secret', ''), CLUSTER_SECRET)
+
+async def cluster_add_reminder(request):
+    if not cluster_authorized(request):
+        return web.json_response({'error': 'forbidden'}, status=403)
+    data = await request.json()
+    reminder = Reminder.from_dict(data['reminder'])
+    if not owns_user(reminder.user_id):
+        return web.json_response({'error': 'not owner'}, status=409)
+    add_reminder(data['id'], reminder)
+    record_reminder_added(data['id'], reminder)
+    return web.json_response({'id': data['id']})
+
+async def cluster_user_reminders(request):
+    if not cluster_authorized(request):
+        return web.json_response({'error': 'forbidden'}, status=403)
+    user_reminders = await local_user_reminders(int(request.match_info['user_id']))
+    return web.json_response([reminder.to_dict() for reminder in user_reminders])
+
+async def cluster_category_changed(request):
+    if not cluster_authorized(request):
+        return web.json_response({'error': 'forbidden'}, status=403)
+    record = await request.json()
+    apply_journal_record(record)
+    menu_cache.bump()
+    record_change(record)
+    return web.json_response({'ok': True})
+
+def run_cluster():
+    """python main.py cluster: запускает процессы кластера и останавливает их вместе"""
+    count = CLUSTER_COUNT if CLUSTER_COUNT > 1 else (os.cpu_count() or 1)
+    env = {
+        **os.environ,
+        'CLUSTER_COUNT': str(count),
+        'SHARD_COUNT': str(SHARD_COUNT or count),
+        'CLUSTER_SECRET': CLUSTER_SECRET or secrets.token_hex(16),
+    }
+    processes = [
+        subprocess.Popen([sys.executable, os.path.abspath(__file__)], env={**env, 'CLUSTER_ID': str(cluster_id)})
+        for cluster_id in range(count)
+    ]
+    print(f"🧩 Запущено процессов кластера: {count}, шардов: {env['SHARD_COUNT']}")
+
+    def stop(*_):
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    # Падение одного процесса останавливает весь кластер: перезапуском занимается платформа
+    while all(process.poll() is None for process in processes):
+        time.sleep(1)
+    stop()
+    for process in processes:
+        process.wait()
+    sys.exit(max(process.returncode for process in processes))
 
-keep_alive()
-print("🌐 Веб-сервер запущен для поддержания работы на Replit")
+# ============================================================================
+# ЗАПУСК БОТА
+# ============================================================================
 
-token = os.getenv('DISCORD_TOKEN')
-if token:
-    bot.run(token)
-else:
-    print("❌ Ошибка: Токен бота не найден в файле .env!")
\ No newline at end of file
+if __name__ == '__main__':
+    token = os.getenv('DISCORD_TOKEN')
+    if sys.argv[1:2] == ['cluster']:
+        run_cluster()
+    elif sys.argv[1:2] in (['export'], ['import']):
+        run_ndjson_cli(sys.argv[1:])
+    elif token:
+        if DISCORD_API_BASE:
+            discord.http.Route.BASE = DISCORD_API_BASE
+        if DISCORD_GATEWAY_URL:
+            discord.gateway.DiscordWebSocket.DEFAULT_GATEWAY = yarl.URL(DISCORD_GATEWAY_URL)
+        bot.run(token)
+    else:
+        print("❌ Ошибка: Токен бота не найден в файле .env!")
\ No newline at end of file